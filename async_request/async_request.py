@@ -0,0 +1,412 @@
+"""
+This script fetches cast and crew details from a Jellyfin server on a single asyncio event loop.
+Requires httpx, install it with `pip install httpx` to use ENGINE=async, HTTP2=true also needs `pip install "httpx[http2]"`.
+"""
+import asyncio
+import collections
+import itertools
+import math
+import threading
+import time
+from concurrency import concurrency
+from fetch_request import fetch_request
+from progress import progress
+from rate_limit import rate_limit
+from retry import retry
+try:
+    import httpx
+except ImportError: # Optional, only the async engine needs it
+    httpx = None
+try:
+    import h2
+except ImportError: # Optional, only HTTP2=true needs it
+    h2 = None
+
+POOL_CONNECTIONS = 4 # HTTP/1.1 connections per pool of PooledTransport
+
+
+class ReleasingStream(httpx.AsyncByteStream if httpx else object):
+    """
+    Response body that tells PooledTransport its pool is free again once the body is closed.
+    """
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+
+    async def aclose(self) -> None:
+        release, self.release = self.release, None # Closing twice must not release twice
+        try:
+            await self.stream.aclose()
+        finally:
+            if release:
+                release()
+
+
+class PooledTransport(httpx.AsyncBaseTransport if httpx else object):
+    """
+    HTTP/1.1 transport spreading its connections over small pools of POOL_CONNECTIONS each.
+    httpcore scans every connection of a pool for every request waiting on it, so a single pool of ASYNC_CONCURRENCY connections
+    gets slower the bigger it is. Every request goes to the pool with the fewest requests in flight instead.
+    """
+    def __init__(self, connections: int, per_pool: int = POOL_CONNECTIONS):
+        """
+        Args:
+            connections (int): Connections in total, the most requests in flight.
+            per_pool (int): Connections per pool.
+        """
+        count = max(1, math.ceil(connections / per_pool))
+        size = math.ceil(connections / count)
+        ssl_context = httpx.create_ssl_context() # Loading the CA bundle once instead of once per pool
+        self.pools = [httpx.AsyncHTTPTransport(verify = ssl_context, limits = httpx.Limits(max_connections = size, max_keepalive_connections = size))
+                      for _ in range(count)]
+        self.busy = [0] * count # Event loop only, no lock needed
+
+
+    async def handle_async_request(self, request):
+        index = min(range(len(self.pools)), key = self.busy.__getitem__)
+        self.busy[index] += 1
+        def release():
+            self.busy[index] -= 1
+        try:
+            response = await self.pools[index].handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(response.status_code, headers = response.headers, stream = ReleasingStream(response.stream, release),
+                              extensions = response.extensions)
+
+
+    async def aclose(self) -> None:
+        for pool in self.pools:
+            await pool.aclose()
+
+
+async def warm_person(client, request_env: dict, person_id: str) -> dict:
+    """
+    Single async warm-up request, retrying is left to the retry scheduler.
+    Sends the WARM_STRATEGY request of fetch_request.get_warm_request() and discards the body as it streams in.
+    Args:
+        client (httpx.AsyncClient): The shared client.
+        request_env (dict): The environment configuration.
+        person_id (str): The crew/cast ID of the person to fetch details for.
+    Returns:
+        dict: The attempt result, see retry.attempt_result().
+    """
+    url, params, read_body, terminal = fetch_request.get_warm_request(request_env, person_id)
+    size = 0
+    try:
+        async with client.stream("GET", url, params = params) as detail_response:
+            if read_body:
+                async for chunk in detail_response.aiter_bytes():
+                    size += len(chunk)
+    except httpx.HTTPError as e:
+        return retry.attempt_result(error = str(e) or type(e).__name__, exception = type(e).__name__)
+    if detail_response.is_success or detail_response.status_code in terminal:
+        return retry.attempt_result(detail_response.status_code, size = size, terminal = detail_response.status_code in terminal)
+    return retry.attempt_result(
+        detail_response.status_code,
+        f"{detail_response.status_code} {detail_response.reason_phrase}",
+        detail_response.headers.get("Retry-After"),
+        size
+    )
+
+
+async def open_client(request_env: dict, max_in_flight: int, transport = None) -> tuple:
+    """
+    Open the shared client. With HTTP2 on, one probe request checks that the server (or its reverse proxy) negotiates HTTP/2,
+    then every request is multiplexed over HTTP2_CONNECTIONS connections instead of one connection per request in flight.
+    Plain http://, a proxy without HTTP/2 or a missing h2 package fall back to HTTP/1.1 with a connection per request in flight,
+    spread over small pools by PooledTransport.
+    Args:
+        request_env (dict): The environment configuration, reads HTTP2 and HTTP2_CONNECTIONS.
+        max_in_flight (int): Requests in flight at most, the size of the HTTP/1.1 pool.
+        transport (httpx.AsyncBaseTransport): Optional transport override, used by tests.
+    Returns:
+        tuple: (httpx.AsyncClient, True if it speaks HTTP/2)
+    """
+    if request_env.get("HTTP2") and h2 is None:
+        print("HTTP2 requires h2, install it with `pip install \"httpx[http2]\"`. Falling back to HTTP/1.1...")
+    elif request_env.get("HTTP2"):
+        connections = request_env.get("HTTP2_CONNECTIONS", 2)
+        limits = httpx.Limits(max_connections = connections, max_keepalive_connections = connections)
+        client = httpx.AsyncClient(http2 = True, limits = limits, timeout = request_env.get("TIMEOUT"), transport = transport)
+        try:
+            response = await client.get(f"{request_env.get('BASE_URL')}/System/Info/Public")
+            if response.http_version == "HTTP/2":
+                return client, True
+            print(f"{request_env.get('BASE_URL')} answered over {response.http_version}, falling back to HTTP/1.1...")
+        except httpx.HTTPError as e:
+            print(f"Error negotiating HTTP/2: {e}. Falling back to HTTP/1.1...")
+        await client.aclose()
+    return httpx.AsyncClient(timeout = request_env.get("TIMEOUT"), transport = transport or PooledTransport(max_in_flight)), False
+
+
+async def execute_requests_async(request_env: dict, ids, transport = None, work = None, run_metrics = None, capacity = None, journal = None,
+                                 engine = None) -> set:
+    """
+    Fetch cast and crew details with up to ASYNC_CONCURRENCY requests in flight on one event loop, as HTTP/2 streams with HTTP2 on.
+    With ADAPTIVE on the controller decides how many requests are in flight, up to ADAPTIVE_MAX.
+    Failed attempts go to the retry scheduler and are started again once their backoff is over.
+    Args:
+        request_env (dict): The environment configuration.
+        ids (iterable): The crew/cast IDs to fetch details for, a set or a generator.
+        transport (httpx.AsyncBaseTransport): Optional transport override, used by tests.
+        work (coroutine function): Single attempt called as work(client, request_env, person_id) for every ID, returning a retry.attempt_result(). Defaults to warm_person.
+        run_metrics (metrics.RunMetrics): Optional, records every attempt and outcome.
+        capacity (concurrency.SharedCapacity): Optional, slots shared with the other targets of the run.
+        journal (journal.Journal): Optional, records every person that is done with.
+        engine (Engine): Optional long lived engine whose client is used and left open, a client is opened for this call otherwise.
+    Returns:
+        set: The IDs that were fetched successfully.
+    Raises:
+        Exception: Whatever a work call raised instead of returning an attempt result, the requests still in flight are cancelled.
+    """
+    controller = concurrency.from_env(request_env)
+    limiter = rate_limit.from_env(request_env)
+    retries = retry.from_env(request_env)
+    max_in_flight = controller.maximum if controller else request_env.get("ASYNC_CONCURRENCY")
+    work = work or warm_person
+    submitted_count = 0
+    completed_count = 0
+    failed_count = 0
+    last_error = None
+    listing = True
+    warmed = set()
+    reporter = progress.from_env(request_env)
+    semaphore = asyncio.Semaphore(max_in_flight)
+    slot_freed = asyncio.Event()
+    tasks = set()
+    errors = [] # Exceptions a work call raised instead of returning an attempt result
+    buffer = collections.deque()
+
+    async def acquire():
+        if controller is None:
+            await semaphore.acquire()
+            return
+        # Single threaded loop, nothing can release between the failed try and clear()
+        while not controller.try_acquire():
+            slot_freed.clear()
+            await slot_freed.wait()
+
+    def report():
+        # Counters only, the reporter's own thread prints them
+        reporter.update(completed_count, submitted_count, listing, len(tasks), failed_count, controller.limit if controller else None,
+                        retries.retried, retries.breaker_open(), last_error)
+
+    def settle(person_id, attempt, result):
+        nonlocal completed_count, failed_count, last_error
+        outcome = retries.settle(person_id, attempt, result)
+        if run_metrics:
+            run_metrics.record_outcome(outcome)
+        if journal:
+            journal.record(person_id, outcome)
+        if outcome == "retry":
+            return
+        if outcome == "ok":
+            warmed.add(person_id)
+        elif outcome == "failed":
+            failed_count += 1
+            last_error = f"{person_id}: {result['error']}"
+        completed_count += 1
+        report()
+
+    async def run(person_id, attempt):
+        if limiter:
+            await limiter.acquire_async()
+        started = time.perf_counter()
+        result = None
+        try:
+            result = await work(client, request_env, person_id)
+        finally:
+            latency = time.perf_counter() - started
+            if controller:
+                controller.release(latency, bool(result and result["ok"]))
+                slot_freed.set()
+            else:
+                semaphore.release()
+            if capacity:
+                capacity.release()
+            if run_metrics and result:
+                run_metrics.record_attempt(latency, result)
+        settle(person_id, attempt, result)
+
+    def finished(task):
+        tasks.discard(task)
+        # Raised again from the loop like the thread engine's future.result(), a person is never dropped silently
+        if not task.cancelled() and task.exception() is not None:
+            errors.append(task.exception())
+
+    async def start(person_id, attempt):
+        # Only create the next task once a slot frees up, thousands of coroutines but never more than concurrency sockets
+        await acquire()
+        if capacity:
+            await capacity.acquire_async()
+        task = asyncio.create_task(run(person_id, attempt))
+        tasks.add(task)
+        task.add_done_callback(finished)
+        report()
+
+    client, http2 = await (engine.client(request_env, max_in_flight) if engine else open_client(request_env, max_in_flight, transport))
+    over = f" over {request_env.get('HTTP2_CONNECTIONS', 2)} HTTP/2 connections" if http2 else ""
+    try: # The probe may have opened the client already, `async with` would refuse it
+        if controller:
+            print(f"Fetching details with {controller.minimum} to {controller.maximum} adaptive concurrent requests{over} and max timeout of {request_env.get('TIMEOUT')} seconds per request...")
+        else:
+            print(f"Fetching details with {max_in_flight} concurrent requests{over} and max timeout of {request_env.get('TIMEOUT')} seconds per request...")
+        iterator = iter(ids)
+        reporter.start()
+        while listing or buffer or tasks or len(retries):
+            if errors:
+                raise errors[0]
+            for person_id, attempt in retries.pop_ready():
+                await start(person_id, attempt)
+
+            if (listing or buffer) and not retries.breaker_open():
+                if not buffer:
+                    # A streaming listing blocks on HTTP, pull it in chunks off the event loop so in-flight requests keep going
+                    buffer.extend(await asyncio.to_thread(list, itertools.islice(iterator, 256)))
+                    listing = bool(buffer)
+                    continue
+                await start(buffer.popleft(), 0)
+                submitted_count += 1
+                continue
+
+            # Nothing fresh to start, wait for a request to finish or the next retry to be due
+            timeout = retries.next_due()
+            if tasks:
+                await asyncio.wait(set(tasks), timeout = timeout, return_when = asyncio.FIRST_COMPLETED)
+            elif timeout is not None:
+                await asyncio.sleep(timeout)
+        if errors:
+            raise errors[0]
+        report()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        reporter.stop()
+        if not engine:
+            await client.aclose()
+    return warmed
+
+
+def execute_requests(request_env: dict, ids, transport = None, work = None, run_metrics = None, capacity = None, journal = None) -> set:
+    """
+    Blocking entry point for the async engine, drop in replacement for warmer.execute_requests().
+    Args:
+        request_env (dict): The environment configuration.
+        ids (iterable): The crew/cast IDs to fetch details for.
+        transport (httpx.AsyncBaseTransport): Optional transport override, used by tests.
+        work (coroutine function): Single attempt called as work(client, request_env, person_id) for every ID, defaults to warm_person.
+        run_metrics (metrics.RunMetrics): Optional, records every attempt and outcome.
+        capacity (concurrency.SharedCapacity): Optional, slots shared with the other targets of the run.
+        journal (journal.Journal): Optional, records every person that is done with.
+    Returns:
+        set: The IDs that were fetched successfully.
+    Raises:
+        RuntimeError: If httpx is not installed.
+    """
+    if httpx is None:
+        raise RuntimeError("ENGINE=async requires httpx, install it with `pip install httpx`.")
+    return asyncio.run(execute_requests_async(request_env, ids, transport, work, run_metrics, capacity, journal))
+
+
+class Engine:
+    """
+    Long lived async engine of a warmer.Warmer: one event loop on its own thread and one client per server, kept open between runs
+    so their keep-alive connections (and the HTTP/2 negotiation) carry over from one warm cycle to the next.
+    Targets warmed at the same time share the loop, each from its own thread.
+    """
+    def __init__(self, sessions = None):
+        """
+        Args:
+            sessions (fetch_request.Sessions): Sessions of the Warmer, bound to the loop so the listing it pulls off the loop uses them.
+        """
+        self.sessions = sessions
+        self.loop = None
+        self.thread = None
+        self.clients = {} # Client settings to the task opening the client, awaited by every run that needs it
+        self.lock = threading.Lock()
+
+
+    def run_loop(self) -> None:
+        """
+        Thread of the event loop, until close().
+        """
+        fetch_request.bind_sessions(self.sessions)
+        self.loop.run_forever()
+
+
+    def client(self, request_env: dict, max_in_flight: int):
+        """
+        Args:
+            request_env (dict): The environment configuration of the run.
+            max_in_flight (int): Requests in flight at most.
+        Returns:
+            asyncio.Task: Resolves to the (httpx.AsyncClient, True if it speaks HTTP/2) of open_client(), opened on first use.
+        """
+        key = (request_env.get("BASE_URL"), request_env.get("TIMEOUT"), request_env.get("HTTP2"), request_env.get("HTTP2_CONNECTIONS", 2), max_in_flight)
+        opening = self.clients.get(key) # Event loop only, no lock needed
+        if opening is None or (opening.done() and (opening.cancelled() or opening.exception())):
+            # The run that opened it first was interrupted, the next one opens it again
+            opening = self.clients[key] = asyncio.ensure_future(open_client(request_env, max_in_flight))
+        return opening
+
+
+    def execute_requests(self, request_env: dict, ids, work = None, run_metrics = None, capacity = None, journal = None) -> set:
+        """
+        Blocking entry point, same as execute_requests() but on the engine's loop and clients.
+        Returns:
+            set: The IDs that were fetched successfully.
+        Raises:
+            RuntimeError: If httpx is not installed.
+        """
+        if httpx is None:
+            raise RuntimeError("ENGINE=async requires httpx, install it with `pip install httpx`.")
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target = self.run_loop, name = "async-engine", daemon = True)
+                self.thread.start()
+        future = asyncio.run_coroutine_threadsafe(
+            execute_requests_async(request_env, ids, work = work, run_metrics = run_metrics, capacity = capacity, journal = journal, engine = self), self.loop
+        )
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel() # Interrupted, stop the run on the loop too
+            raise
+
+
+    async def aclose(self) -> None:
+        """
+        Close every client the engine opened, on its loop.
+        """
+        for opening in self.clients.values():
+            await asyncio.wait([opening])
+            if not opening.cancelled() and not opening.exception(): # Never opened, nothing to close
+                await opening.result()[0].aclose()
+        self.clients.clear()
+
+
+    def close(self) -> None:
+        """
+        Close every client and stop the loop, the engine starts a new one if it is used again.
+        Returns:
+            None
+        """
+        with self.lock:
+            loop, self.loop = self.loop, None
+            thread, self.thread = self.thread, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
@@ -0,0 +1,153 @@
+"""
+This script benchmarks the warming engines and warm-up strategies against the fake Jellyfin server and reports requests/s, tail latency and bytes per request.
+Run it with `python -m bench.bench --persons 5000 --latency 0.02 --jitter 0.5`.
+"""
+import argparse
+import contextlib
+import io
+import json
+from fake_jellyfin import fake_jellyfin
+from fetch_request import fetch_request
+from metrics import metrics
+
+ENGINES = ("thread", "async")
+
+
+def bench_env(base_url: str, args: argparse.Namespace, engine: str, strategy: str = "full") -> dict:
+    """
+    Build the same configuration load_env.load_env() would, pointed at the fake server.
+    Args:
+        base_url (str): The fake server.
+        args (argparse.Namespace): The benchmark arguments.
+        engine (str): "thread" or "async".
+        strategy (str): The WARM_STRATEGY, see fetch_request.get_warm_request().
+    Returns:
+        dict: The environment configuration.
+    """
+    return {
+        "API_KEY": "bench",
+        "BASE_URL": base_url,
+        "USER": "bench",
+        "USERID": "bench",
+        "CORE_COUNT": args.threads,
+        "TIMEOUT": args.timeout,
+        "POOL_MAXSIZE": 1,
+        "KEEP_ALIVE": True,
+        "ENGINE": engine,
+        "ASYNC_CONCURRENCY": args.concurrency,
+        "PAGE_SIZE": args.page_size,
+        "TARGET_MODE": "all",
+        "WARM_STRATEGY": strategy,
+        "ADAPTIVE": args.adaptive,
+        "ADAPTIVE_MIN": 2,
+        "ADAPTIVE_MAX": max(args.threads, args.concurrency),
+        "ADAPTIVE_TARGET_LATENCY": 0,
+        "RATE_LIMIT": 0,
+        "RATE_BURST": 0,
+        "RATE_SCHEDULE": "",
+        "MAX_ATTEMPTS": 3,
+        "RETRY_BASE_DELAY": 1.0,
+        "RETRY_MAX_DELAY": 60.0,
+        "RETRY_BUDGET": 0,
+        "BREAKER_THRESHOLD": 0,
+        "BREAKER_COOLDOWN": 30.0
+    }
+
+
+def get_engine(engine: str):
+    """
+    Args:
+        engine (str): "thread" or "async".
+    Returns:
+        callable: The engine's execute_requests(request_env, ids, run_metrics = ...).
+    """
+    if engine == "async":
+        from async_request import async_request
+        return async_request.execute_requests
+    from warmer import warmer
+    return warmer.execute_requests
+
+
+def run_engine(engine: str, request_env: dict, verbose: bool = False) -> dict:
+    """
+    List and warm the whole fake library with one engine, the same pipeline warmer.run() runs.
+    Args:
+        engine (str): "thread" or "async".
+        request_env (dict): The environment configuration.
+        verbose (bool): Show the engine's own progress output.
+    Returns:
+        dict: The run report of metrics.RunMetrics.report() plus the engine and strategy names.
+    """
+    execute = get_engine(engine)
+    run_metrics = metrics.RunMetrics()
+    ids = (person_id for person_id, _ in run_metrics.timed_iter(fetch_request.iter_crew(request_env), "listing"))
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        execute(request_env, ids, run_metrics = run_metrics)
+    run_metrics.finish()
+    fetch_request.close_sessions()
+    return { "engine": engine, "strategy": request_env.get("WARM_STRATEGY", "full"), **run_metrics.report() }
+
+
+def format_row(report: dict) -> str:
+    """
+    Args:
+        report (dict): As returned by run_engine().
+    Returns:
+        str: One line of the results table.
+    """
+    latency = report["latency_seconds"]
+    return (f"{report['engine']:<8}{report['strategy']:<9}{report['persons']['warmed']:>9}{report['persons']['failed']:>8}{report['duration_seconds']:>10.2f}"
+            f"{report['requests']['per_second']:>10.1f}{latency['p50']:>9.3f}{latency['p95']:>9.3f}{latency['p99']:>9.3f}{report['requests']['retries']:>9}{report['requests']['bytes_per_request']:>10}")
+
+
+def main(argv: list = None) -> list:
+    """
+    Start the fake server, run every requested engine and strategy against it and print the results table.
+    Args:
+        argv (list): Arguments to parse, defaults to sys.argv.
+    Returns:
+        list: The report of every engine and strategy.
+    """
+    parser = argparse.ArgumentParser(description = "Benchmark the warming engines against a local fake Jellyfin.")
+    parser.add_argument("--engines", nargs = "+", choices = ENGINES, default = list(ENGINES))
+    parser.add_argument("--strategies", nargs = "+", choices = fetch_request.WARM_STRATEGIES, default = ["full"], help = "Warm-up requests to compare, see WARM_STRATEGY")
+    parser.add_argument("--persons", type = int, default = 2000)
+    parser.add_argument("--latency", type = float, default = 0.01, help = "Median seconds per detail request")
+    parser.add_argument("--jitter", type = float, default = 0.0, help = "Lognormal spread of the latency, 0 for fixed")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "Fraction of 503 answers")
+    parser.add_argument("--timeout-rate", type = float, default = 0.0, help = "Fraction of requests that hang past --timeout")
+    parser.add_argument("--max-connections", type = int, default = 0, help = "Connections the server serves at once, 0 for unlimited")
+    parser.add_argument("--threads", type = int, default = 16, help = "CORE_COUNT of the thread engine")
+    parser.add_argument("--concurrency", type = int, default = 64, help = "ASYNC_CONCURRENCY of the async engine")
+    parser.add_argument("--page-size", type = int, default = 1000)
+    parser.add_argument("--timeout", type = float, default = 5)
+    parser.add_argument("--adaptive", action = "store_true")
+    parser.add_argument("--json", help = "Also write every report to this file")
+    parser.add_argument("--verbose", action = "store_true", help = "Show the engines' progress output")
+    args = parser.parse_args(argv)
+
+    server = fake_jellyfin.FakeJellyfin(
+        persons = args.persons, latency = args.latency, jitter = args.jitter, error_rate = args.error_rate,
+        timeout_rate = args.timeout_rate, hang = args.timeout * 2, max_connections = args.max_connections
+    ).start()
+    reports = []
+    try:
+        print(f"Benchmarking {args.persons} persons at {args.latency}s median latency against {server.base_url}")
+        print(f"{'engine':<8}{'strategy':<9}{'warmed':>9}{'failed':>8}{'seconds':>10}{'req/s':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'retries':>9}{'bytes/req':>10}")
+        for engine in args.engines:
+            for strategy in args.strategies:
+                report = run_engine(engine, bench_env(server.base_url, args, engine, strategy), args.verbose)
+                reports.append(report)
+                print(format_row(report))
+    finally:
+        server.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding = "utf-8") as file:
+            json.dump(reports, file, indent = 2)
+    return reports
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+This module adjusts how many requests are in flight while the run goes, based on the latency and error rate Jellyfin answers with.
+"""
+import asyncio
+import collections
+import threading
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Nearest rank percentile.
+    Args:
+        values (list): Samples, does not need to be sorted.
+        fraction (float): 0.95 for p95.
+    Returns:
+        float: The percentile, 0 if there are no samples.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD controller, every `window` finished requests the limit goes up by one while p95 latency and error rate look healthy,
+    and is halved as soon as they do not. Without a target latency the fastest p95 seen so far times `tolerance` is the target.
+    """
+    def __init__(self, minimum: int, maximum: int, target_latency: float = 0, error_threshold: float = 0.05,
+                 window: int = 20, tolerance: float = 2.0):
+        """
+        Args:
+            minimum (int): Never go below this many requests in flight.
+            maximum (int): Never go above this many requests in flight.
+            target_latency (float): p95 latency in seconds to stay under, 0 to learn it from the run.
+            error_threshold (float): Back off when more than this fraction of a window failed.
+            window (int): Requests per adjustment.
+            tolerance (float): How much slower than the best p95 seen counts as the server struggling.
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = self.minimum
+        self.target_latency = target_latency
+        self.error_threshold = error_threshold
+        self.window = window
+        self.tolerance = tolerance
+        self.best_p95 = None
+        self.in_flight = 0
+        self.latencies = []
+        self.errors = 0
+        self.condition = threading.Condition()
+
+
+    def try_acquire(self) -> bool:
+        """
+        Take an in-flight slot if one is free under the current limit.
+        Returns:
+            bool: True if the slot was taken.
+        """
+        with self.condition:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            return False
+
+
+    def acquire(self) -> None:
+        """
+        Block until an in-flight slot is free, used by the thread engine.
+        Returns:
+            None
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+
+    def release(self, latency: float, ok: bool) -> None:
+        """
+        Give the slot back and record how the request went.
+        Args:
+            latency (float): Seconds the request took.
+            ok (bool): False for timeouts and server errors.
+        Returns:
+            None
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.latencies.append(latency)
+            if not ok:
+                self.errors += 1
+            if len(self.latencies) >= self.window:
+                self.adjust()
+            self.condition.notify_all()
+
+
+    def adjust(self) -> None:
+        """
+        Apply one AIMD step from the finished window, the caller holds the lock.
+        Returns:
+            None
+        """
+        p95 = percentile(self.latencies, 0.95)
+        error_rate = self.errors / len(self.latencies)
+        self.latencies = []
+        self.errors = 0
+
+        target = self.target_latency
+        if not target:
+            if error_rate <= self.error_threshold:
+                self.best_p95 = p95 if self.best_p95 is None else min(self.best_p95, p95)
+            target = (self.best_p95 or p95) * self.tolerance
+
+        if error_rate > self.error_threshold or p95 > target:
+            self.limit = max(self.minimum, self.limit // 2)
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+
+
+class SharedCapacity:
+    """
+    Requests in flight across every target of a run, each target still stays under its own limit.
+    Whoever asks first gets a free slot, so once a target is done its share goes to the ones still warming.
+    Threads and event loops of different targets wait on the same slots.
+    """
+    def __init__(self, total: int):
+        """
+        Args:
+            total (int): Requests in flight across every target.
+        """
+        self.total = max(1, total)
+        self.in_use = 0
+        self.lock = threading.Lock()
+        self.waiters = collections.deque() # Callables waking one waiting thread or coroutine
+
+
+    def _take(self, waiter) -> bool:
+        # Called with the lock held, queue the waiter if no slot is free
+        if self.in_use < self.total:
+            self.in_use += 1
+            return True
+        self.waiters.append(waiter)
+        return False
+
+
+    def acquire(self) -> None:
+        """
+        Block until a slot is free, used by the thread engine.
+        Returns:
+            None
+        """
+        while True:
+            event = threading.Event()
+            with self.lock:
+                if self._take(event.set):
+                    return
+            event.wait()
+
+
+    async def acquire_async(self) -> None:
+        """
+        Suspend the calling coroutine until a slot is free, the other coroutines of its loop keep going.
+        Returns:
+            None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            future = loop.create_future()
+            wake = lambda future = future: loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+            with self.lock:
+                if self._take(wake):
+                    return
+            await future
+
+
+    def release(self) -> None:
+        """
+        Give a slot back and wake the longest waiting thread or coroutine.
+        Returns:
+            None
+        """
+        with self.lock:
+            self.in_use -= 1
+            wake = self.waiters.popleft() if self.waiters else None
+        if wake:
+            wake()
+
+
+def from_env(request_env: dict):
+    """
+    Build the controller when ADAPTIVE is enabled.
+    Args:
+        request_env (dict): The environment configuration, reads ADAPTIVE, ADAPTIVE_MIN, ADAPTIVE_MAX and ADAPTIVE_TARGET_LATENCY.
+    Returns:
+        AdaptiveConcurrency: The controller, None if ADAPTIVE is off.
+    """
+    if not request_env.get("ADAPTIVE"):
+        return None
+    return AdaptiveConcurrency(
+        request_env.get("ADAPTIVE_MIN", 2),
+        request_env.get("ADAPTIVE_MAX", 64),
+        request_env.get("ADAPTIVE_TARGET_LATENCY", 0)
+    )
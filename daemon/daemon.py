@@ -0,0 +1,288 @@
+"""
+This module keeps the tool running between warms: a scheduler starts an incremental run at set times of day and a small HTTP
+endpoint takes Jellyfin webhook "ItemAdded" events and warms the cast and crew of the new item within seconds.
+The worker pool, and the keep-alive connections of its threads, stay up from one event to the next.
+"""
+import datetime
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import requests
+from fetch_request import fetch_request
+from warmer import warmer
+
+
+def parse_times(times: str) -> list:
+    """
+    Parse a DAEMON_SCHEDULE such as "03:00,15:30".
+    Args:
+        times (str): Comma separated HH:MM times of day, empty for no scheduled runs.
+    Returns:
+        list: Sorted (hour, minute) tuples.
+    Raises:
+        ValueError: If a time is malformed.
+    """
+    parsed = []
+    for time_of_day in filter(None, (part.strip() for part in (times or "").split(","))):
+        try:
+            hour, minute = (int(part) for part in time_of_day.split(":"))
+            if not (0 <= hour < 24 and 0 <= minute < 60):
+                raise ValueError
+        except ValueError as e:
+            raise ValueError(f"Invalid DAEMON_SCHEDULE time '{time_of_day}', expected HH:MM") from e
+        parsed.append((hour, minute))
+    return sorted(parsed)
+
+
+def next_run(times: list, now: datetime.datetime) -> datetime.datetime:
+    """
+    Args:
+        times (list): (hour, minute) tuples from parse_times().
+        now (datetime.datetime): The current local time.
+    Returns:
+        datetime.datetime: The first scheduled time after now, None without a schedule.
+    """
+    candidates = [now.replace(hour = hour, minute = minute, second = 0, microsecond = 0) for hour, minute in times]
+    candidates += [candidate + datetime.timedelta(days = 1) for candidate in candidates]
+    return min((candidate for candidate in candidates if candidate > now), default = None)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """
+    POST /webhook takes a Jellyfin webhook plugin event, GET /health reports what the daemon is doing.
+    """
+    def log_message(self, format, *args):
+        pass
+
+
+    def send_json(self, status: int, body: dict) -> None:
+        """
+        Send a JSON response.
+        """
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def authorized(self) -> bool:
+        """
+        Returns:
+            bool: True if WEBHOOK_TOKEN is not set or the request carries it as a Bearer token, X-Webhook-Token header or ?token=.
+        """
+        token = self.server.daemon.request_env.get("WEBHOOK_TOKEN")
+        if not token:
+            return True
+        given = (self.headers.get("X-Webhook-Token")
+                 or self.headers.get("Authorization", "").removeprefix("Bearer ")
+                 or parse_qs(urlparse(self.path).query).get("token", [""])[0])
+        return hmac.compare_digest(given.encode(), token.encode())
+
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/health":
+            self.send_json(404, { "error": "not found" })
+            return
+        self.send_json(200, self.server.daemon.health())
+
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/webhook":
+            self.send_json(404, { "error": "not found" })
+            return
+        if not self.authorized():
+            self.send_json(401, { "error": "invalid token" })
+            return
+        try:
+            event = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            self.send_json(400, { "error": "body is not JSON" })
+            return
+        if event.get("NotificationType", "ItemAdded") != "ItemAdded" or not event.get("ItemId"):
+            self.send_json(200, { "queued": False }) # Other events are fine, there is just nothing to warm
+            return
+        self.server.daemon.submit_item(event["ItemId"])
+        self.send_json(202, { "queued": True })
+
+
+class Daemon:
+    """
+    Warms new items as their webhook events arrive and runs an incremental pass at every DAEMON_SCHEDULE time.
+    Everything runs on one worker thread in arrival order, over a thread pool that lives as long as the daemon.
+    """
+    def __init__(self, run_warmer: warmer.Warmer, now = datetime.datetime.now):
+        """
+        Args:
+            run_warmer (warmer.Warmer): Warms on its pool, its configuration is read for DAEMON_HOST, DAEMON_PORT, DAEMON_SCHEDULE and WEBHOOK_TOKEN.
+            now (callable): Local wall clock for the schedule, overridden by tests.
+        Raises:
+            ValueError: If DAEMON_SCHEDULE is malformed.
+            OSError: If the endpoint cannot listen on DAEMON_HOST:DAEMON_PORT.
+        """
+        self.warmer = run_warmer
+        self.request_env = run_warmer.request_env
+        self.now = now
+        self.times = parse_times(self.request_env.get("DAEMON_SCHEDULE"))
+        self.next_run = next_run(self.times, now())
+        self.items = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.warmed_count = 0
+        self.last_run = None
+        self.server = ThreadingHTTPServer((self.request_env.get("DAEMON_HOST", "127.0.0.1"), self.request_env.get("DAEMON_PORT", 8097)), WebhookHandler)
+        self.server.daemon_threads = True
+        self.server.daemon = self
+        self.worker = threading.Thread(target = self.loop, daemon = True)
+
+
+    @property
+    def address(self) -> str:
+        """
+        Returns:
+            str: The URL the webhook plugin should post to.
+        """
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/webhook"
+
+
+    def health(self) -> dict:
+        """
+        Returns:
+            dict: Items waiting, persons warmed since start, the last and next scheduled run.
+        """
+        with self.lock:
+            return {
+                "queued_items": len(self.items),
+                "warmed": self.warmed_count,
+                "last_run": self.last_run,
+                "next_run": self.next_run.isoformat() if self.next_run else None
+            }
+
+
+    def submit_item(self, item_id: str) -> None:
+        """
+        Queue a newly added item, its cast and crew are warmed by the worker thread.
+        Args:
+            item_id (str): The Jellyfin item ID from the webhook.
+        Returns:
+            None
+        """
+        with self.lock:
+            self.items.append(item_id)
+        self.wake.set()
+
+
+    def warm_items(self) -> None:
+        """
+        Warm the cast and crew of every queued item in one batch, persons STATE_DB already has are skipped.
+        Returns:
+            None
+        """
+        with self.lock:
+            items, self.items = list(dict.fromkeys(self.items)), []
+        crew = {}
+        with fetch_request.using_sessions(self.warmer.sessions):
+            for item_id in items:
+                try:
+                    crew.update(fetch_request.get_item_people(self.request_env, item_id))
+                except (requests.RequestException, ValueError) as e:
+                    print(f"Error fetching the cast and crew of item {item_id}: {e}")
+        warmed = self.warmer.warm_persons(crew)
+        with self.lock:
+            self.warmed_count += len(warmed)
+        if warmed:
+            print(f"\nWarmed {len(warmed)} crew & cast from {len(items)} new items.")
+
+
+    def scheduled_run(self) -> None:
+        """
+        Incremental pass over everything added since the last one (a full pass without STATE_DB), catching anything a webhook missed.
+        Returns:
+            None
+        """
+        started_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        _, result, _ = self.warmer.warm(incremental = bool(self.request_env.get("STATE_DB")))[0]
+        with self.lock:
+            self.warmed_count += len(result["warmed"])
+            self.last_run = started_at
+        print(f"\nScheduled run warmed {len(result['warmed'])} of {result['listed']} crew & cast. Metrics: {result['metrics'].summary()}")
+
+
+    def loop(self) -> None:
+        """
+        Worker thread, sleeps until an item arrives or the next scheduled run is due.
+        Returns:
+            None
+        """
+        while not self.stopping.is_set():
+            timeout = max(0.0, (self.next_run - self.now()).total_seconds()) if self.next_run else None
+            self.wake.wait(timeout)
+            self.wake.clear()
+            if self.stopping.is_set():
+                break
+            try:
+                if self.next_run and self.now() >= self.next_run:
+                    self.next_run = next_run(self.times, self.now())
+                    self.scheduled_run()
+                if self.items:
+                    self.warm_items()
+            except Exception as e: # A bad event or an unreachable server must not take the daemon down
+                print(f"\nError in daemon: {e}")
+
+
+    def start(self) -> "Daemon":
+        """
+        Serve the endpoint and start the worker thread.
+        Returns:
+            Daemon: self, for chaining.
+        """
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        self.worker.start()
+        return self
+
+
+    def stop(self) -> None:
+        """
+        Stop the endpoint, let the worker finish what it is doing and close the warmer.
+        Returns:
+            None
+        """
+        self.stopping.set()
+        self.wake.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.worker.join()
+        self.warmer.close()
+
+
+def serve(run_warmer: warmer.Warmer) -> int:
+    """
+    Run the daemon until interrupted, the entry point of `main.py --daemon`.
+    Args:
+        run_warmer (warmer.Warmer): Warms on its pool, see Daemon.
+    Returns:
+        int: Exit status, 1 if the daemon could not start.
+    """
+    request_env = run_warmer.request_env
+    try:
+        daemon = Daemon(run_warmer).start()
+    except ValueError as e:
+        print(f"{e} in your .env file.")
+        return 1
+    except OSError as e:
+        print(f"Cannot listen on {request_env.get('DAEMON_HOST')}:{request_env.get('DAEMON_PORT')}: {e}")
+        return 1
+    schedule = f", next scheduled run at {daemon.next_run:%Y-%m-%d %H:%M}" if daemon.next_run else ""
+    print(f"Waiting for Jellyfin webhooks on {daemon.address}{schedule}. Press Ctrl+C to stop.")
+    try:
+        daemon.stopping.wait()
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    finally:
+        daemon.stop()
+    return 0
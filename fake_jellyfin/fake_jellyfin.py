@@ -0,0 +1,292 @@
+"""
+This module serves a stand-in Jellyfin with the endpoints this tool calls, so throughput can be measured offline.
+Run it on its own with `python -m fake_jellyfin.fake_jellyfin --persons 20000 --latency 0.02`.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+IMAGE = b"\xff\xd8" + bytes(range(256)) * 64 + b"\xff\xd9" # A portrait sized body, bigger than any detail DTO
+
+
+class FakeJellyfinHandler(BaseHTTPRequestHandler):
+    """
+    Answers /emby/Persons, /Users/{id}/Items, /Users/{id}/Items/{id} and /Items/{id}/Images/Primary like Jellyfin would, with injected latency and errors.
+    """
+    protocol_version = "HTTP/1.1" # Keep-alive, like Jellyfin behind a reverse proxy
+    timeout = 5 # Idle keep-alive connections are closed so a connection limit cannot starve new ones
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def send_body(self, status: int, body: bytes = b"", headers: dict = None) -> None:
+        """
+        Send a complete response, HEAD requests get the headers only.
+        """
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+    def do_GET(self):
+        self.server.serve(self)
+
+
+    def do_HEAD(self):
+        self.server.serve(self)
+
+
+class FakeJellyfin(ThreadingHTTPServer):
+    """
+    Threaded fake server, every option can be changed between benchmark runs.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple = ("127.0.0.1", 0), persons: int = 1000, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, timeout_rate: float = 0.0, hang: float = 60.0, max_connections: int = 0,
+                 image_rate: float = 0.5, seed: int = 0):
+        """
+        Args:
+            address (tuple): (host, port) to listen on, port 0 picks a free one.
+            persons (int): Persons in the library.
+            latency (float): Median seconds per detail request.
+            jitter (float): Spread of the lognormal latency distribution, 0 for a fixed latency.
+            error_rate (float): Fraction of detail requests answered 503 with Retry-After.
+            timeout_rate (float): Fraction of detail requests that hang for `hang` seconds, past any sane client timeout.
+            hang (float): Seconds a hanging request takes.
+            max_connections (int): Connections served at once, extra ones wait in the backlog. 0 for unlimited.
+            image_rate (float): Fraction of persons whose primary image resolves.
+            seed (int): Seed of the random latency and error injection.
+        """
+        super().__init__(address, FakeJellyfinHandler)
+        self.persons = persons
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.image_rate = image_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.connections = threading.BoundedSemaphore(max_connections) if max_connections else None
+        self.counts_lock = threading.Lock()
+        self.requests = 0
+
+
+    @property
+    def base_url(self) -> str:
+        """
+        Returns:
+            str: The BASE_URL to point the tool at.
+        """
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def process_request(self, request, client_address):
+        """
+        Wait for a free connection slot before serving a new connection.
+        """
+        if self.connections:
+            self.connections.acquire()
+        super().process_request(request, client_address)
+
+
+    def shutdown_request(self, request):
+        """
+        Free the connection slot once the connection is closed.
+        """
+        super().shutdown_request(request)
+        if self.connections:
+            self.connections.release()
+
+
+    def handle_error(self, request, client_address):
+        """
+        A client hanging up before the body is sent (WARM_STRATEGY=headers) is expected, anything else is printed.
+        """
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+    def roll(self) -> float:
+        """
+        Returns:
+            float: A seeded random float in [0, 1).
+        """
+        with self.random_lock:
+            return self.random.random()
+
+
+    def delay(self) -> float:
+        """
+        Returns:
+            float: Seconds the next detail request takes, lognormal around `latency`.
+        """
+        if not self.latency:
+            return 0.0
+        with self.random_lock:
+            return self.latency * self.random.lognormvariate(0, self.jitter) if self.jitter else self.latency
+
+
+    def serve(self, handler: FakeJellyfinHandler) -> None:
+        """
+        Route one request.
+        """
+        with self.counts_lock:
+            self.requests += 1
+        url = urlparse(handler.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+
+        if handler.command == "HEAD" and not (len(parts) == 4 and parts[0] == "Items" and parts[2] == "Images"):
+            # Like Jellyfin, only the image endpoint answers HEAD
+            handler.send_body(405)
+        elif url.path == "/emby/Persons":
+            start_index = int(query.get("StartIndex", ["0"])[0])
+            limit = int(query.get("Limit", [str(self.persons)])[0])
+            items = [self.person(index) for index in range(start_index, min(self.persons, start_index + limit))]
+            body = json.dumps({ "Items": items, "TotalRecordCount": self.persons, "StartIndex": start_index }).encode()
+            handler.send_body(200, body, { "Content-Type": "application/json" })
+        elif len(parts) == 4 and parts[0] == "Users" and parts[2] == "Items":
+            self.detail(handler, parts[3])
+        elif len(parts) == 3 and parts[0] == "Users" and parts[2] == "Items" and "," in query.get("Ids", [""])[0]:
+            # Bulk lookup, the verification pass checks many persons per request
+            items = [self.person(index) for index in map(self.index, query["Ids"][0].split(",")) if index is not None]
+            handler.send_body(200, json.dumps({ "Items": items, "TotalRecordCount": len(items) }).encode(), { "Content-Type": "application/json" })
+        elif len(parts) == 3 and parts[0] == "Users" and parts[2] == "Items":
+            self.detail(handler, query.get("Ids", [""])[0], minimal = True)
+        elif len(parts) == 4 and parts[0] == "Items" and parts[2] == "Images":
+            if handler.command == "GET":
+                self.detail(handler, parts[1], image = True)
+                return
+            index = self.index(parts[1])
+            handler.send_body(200 if index is not None and self.has_image(index) else 404, b"", { "Content-Type": "image/jpeg" })
+        else:
+            handler.send_body(404)
+
+
+    def detail(self, handler: FakeJellyfinHandler, person_id: str, minimal: bool = False, image: bool = False) -> None:
+        """
+        Answer a warm-up request, this is where latency, errors and timeouts are injected.
+        Args:
+            handler (FakeJellyfinHandler): The request to answer.
+            person_id (str): The requested person.
+            minimal (bool): Answer like /Items?Ids= without optional fields.
+            image (bool): Answer with the primary image.
+        """
+        roll = self.roll()
+        if roll < self.timeout_rate:
+            time.sleep(self.hang)
+        elif roll < self.timeout_rate + self.error_rate:
+            handler.send_body(503, b"", { "Retry-After": "1" })
+            return
+        time.sleep(self.delay())
+        index = self.index(person_id)
+        if index is None or (image and not self.has_image(index)):
+            handler.send_body(404)
+            return
+        if image:
+            # Validators like a caching reverse proxy sends, a matching If-None-Match gets a 304 without a body
+            etag = f'"tag{index}"'
+            if handler.headers.get("If-None-Match") == etag:
+                handler.send_body(304, b"", { "ETag": etag })
+                return
+            handler.send_body(200, IMAGE, { "Content-Type": "image/jpeg", "ETag": etag })
+            return
+        item = self.person(index, detail = not minimal)
+        body = json.dumps({ "Items": [item], "TotalRecordCount": 1 } if minimal else item).encode()
+        handler.send_body(200, body, { "Content-Type": "application/json" })
+
+
+    def index(self, person_id: str) -> int:
+        """
+        Returns:
+            int: The index of a person ID, None if it is not a person of this library.
+        """
+        try:
+            index = int(person_id.removeprefix("person"))
+        except ValueError:
+            return None
+        return index if 0 <= index < self.persons else None
+
+
+    def has_image(self, index: int) -> bool:
+        """
+        Returns:
+            bool: True if the primary image of the person resolves.
+        """
+        # Stable per person, independent of the seeded error rolls
+        return (index * 2654435761 % 1000) < self.image_rate * 1000
+
+
+    def person(self, index: int, detail: bool = False) -> dict:
+        """
+        Returns:
+            dict: The listing item of a person, or its bigger detail DTO.
+        """
+        item = { "Id": f"person{index:08d}", "Name": f"Person {index}", "Type": "Person", "ImageTags": {} }
+        if index % 2 == 0: # Half of the library has an image tag, not all of them resolve
+            item["ImageTags"]["Primary"] = f"tag{index}"
+            item["PrimaryImageTag"] = f"tag{index}"
+        if detail:
+            item["Overview"] = "Lorem ipsum " * 50 # Detail DTOs are much bigger than listing items
+        return item
+
+
+    def start(self) -> "FakeJellyfin":
+        """
+        Serve from a background thread.
+        Returns:
+            FakeJellyfin: self, for chaining.
+        """
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+        return self
+
+
+    def stop(self) -> None:
+        """
+        Stop serving and close the socket.
+        Returns:
+            None
+        """
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    """
+    Serve a fake Jellyfin until interrupted.
+    """
+    parser = argparse.ArgumentParser(description = "Stand-in Jellyfin server for offline benchmarks.")
+    parser.add_argument("--port", type = int, default = 8096)
+    parser.add_argument("--persons", type = int, default = 1000)
+    parser.add_argument("--latency", type = float, default = 0.0)
+    parser.add_argument("--jitter", type = float, default = 0.0)
+    parser.add_argument("--error-rate", type = float, default = 0.0)
+    parser.add_argument("--timeout-rate", type = float, default = 0.0)
+    parser.add_argument("--max-connections", type = int, default = 0)
+    args = parser.parse_args()
+
+    server = FakeJellyfin(("127.0.0.1", args.port), args.persons, args.latency, args.jitter, args.error_rate,
+                          args.timeout_rate, max_connections = args.max_connections)
+    print(f"Fake Jellyfin with {args.persons} persons on {server.base_url}, press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
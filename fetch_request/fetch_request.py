@@ -1,63 +1,457 @@
 """
 This script fetches all cast and crew members from a Jellyfin server.
 """
+import contextlib
+import contextvars
+import threading
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from json_stream import json_stream
+from retry import retry
+try:
+    import orjson
+except ImportError: # Optional, LISTING_PARSER=orjson falls back to response.json() without it
+    orjson = None
 
-def get_all_crew_ids(request_env: dict) -> set:
+WARM_STRATEGIES = ("full", "minimal", "headers", "image")
+RECENT_SOURCES = ("resume", "played", "latest") # Continue watching, recently played and recently added items
+
+
+class ListingError(RuntimeError):
+    """
+    The first listing page could not be fetched, nothing is known about the library.
+    """
+
+
+class Sessions:
+    """
+    Keep-alive sessions of a set of threads, one per thread and BASE_URL.
+    requests.Session is not guaranteed to be thread safe but a per-thread one keeps its connections alive between persons.
+    A warmer.Warmer owns one, so closing it never touches the sessions of another Warmer, anything else shares a module wide one.
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.sessions = []
+        self.lock = threading.Lock()
+        self.generation = 0 # Bumped by close() so threads drop their closed sessions
+
+
+    def get(self, request_env: dict) -> requests.Session:
+        """
+        Get the pooled session of the calling thread, creating it on first use.
+        Args:
+            request_env (dict): The environment configuration, reads POOL_MAXSIZE and KEEP_ALIVE.
+        Returns:
+            requests.Session: The session owned by the current thread for this BASE_URL.
+        """
+        if getattr(self.local, "generation", None) != self.generation:
+            self.local.sessions = {}
+            self.local.generation = self.generation
+        sessions = self.local.sessions
+
+        base_url = request_env.get("BASE_URL")
+        session = sessions.get(base_url)
+        if session is None:
+            session = requests.Session()
+            # max_retries=0, retrying is handled by us not urllib3
+            adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = request_env.get("POOL_MAXSIZE", 1), max_retries = 0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            if not request_env.get("KEEP_ALIVE", True):
+                session.headers["Connection"] = "close"
+            sessions[base_url] = session
+            with self.lock:
+                self.sessions.append(session)
+        return session
+
+
+    def close(self) -> None:
+        """
+        Close every session handed out in any thread, releasing their pooled connections.
+        Returns:
+            None
+        """
+        with self.lock:
+            for session in self.sessions:
+                session.close()
+            self.sessions.clear()
+            self.generation += 1
+
+
+_shared = Sessions()
+_current = contextvars.ContextVar("sessions", default = None) # The Sessions of the Warmer running in this thread or task, if any
+
+
+def bind_sessions(sessions: Sessions) -> None:
     """
-    Fetch all crew IDs from the Jellyfin API.
+    Make get_session() of the calling thread hand out the given sessions, used as the initializer of a Warmer's threads.
+    asyncio.to_thread() and the tasks of an event loop inherit the binding.
+    Args:
+        sessions (Sessions): The sessions to use, None for the module wide ones.
     Returns:
-        set: A set of all crew IDs.
+        None
     """
-    # Fetch all Cast and Crew persons, TIL try/except does not count as a scope
+    _current.set(sessions)
+
+
+@contextlib.contextmanager
+def using_sessions(sessions: Sessions):
+    """
+    Bind the given sessions to the calling thread for the duration of a with block, the previous binding comes back after it.
+    Args:
+        sessions (Sessions): The sessions to use.
+    Yields:
+        Sessions: The same sessions.
+    """
+    token = _current.set(sessions)
     try:
-        response = requests.get(
-            f"{request_env.get('BASE_URL')}/emby/Persons",
-            params = {"api_key": request_env.get("API_KEY")},
-            timeout = request_env.get("TIMEOUT")
-        )
-        response.raise_for_status()
-        data = response.json() # Setting data here can be use later
-    except (requests.HTTPError, requests.exceptions.Timeout, requests.JSONDecodeError) as e:
-        print(f"Error fetching all crew and casts: {e}. Exiting...")
-        exit(0)
+        yield sessions
+    finally:
+        _current.reset(token)
 
 
-    # Get every cast and crew id, doesnt matter if they have a picture or not. Sometimes the person have a picture hash but still display blank
-    ids = set()
-    for item in data.get('Items', []):
-        if item.get('Id'):
-            ids.add(item.get('Id'))
-    return ids
+def current_sessions() -> Sessions:
+    """
+    Returns:
+        Sessions: The sessions bound to the calling thread, None if it uses the module wide ones.
+    """
+    return _current.get()
 
 
-def get_cast_and_crew(request_env: dict, person_id: str) -> None:
+def get_session(request_env: dict) -> requests.Session:
     """
-    GET request to the detail page of a cast or crew member by their ID.
+    Get the pooled session of the calling thread, creating it on first use.
+    Reusing the session skips the TCP (and TLS if behind a reverse proxy) handshake on every request.
     Args:
-        person_id (str): The crew/cast ID of the person to fetch details for.
+        request_env (dict): The environment configuration, reads POOL_MAXSIZE and KEEP_ALIVE.
+    Returns:
+        requests.Session: The session owned by the current thread for this BASE_URL, from the bound Sessions if there is one.
+    """
+    return (_current.get() or _shared).get(request_env)
+
+
+def close_sessions() -> None:
+    """
+    Close every module wide session, the ones no Warmer owns, in any thread.
     Returns:
         None
+    """
+    _shared.close()
+
+
+def get_crew_page_params(request_env: dict, start_index: int, since: str = None) -> dict:
+    """
+    Build the query of one Persons listing page.
+    TARGET_MODE=missing also asks for the primary image tag so persons can be sorted by image state.
+    With `since` the page lists the media items added since then with their People instead, for INCREMENTAL runs.
+    Args:
+        request_env (dict): The environment configuration, reads PAGE_SIZE and TARGET_MODE.
+        start_index (int): Index of the first person (or item) of the page.
+        since (str): ISO 8601 UTC time, only list items created after it.
+    Returns:
+        dict: The query parameters.
+    """
+    params = {
+        "api_key": request_env.get("API_KEY"),
+        "StartIndex": start_index,
+        "Limit": request_env.get("PAGE_SIZE", 1000)
+    }
+    if since:
+        # People entries carry their PrimaryImageTag already, TARGET_MODE=missing needs nothing extra
+        params.update({
+            "MinDateCreated": since,
+            "Recursive": "true",
+            "Fields": "People",
+            "EnableImages": "false",
+            "EnableUserData": "false"
+        })
+    elif request_env.get("TARGET_MODE") == "missing":
+        params.update({
+            "Fields": "PrimaryImageAspectRatio",
+            "EnableImages": "true",
+            "EnableImageTypes": "Primary",
+            "ImageTypeLimit": 1
+        })
+    return params
+
+
+def decode_crew_page(request_env: dict, response: requests.Response, people: bool = False) -> tuple:
+    """
+    Decode a Persons listing page down to what is needed, crew IDs and their primary image tag.
+    LISTING_PARSER picks how: "stream" parses item by item off the socket so memory stays flat,
+    "orjson" decodes the whole page with orjson when it is installed, "json" is the plain response.json().
+    Args:
+        request_env (dict): The environment configuration, reads LISTING_PARSER.
+        response (requests.Response): The page response.
+        people (bool): The page lists media items, take the persons from their People instead.
+    Returns:
+        tuple: (crew ID to primary image tag, items on the page, TotalRecordCount or None)
+    """
+    parser = request_env.get("LISTING_PARSER", "json")
+    if parser == "stream":
+        listing = json_stream.ListingStream(response.iter_content(chunk_size = 65536))
+        items = listing.items()
+    else:
+        data = orjson.loads(response.content) if parser == "orjson" and orjson else response.json() # Setting data here can be use later
+        items = data.get('Items', [])
+
+    # Get every cast and crew id, doesnt matter if they have a picture or not. Sometimes the person have a picture hash but still display blank
+    page = {}
+    item_count = 0
+    for item in items:
+        item_count += 1
+        for person in (item.get('People') or []) if people else [item]:
+            if person.get('Id'):
+                page[person.get('Id')] = get_primary_image_tag(person)
+    total_count = listing.total_count if parser == "stream" else data.get('TotalRecordCount')
+    return page, item_count, total_count
+
+
+def get_crew_page(request_env: dict, start_index: int, since: str = None) -> tuple:
+    """
+    Fetch one page of the Persons listing, retrying a slow or failing page before giving up on it.
+    Args:
+        request_env (dict): The environment configuration, reads PAGE_SIZE and LISTING_PARSER.
+        start_index (int): Index of the first person of the page.
+        since (str): List the People of the items created after this time instead, see get_crew_page_params().
+    Returns:
+        tuple: The decoded page, see decode_crew_page().
     Raises:
-        requests.RequestException: If the request to the Jellyfin API fails.
+        requests.RequestException: If the page still fails after all retries.
+        ValueError: If the page is still not valid JSON after all retries.
     """
     max_retries = 3
+    stream = request_env.get("LISTING_PARSER", "json") == "stream"
+    path = f"/Users/{request_env.get('USERID')}/Items" if since else "/emby/Persons"
 
     for attempt in range(max_retries):
+        # TIL try/except does not count as a scope
         try:
-            detail_response = requests.get(
-                f"{request_env.get('BASE_URL')}/Users/{request_env.get('USERID')}/Items/{person_id}",
-                params = {"api_key": request_env.get("API_KEY")},
-                timeout = request_env.get("TIMEOUT") # This needs to be high, multithread request basically is a mini ddos your Jellyfin server
+            response = get_session(request_env).get(
+                f"{request_env.get('BASE_URL')}{path}",
+                params = get_crew_page_params(request_env, start_index, since),
+                timeout = request_env.get("TIMEOUT"),
+                stream = stream # Body is read off the socket chunk by chunk, gzip (br with brotli installed) is already asked for by requests
             )
-            detail_response.raise_for_status()
-            break # If not raise for status, break out (this was caught in testing, unit testing does its work)
-        except (requests.exceptions.Timeout, requests.RequestException) as e:
+            response.raise_for_status()
+            try:
+                return decode_crew_page(request_env, response, people = bool(since))
+            finally:
+                response.close()
+        except (requests.RequestException, ValueError):
             if attempt == max_retries - 1:
-                print(f"Error fetching details for person {person_id}: {e}")
+                raise
+            print(f"Retry attempt #{attempt + 1} for persons starting at {start_index}")
+            time.sleep(1)
+
+
+def iter_crew_pages(request_env: dict, since: str = None, run_metrics = None):
+    """
+    Page through the Persons listing with StartIndex/Limit so warming can start before the whole library is listed.
+    A page that keeps failing is skipped, only the first page failing raises since nothing is known about the library yet.
+    Args:
+        request_env (dict): The environment configuration, reads PAGE_SIZE.
+        since (str): Page through the items created after this time instead, see get_crew_page_params().
+        run_metrics (metrics.RunMetrics): Optional, counts the skipped pages so an incremental run keeps its watermark.
+    Yields:
+        dict: The Items of every page, as crew ID to primary image tag.
+    Raises:
+        ListingError: If the first page still fails after all retries.
+    """
+    page_size = request_env.get("PAGE_SIZE", 1000)
+    start_index = 0
+    total_count = None
+
+    while True:
+        try:
+            page, item_count, page_total = get_crew_page(request_env, start_index, since)
+        except (requests.RequestException, ValueError) as e:
+            if total_count is None:
+                raise ListingError(f"Error fetching all crew and casts: {e}") from e
+            print(f"Error fetching persons {start_index} to {start_index + page_size - 1}: {e}. Skipping page...")
+            if run_metrics:
+                run_metrics.record_skipped_page()
+            start_index += page_size
+            if start_index >= total_count:
                 break
-            else:
-                print(f"Retry attempt #{attempt + 1} for person {person_id}")
-                time.sleep(1)
-                continue
+            continue
+
+        total_count = page_total if page_total is not None else (total_count or 0)
+        yield page
+
+        start_index += page_size
+        # A short page is the last page, TotalRecordCount lets us skip past a failed page without guessing
+        if item_count < page_size or (total_count and start_index >= total_count):
+            break
+
+
+def iter_crew(request_env: dict, since: str = None, run_metrics = None):
+    """
+    Stream every crew member from the paginated listing, deduplicated as they arrive.
+    Args:
+        request_env (dict): The environment configuration.
+        since (str): Only the cast and crew of items created after this ISO 8601 UTC time, None for the whole library.
+        run_metrics (metrics.RunMetrics): Optional, counts the listing pages that were skipped.
+    Yields:
+        tuple: (crew ID, primary image tag) the first time each ID is seen.
+    """
+    seen = set()
+    for page in iter_crew_pages(request_env, since, run_metrics):
+        for person_id, image_tag in page.items():
+            if person_id not in seen:
+                seen.add(person_id)
+                yield person_id, image_tag
+
+
+def get_primary_image_tag(item: dict) -> str:
+    """
+    Get the primary image tag of a person from a Persons listing item.
+    Args:
+        item (dict): One item of the Persons listing.
+    Returns:
+        str: The primary image tag, None if the person has none.
+    """
+    return (item.get('ImageTags') or {}).get('Primary') or item.get('PrimaryImageTag')
+
+
+def get_item_people(request_env: dict, item_id: str) -> dict:
+    """
+    Get the cast and crew of one media item, used when Jellyfin reports a newly added item.
+    Args:
+        request_env (dict): The environment configuration.
+        item_id (str): The movie, series or episode ID.
+    Returns:
+        dict: Crew ID to primary image tag of everyone in the item's People.
+    Raises:
+        requests.RequestException: If the item cannot be fetched.
+    """
+    response = get_session(request_env).get(
+        f"{request_env.get('BASE_URL')}/Users/{request_env.get('USERID')}/Items/{item_id}",
+        params = {"api_key": request_env.get("API_KEY")},
+        timeout = request_env.get("TIMEOUT")
+    )
+    response.raise_for_status()
+    return { person["Id"]: get_primary_image_tag(person) for person in response.json().get("People") or [] if person.get("Id") }
+
+
+def get_recent_items(request_env: dict, source: str, limit: int) -> list:
+    """
+    Get the items users see first with their People: "resume" is continue watching, "played" the recently played movies and episodes
+    and "latest" the recently added items of the home screen.
+    Args:
+        request_env (dict): The environment configuration.
+        source (str): One of RECENT_SOURCES.
+        limit (int): Items to return.
+    Returns:
+        list: The items, most recent first, every one with its People in billing order.
+    Raises:
+        requests.RequestException: If the items cannot be fetched.
+    """
+    url = f"{request_env.get('BASE_URL')}/Users/{request_env.get('USERID')}/Items"
+    params = {"api_key": request_env.get("API_KEY"), "Limit": limit, "Fields": "People", "EnableImages": "false", "EnableUserData": "false"}
+    if source == "resume":
+        url += "/Resume"
+        params["MediaTypes"] = "Video"
+    elif source == "played":
+        params.update({"SortBy": "DatePlayed", "SortOrder": "Descending", "Filters": "IsPlayed", "Recursive": "true", "IncludeItemTypes": "Movie,Episode"})
+    elif source == "latest":
+        url += "/Latest"
+    else:
+        raise ValueError(f"Unknown source {source!r}, expected one of {', '.join(RECENT_SOURCES)}")
+    response = get_session(request_env).get(url, params = params, timeout = request_env.get("TIMEOUT"))
+    response.raise_for_status()
+    data = response.json()
+    return data if isinstance(data, list) else data.get("Items") or [] # /Latest answers a bare list
+
+
+def get_image_tags(request_env: dict, ids: list, batch_size: int = 100) -> dict:
+    """
+    Look up the current primary image tag of many persons, batch_size of them per /Items?Ids= request.
+    Args:
+        request_env (dict): The environment configuration.
+        ids (list): The crew/cast IDs to look up.
+        batch_size (int): IDs per request, kept well below URL length limits of reverse proxies.
+    Returns:
+        dict: Crew ID to (primary image tag or None, name), persons Jellyfin no longer knows are left out.
+    Raises:
+        requests.RequestException: If a batch cannot be fetched.
+    """
+    ids = list(ids)
+    tags = {}
+    for start in range(0, len(ids), batch_size):
+        response = get_session(request_env).get(
+            f"{request_env.get('BASE_URL')}/Users/{request_env.get('USERID')}/Items",
+            params = {
+                "api_key": request_env.get("API_KEY"),
+                "Ids": ",".join(ids[start:start + batch_size]),
+                "EnableImageTypes": "Primary",
+                "ImageTypeLimit": 1,
+                "EnableUserData": "false",
+                "EnableTotalRecordCount": "false"
+            },
+            timeout = request_env.get("TIMEOUT")
+        )
+        response.raise_for_status()
+        for item in response.json().get("Items") or []:
+            if item.get("Id"):
+                tags[item["Id"]] = (get_primary_image_tag(item), item.get("Name"))
+    return tags
+
+
+def get_warm_request(request_env: dict, person_id: str) -> tuple:
+    """
+    Build the request that warms a person, WARM_STRATEGY picks how much Jellyfin has to send back:
+    "full" GETs the whole detail DTO, "minimal" asks /Items for the person without any optional field,
+    "headers" GETs the detail DTO but hangs up once the headers arrive (Jellyfin does not route HEAD on the item endpoints, the cost is that the connection is not reused), and "image" GETs the primary image itself.
+    Shared by both engines so they send the exact same requests.
+    Args:
+        request_env (dict): The environment configuration, reads WARM_STRATEGY.
+        person_id (str): The crew/cast ID.
+    Returns:
+        tuple: (url, params, read_body, terminal statuses), read_body is False when only the headers are wanted and a terminal status is a final answer and not a failure, such as 404 for a person without a portrait.
+    """
+    strategy = request_env.get("WARM_STRATEGY", "full")
+    base_url = request_env.get("BASE_URL")
+    params = {"api_key": request_env.get("API_KEY")}
+    if strategy == "minimal":
+        params.update({"Ids": person_id, "Fields": "", "EnableImages": "false", "EnableUserData": "false", "EnableTotalRecordCount": "false"})
+        return f"{base_url}/Users/{request_env.get('USERID')}/Items", params, True, ()
+    if strategy == "image":
+        return f"{base_url}/Items/{person_id}/Images/Primary", params, True, (404,)
+    if strategy not in WARM_STRATEGIES:
+        raise ValueError(f"Unknown WARM_STRATEGY {strategy!r}, expected one of {', '.join(WARM_STRATEGIES)}")
+    return f"{base_url}/Users/{request_env.get('USERID')}/Items/{person_id}", params, strategy != "headers", ()
+
+
+def warm_person(request_env: dict, person_id: str) -> dict:
+    """
+    Single warm-up request for a cast or crew member, retrying is left to the engine's retry scheduler.
+    The body is streamed and discarded chunk by chunk, only its size is kept.
+    Args:
+        request_env (dict): The environment configuration.
+        person_id (str): The crew/cast ID of the person to fetch details for.
+    Returns:
+        dict: The attempt result, see retry.attempt_result().
+    """
+    url, params, read_body, terminal = get_warm_request(request_env, person_id)
+    size = 0
+    try:
+        detail_response = get_session(request_env).get(url, params = params, timeout = request_env.get("TIMEOUT"), stream = True)
+        try:
+            if read_body:
+                # Read to the end, even an error body, so the connection goes back to the pool
+                size = sum(len(chunk) for chunk in detail_response.iter_content(chunk_size = 65536))
+        finally:
+            detail_response.close()
+    except requests.RequestException as e:
+        return retry.attempt_result(error = str(e) or type(e).__name__, exception = type(e).__name__)
+    if detail_response.ok or detail_response.status_code in terminal:
+        return retry.attempt_result(detail_response.status_code, size = size, terminal = detail_response.status_code in terminal)
+    return retry.attempt_result(
+        detail_response.status_code,
+        f"{detail_response.status_code} {detail_response.reason}",
+        detail_response.headers.get("Retry-After"),
+        size
+    )
+
@@ -0,0 +1,227 @@
+"""
+This module warms the reverse proxy or CDN in front of Jellyfin: the primary image of every warmed person is fetched at each IMAGE_VARIANTS
+size and quality the web client asks for, so the cast grid is served from the proxy cache on its first view instead of being resized by Jellyfin.
+"""
+import threading
+from urllib.parse import parse_qsl
+import requests
+from fetch_request import fetch_request
+from retry import retry
+from shard import shard
+
+CACHE_STATUS_HEADERS = ("X-Cache-Status", "CF-Cache-Status", "X-Cache") # nginx, Cloudflare, Varnish/CloudFront
+CHUNK_SIZE = 65536 # Image bodies are read and dropped in chunks of this size, never held whole
+
+
+def parse_variants(variants: str) -> list:
+    """
+    Parse IMAGE_VARIANTS, query strings separated by ";" such as "fillHeight=396&fillWidth=264&quality=96;fillHeight=792&fillWidth=528&quality=96".
+    Args:
+        variants (str): The IMAGE_VARIANTS setting, empty for none.
+    Returns:
+        list: The query strings, in the order given.
+    Raises:
+        ValueError: If an entry is not a query string.
+    """
+    parsed = []
+    for variant in filter(None, (part.strip().lstrip("?") for part in (variants or "").split(";"))):
+        try:
+            parse_qsl(variant, strict_parsing = True)
+        except ValueError as e:
+            raise ValueError(f"Invalid IMAGE_VARIANTS entry '{variant}', expected a query string such as fillHeight=396&quality=96") from e
+        parsed.append(variant)
+    return parsed
+
+
+def variant_url(base_url: str, person_id: str, image_tag: str, variant: str) -> str:
+    """
+    Spell the image URL the way the web client does, the proxy caches it under that exact URL.
+    Args:
+        base_url (str): IMAGE_BASE_URL, or BASE_URL.
+        person_id (str): The crew/cast ID.
+        image_tag (str): The primary image tag from the listing.
+        variant (str): One IMAGE_VARIANTS query string, a {tag} placeholder sets where the tag goes, otherwise it goes last.
+    Returns:
+        str: The URL of the variant, without api_key so the cache key matches the web client's.
+    """
+    query = variant.replace("{tag}", image_tag) if "{tag}" in variant else f"{variant}&tag={image_tag}"
+    return f"{base_url}/Items/{person_id}/Images/Primary?{query}"
+
+
+def conditional_headers(validator: tuple) -> dict:
+    """
+    Args:
+        validator (tuple): (ETag, Last-Modified) the proxy sent for the variant last time, None if it was never fetched.
+    Returns:
+        dict: If-None-Match and If-Modified-Since headers, empty for an unconditional fetch.
+    """
+    etag, last_modified = validator or (None, None)
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+def cache_hit(headers) -> bool:
+    """
+    Args:
+        headers (Mapping): Response headers, case insensitive.
+    Returns:
+        bool: True if the proxy says it answered from its cache.
+    """
+    return any("HIT" in (headers.get(name) or "").upper() for name in CACHE_STATUS_HEADERS)
+
+
+class ImageCache(shard.ShardResult):
+    """
+    Second stage of a run, fetches every IMAGE_VARIANTS variant of the persons the first stage warmed.
+    A variant fetched by an earlier run is requested conditionally, a 304 means the proxy still holds it and no body is sent.
+    The worker functions plug into either engine through their `work` argument.
+    """
+    def __init__(self, request_env: dict, crew: dict, validators: dict = None):
+        """
+        Args:
+            request_env (dict): The environment configuration, reads IMAGE_VARIANTS and IMAGE_BASE_URL.
+            crew (dict): Person ID to primary image tag, persons without a tag have no image to fetch.
+            validators (dict): Variant URL to (ETag, Last-Modified) from earlier runs, see state_store.StateStore.get_image_validators().
+        """
+        self.variants = parse_variants(request_env.get("IMAGE_VARIANTS"))
+        self.base_url = (request_env.get("IMAGE_BASE_URL") or request_env.get("BASE_URL")).rstrip("/")
+        self.crew = crew
+        self.validators = validators or {}
+        self.updated = {} # Validators sent by the proxy during this run, to be stored for the next one
+        self.done = set() # Variant URLs fetched this run, a retried person does not fetch them again
+        self.counts = { "fetched": 0, "not_modified": 0, "hits": 0, "failed": 0 }
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+
+    def merge(self, other: "ImageCache") -> None:
+        """
+        Add the variants fetched by another run, such as a shard that ran in parallel.
+        Args:
+            other (ImageCache): The finished run to add.
+        Returns:
+            None
+        """
+        with self.lock:
+            for name, count in other.counts.items():
+                self.counts[name] += count
+            self.bytes += other.bytes
+            self.updated.update(other.updated)
+
+
+    def urls(self, person_id: str) -> list:
+        """
+        Args:
+            person_id (str): The crew/cast ID.
+        Returns:
+            list: The variant URLs still to fetch for the person, empty if they have no image tag.
+        """
+        image_tag = self.crew.get(person_id)
+        if not image_tag:
+            return []
+        return [url for url in (variant_url(self.base_url, person_id, image_tag, variant) for variant in self.variants) if url not in self.done]
+
+
+    def record(self, url: str, status: int, headers, size: int) -> None:
+        """
+        Count a fetched variant and keep the validators the proxy sent, called from every worker thread.
+        Args:
+            url (str): The variant URL.
+            status (int): 304 if the proxy still held it, 2xx otherwise.
+            headers (Mapping): The response headers.
+            size (int): Body bytes read.
+        Returns:
+            None
+        """
+        with self.lock:
+            self.done.add(url)
+            if status == 304:
+                self.counts["not_modified"] += 1
+            else:
+                self.counts["fetched"] += 1
+                self.bytes += size
+                validator = (headers.get("ETag"), headers.get("Last-Modified"))
+                if any(validator):
+                    self.updated[url] = validator
+            if cache_hit(headers):
+                self.counts["hits"] += 1
+
+
+    def fail(self, result: dict) -> dict:
+        """
+        Count a failed variant.
+        Args:
+            result (dict): The attempt result of the failed fetch.
+        Returns:
+            dict: The same result, the whole person is retried if it is worth retrying.
+        """
+        with self.lock:
+            self.counts["failed"] += 1
+        return result
+
+
+    def warm(self, request_env: dict, person_id: str) -> dict:
+        """
+        Thread engine worker, fetch every variant of the person through the proxy and drop the bodies as they stream in.
+        Args:
+            request_env (dict): The environment configuration.
+            person_id (str): The crew/cast ID.
+        Returns:
+            dict: The attempt result, ok once every variant was fetched or not modified.
+        """
+        size = 0
+        for url in self.urls(person_id):
+            try:
+                response = fetch_request.get_session(request_env).get(
+                    url, headers = conditional_headers(self.validators.get(url)), timeout = request_env.get("TIMEOUT"), stream = True
+                )
+                with response:
+                    body = sum(len(chunk) for chunk in response.iter_content(chunk_size = CHUNK_SIZE))
+            except requests.RequestException as e:
+                return self.fail(retry.attempt_result(error = str(e) or type(e).__name__, size = size, exception = type(e).__name__))
+            if response.status_code != 304 and not response.ok:
+                return self.fail(retry.attempt_result(response.status_code, f"{response.status_code} {response.reason}", response.headers.get("Retry-After"), size))
+            self.record(url, response.status_code, response.headers, body)
+            size += body
+        return retry.attempt_result(200, size = size)
+
+
+    async def warm_async(self, client, request_env: dict, person_id: str) -> dict:
+        """
+        Async engine worker, same as warm().
+        Args:
+            client (httpx.AsyncClient): The shared client.
+            request_env (dict): The environment configuration.
+            person_id (str): The crew/cast ID.
+        Returns:
+            dict: The attempt result, ok once every variant was fetched or not modified.
+        """
+        import httpx
+
+        size = 0
+        for url in self.urls(person_id):
+            try:
+                async with client.stream("GET", url, headers = conditional_headers(self.validators.get(url))) as response:
+                    body = 0
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        body += len(chunk)
+            except httpx.HTTPError as e:
+                return self.fail(retry.attempt_result(error = str(e) or type(e).__name__, size = size, exception = type(e).__name__))
+            if response.status_code != 304 and not response.is_success:
+                return self.fail(retry.attempt_result(response.status_code, f"{response.status_code} {response.reason_phrase}", response.headers.get("Retry-After"), size))
+            self.record(url, response.status_code, response.headers, body)
+            size += body
+        return retry.attempt_result(200, size = size)
+
+
+    def summary(self) -> str:
+        """
+        Returns:
+            str: One line with the variants fetched, not modified, served by the proxy cache and failed.
+        """
+        return (f"{self.counts['fetched']} variants fetched ({self.bytes / 1048576:.1f} MiB), {self.counts['not_modified']} not modified, "
+                f"{self.counts['hits']} already in the proxy cache, {self.counts['failed']} failed.")
@@ -0,0 +1,126 @@
+"""
+This module keeps an append-only journal of the persons a run finished, so an interrupted run can be resumed with --resume.
+"""
+import os
+import threading
+import time
+
+OK = "ok"
+FAILED = "failed"
+
+
+def journal_path(request_env: dict, path: tuple = ()) -> str:
+    """
+    The journal file of a run, targets and shard processes each get their own so they never write to the same file.
+    Args:
+        request_env (dict): The environment configuration, reads JOURNAL and TARGET_NAME.
+        path (tuple): The shard of the run, see shard.owns().
+    Returns:
+        str: The path, empty if JOURNAL is disabled.
+    """
+    base = request_env.get("JOURNAL")
+    if not base:
+        return ""
+    root, extension = os.path.splitext(base)
+    parts = [request_env.get("TARGET_NAME")] + [f"{index + 1}-{count}" for index, count in path]
+    return ".".join([root, *filter(None, parts)]) + extension
+
+
+def load(path: str) -> tuple:
+    """
+    Read a journal back, a line cut short by a crash is ignored.
+    Args:
+        path (str): The journal file.
+    Returns:
+        tuple: (completed IDs, failed IDs) as sets, a person that failed and was completed later only counts as completed.
+    """
+    completed, failed = set(), set()
+    try:
+        with open(path, encoding = "utf-8") as file:
+            for line in file:
+                if not line.endswith("\n"):
+                    break
+                outcome, _, person_id = line.rstrip("\n").partition("\t")
+                if outcome == OK:
+                    completed.add(person_id)
+                    failed.discard(person_id)
+                elif outcome == FAILED and person_id not in completed:
+                    failed.add(person_id)
+    except FileNotFoundError:
+        pass
+    return completed, failed
+
+
+class Journal:
+    """
+    Buffers outcomes and appends them in batches, so a crash loses at most one batch instead of paying an fsync per person.
+    """
+    def __init__(self, path: str, resume: bool = False, batch_size: int = 500, interval: float = 5.0, clock = time.monotonic):
+        """
+        Args:
+            path (str): The journal file.
+            resume (bool): Keep appending to an existing journal instead of starting a new one.
+            batch_size (int): Flush once this many outcomes are buffered.
+            interval (float): Flush once the oldest buffered outcome is this many seconds old.
+            clock (callable): Monotonic clock, overridden by tests.
+        """
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.clock = clock
+        self.buffer = []
+        self.flushed = clock()
+        self.lock = threading.Lock()
+        self.file = open(path, "a" if resume else "w", encoding = "utf-8")
+
+
+    def record(self, person_id: str, outcome: str) -> None:
+        """
+        Buffer the final outcome of a person, called from every worker.
+        Args:
+            person_id (str): The crew/cast ID.
+            outcome (str): OK or FAILED, "retry" is not final and ignored.
+        Returns:
+            None
+        """
+        if outcome not in (OK, FAILED):
+            return
+        with self.lock:
+            self.buffer.append(f"{outcome}\t{person_id}\n")
+            if len(self.buffer) >= self.batch_size or self.clock() - self.flushed >= self.interval:
+                self._flush()
+
+
+    def _flush(self) -> None:
+        # Called with the lock held
+        if self.buffer:
+            self.file.write("".join(self.buffer))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.buffer = []
+        self.flushed = self.clock()
+
+
+    def flush(self) -> None:
+        """
+        Write and fsync everything buffered.
+        Returns:
+            None
+        """
+        with self.lock:
+            self._flush()
+
+
+    def close(self, remove: bool = False) -> None:
+        """
+        Flush and close the journal.
+        Args:
+            remove (bool): Delete the file, the run finished and there is nothing left to resume.
+        Returns:
+            None
+        """
+        with self.lock:
+            self._flush()
+            self.file.close()
+        if remove:
+            os.remove(self.path)
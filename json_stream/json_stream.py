@@ -0,0 +1,96 @@
+"""
+This module decodes a Jellyfin listing response one item at a time, so only the item being read is ever materialized.
+"""
+import codecs
+import json
+import re
+
+ITEMS_START = re.compile(r'"Items"\s*:\s*\[')
+TOTAL_RECORD_COUNT = re.compile(r'"TotalRecordCount"\s*:\s*(\d+)')
+SEPARATORS = " \t\r\n,"
+
+
+class ListingStream:
+    """
+    Incremental parser of a {"Items": [...], "TotalRecordCount": N} body fed by raw byte chunks (e.g. response.iter_content()).
+    Items are decoded one by one with json.JSONDecoder.raw_decode and already read text is dropped as it goes.
+    total_count is filled in once items() is exhausted, Jellyfin sends it after the Items array.
+    """
+    def __init__(self, chunks):
+        """
+        Args:
+            chunks (iterable): Bytes of the response body, in order.
+        """
+        self.chunks = iter(chunks)
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.total_count = None
+        self.decoder = json.JSONDecoder()
+
+
+    def read(self) -> bool:
+        """
+        Append the next chunk to the buffer.
+        Returns:
+            bool: False once the body is exhausted.
+        """
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.buffer += self.text.decode(b"", final = True)
+            return False
+        self.buffer += self.text.decode(chunk)
+        return True
+
+
+    def note_total(self, text: str) -> None:
+        """
+        Pick TotalRecordCount out of the text around the Items array.
+        """
+        match = TOTAL_RECORD_COUNT.search(text)
+        if match:
+            self.total_count = int(match.group(1))
+
+
+    def items(self):
+        """
+        Yields:
+            dict: Every item of the Items array, a body without Items yields nothing.
+        Raises:
+            json.JSONDecodeError: If the body is malformed or cut short.
+        """
+        match = ITEMS_START.search(self.buffer)
+        while not match:
+            if not self.read():
+                self.note_total(self.buffer)
+                return
+            match = ITEMS_START.search(self.buffer)
+        self.note_total(self.buffer[:match.start()])
+        position = match.end()
+
+        while True:
+            while position < len(self.buffer) and self.buffer[position] in SEPARATORS:
+                position += 1
+            if position == len(self.buffer):
+                if not self.read():
+                    raise json.JSONDecodeError("Unterminated Items array", self.buffer, position)
+                continue
+            if self.buffer[position] == "]":
+                position += 1
+                break
+            try:
+                item, end = self.decoder.raw_decode(self.buffer, position)
+            except json.JSONDecodeError:
+                # Most likely the item is split across chunks, only an error once there is nothing left to read
+                if not self.read():
+                    raise
+                continue
+            yield item
+            position = end
+            if position > 65536:
+                self.buffer = self.buffer[position:]
+                position = 0
+
+        # Only the short tail is left, read it whole for TotalRecordCount
+        while self.read():
+            pass
+        self.note_total(self.buffer[position:])
@@ -3,14 +3,107 @@ This module loads environment variables from a .env file and provides a dictiona
 """
 import os
 from dotenv import load_dotenv
+from fetch_request import fetch_request
+from image_cache import image_cache
+from rate_limit import rate_limit
+from shard import shard
+
+
+class ConfigError(ValueError):
+    """
+    The configuration cannot be used, the message says which setting to fix.
+    """
+
+
+def _number(name: str, value, convert):
+    """
+    Convert a numeric setting, naming it in the error instead of failing with a bare ValueError.
+    Args:
+        name (str): The variable, as written in .env.
+        value: Its value, or the default.
+        convert (type): int or float.
+    Returns:
+        int | float: The converted value.
+    Raises:
+        ConfigError: If the value is not a number.
+    """
+    try:
+        return convert(value)
+    except (TypeError, ValueError) as e:
+        kind = "a whole number" if convert is int else "a number"
+        raise ConfigError(f"{name} must be {kind} in your .env file, got {value!r}.") from e
+
+
+def _boolean(name: str, value: str) -> bool:
+    """
+    Convert a yes/no setting the same way for the shared and the per target values.
+    Args:
+        name (str): The variable, as written in .env.
+        value (str): Its value.
+    Returns:
+        bool: True for 1, true, yes or on and False for 0, false, no or off, in any case.
+    Raises:
+        ConfigError: If the value is neither.
+    """
+    if value.strip().lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.strip().lower() in ("0", "false", "no", "off"):
+        return False
+    raise ConfigError(f"{name} must be true or false in your .env file, got {value!r}.")
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """
+    Read a yes/no setting from the environment, see _boolean().
+    """
+    value = os.getenv(name)
+    return default if value is None else _boolean(name, value)
+
+
+def _env_int(name: str, default: int) -> int:
+    """
+    Read a whole number setting from the environment, see _number().
+    """
+    return _number(name, os.getenv(name, default), int)
+
+
+def _env_float(name: str, default: float) -> float:
+    """
+    Read a numeric setting from the environment, see _number().
+    """
+    return _number(name, os.getenv(name, default), float)
+
 
 def load_env() -> dict:
     """
     Load environment variables from a .env file and return a dictionary with the configuration.
     CORE COUNT is set to the maximum number of CPU cores if "MAX" is specified, otherwise it defaults to 4.
-    Exit if required variables are missing.
+    POOL_MAXSIZE defaults to 1 connection per thread and KEEP_ALIVE defaults to true.
+    ENGINE defaults to "thread", ASYNC_CONCURRENCY (only used by ENGINE=async) defaults to 64.
+    HTTP2 defaults to false, with HTTP2_CONNECTIONS=2 connections when it is on.
+    SUBMIT_WINDOW defaults to 0, twice the thread count.
+    PROGRESS_INTERVAL defaults to 0.25 seconds on a terminal, PROGRESS_LOG_INTERVAL to 30 seconds otherwise.
+    SHARD defaults to empty (the whole library), PROCESSES to 1.
+    JOURNAL defaults to "journal.log" flushed every 500 persons (JOURNAL_BATCH), set it empty to disable.
+    STATE_DB defaults to "state.db", set it empty to warm everyone on every run.
+    INCREMENTAL defaults to false.
+    PAGE_SIZE defaults to 1000 persons per listing page.
+    LISTING_PARSER defaults to "stream".
+    TARGET_MODE defaults to "all".
+    WARM_STRATEGY defaults to "full".
+    VERIFY_ROUNDS defaults to 2 rounds, VERIFY_DELAY to 10 seconds.
+    PRIORITY_ITEMS defaults to 50 items per source.
+    IMAGE_VARIANTS defaults to empty, no image is fetched through the proxy, IMAGE_BASE_URL to BASE_URL.
+    ADAPTIVE defaults to false, between ADAPTIVE_MIN=2 and ADAPTIVE_MAX=64 requests, ADAPTIVE_TARGET_LATENCY=0 learns the target p95 from the run.
+    RATE_LIMIT defaults to 0 (unlimited), RATE_BURST to one second worth of RATE_LIMIT, RATE_SCHEDULE to no schedule.
+    MAX_ATTEMPTS defaults to 3 with a 1 to 60 second backoff, RETRY_BUDGET to 1000 retries per run, the breaker opens for 30 seconds after 20 failures in a row.
+    METRICS_JSON and METRICS_PROM default to empty, no report is written.
+    TARGETS defaults to empty, a single server. SHARED_CONCURRENCY defaults to 0, no limit across targets.
+    The --daemon endpoint listens on DAEMON_HOST=127.0.0.1 and DAEMON_PORT=8097 without a WEBHOOK_TOKEN, DAEMON_SCHEDULE defaults to "03:00".
     Returns:
         dict: A dictionary containing the environment variables.
+    Raises:
+        ConfigError: If required variables are missing or a setting is invalid.
     """
     load_dotenv()
     # Loading .env file
@@ -19,12 +112,144 @@ def load_env() -> dict:
         "BASE_URL": os.getenv("BASE_URL"),
         "USER": os.getenv("USER"),
         "USERID": os.getenv("USERID"),
-        "CORE_COUNT": os.cpu_count() if os.getenv("CORE_COUNT") == "MAX" else int(os.getenv("CORE_COUNT", 4)),
-        "TIMEOUT": 30
+        "CORE_COUNT": os.cpu_count() if os.getenv("CORE_COUNT") == "MAX" else _env_int("CORE_COUNT", 4),
+        "TIMEOUT": 30,
+        # Connection pooling, every worker thread keeps its own session with this many connections per host
+        "POOL_MAXSIZE": _env_int("POOL_MAXSIZE", 1),
+        "KEEP_ALIVE": _env_bool("KEEP_ALIVE", True),
+        # "thread" runs CORE_COUNT threads, "async" runs ASYNC_CONCURRENCY requests on one event loop
+        "ENGINE": os.getenv("ENGINE", "thread"),
+        "ASYNC_CONCURRENCY": _env_int("ASYNC_CONCURRENCY", 64),
+        # ENGINE=async multiplexes its requests as HTTP/2 streams over this many connections, HTTP/1.1 if the server does not negotiate it
+        "HTTP2": _env_bool("HTTP2", False),
+        "HTTP2_CONNECTIONS": _env_int("HTTP2_CONNECTIONS", 2),
+        # Attempts queued on the thread pool at once, 0 picks twice the thread count
+        "SUBMIT_WINDOW": _env_int("SUBMIT_WINDOW", 0),
+        # Seconds between redraws of the progress line on a terminal, and between structured progress lines when stdout is a log pipe
+        "PROGRESS_INTERVAL": _env_float("PROGRESS_INTERVAL", 0.25),
+        "PROGRESS_LOG_INTERVAL": _env_float("PROGRESS_LOG_INTERVAL", 30),
+        # K/N hash partition of the library warmed by this host, and local processes splitting it further
+        "SHARD": os.getenv("SHARD", ""),
+        "PROCESSES": _env_int("PROCESSES", 1),
+        # SQLite file remembering who was already warmed, empty to disable
+        "STATE_DB": os.getenv("STATE_DB", "state.db"),
+        # Only list the People of items created since the last complete run, the watermark is kept in STATE_DB
+        "INCREMENTAL": _env_bool("INCREMENTAL", False),
+        # Append-only record of finished persons while a run goes, kept for --resume if the run is interrupted
+        "JOURNAL": os.getenv("JOURNAL", "journal.log"),
+        "JOURNAL_BATCH": _env_int("JOURNAL_BATCH", 500),
+        # Persons listed per /emby/Persons page, warming starts as soon as the first page arrives
+        "PAGE_SIZE": _env_int("PAGE_SIZE", 1000),
+        # "stream" decodes listing pages item by item off the socket, "orjson" or "json" load the whole page at once
+        "LISTING_PARSER": os.getenv("LISTING_PARSER", "stream"),
+        # "all" warms everyone, "missing" only persons without a primary image or whose image tag changed since STATE_DB saw them warmed
+        "TARGET_MODE": os.getenv("TARGET_MODE", "all"),
+        # Request sent to warm a person: "full" detail GET, "minimal" fields, "headers" only or the "image" itself
+        "WARM_STRATEGY": os.getenv("WARM_STRATEGY", "full"),
+        # Rounds of looking up persons warmed without a portrait and warming the still blank ones again, 0 to skip, and seconds to wait before each lookup
+        "VERIFY_ROUNDS": _env_int("VERIFY_ROUNDS", 2),
+        "VERIFY_DELAY": _env_float("VERIFY_DELAY", 10),
+        # Continue watching, recently played and recently added items whose People are warmed before the rest, 0 for listing order
+        "PRIORITY_ITEMS": _env_int("PRIORITY_ITEMS", 50),
+        # Query strings of the primary image sizes the web client asks for, fetched through the reverse proxy at IMAGE_BASE_URL after warming
+        "IMAGE_VARIANTS": os.getenv("IMAGE_VARIANTS", ""),
+        "IMAGE_BASE_URL": os.getenv("IMAGE_BASE_URL", ""),
+        # Adaptive concurrency, in-flight requests follow the latency and error rate of the server
+        "ADAPTIVE": _env_bool("ADAPTIVE", False),
+        "ADAPTIVE_MIN": _env_int("ADAPTIVE_MIN", 2),
+        "ADAPTIVE_MAX": _env_int("ADAPTIVE_MAX", 64),
+        "ADAPTIVE_TARGET_LATENCY": _env_float("ADAPTIVE_TARGET_LATENCY", 0),
+        # Requests per second shared by every worker, 0 for unlimited, RATE_SCHEDULE overrides it by time of day
+        "RATE_LIMIT": _env_float("RATE_LIMIT", 0),
+        "RATE_BURST": _env_float("RATE_BURST", 0),
+        "RATE_SCHEDULE": os.getenv("RATE_SCHEDULE", ""),
+        # Failed requests wait in a retry queue with exponential backoff and jitter instead of blocking a worker
+        "MAX_ATTEMPTS": _env_int("MAX_ATTEMPTS", 3),
+        "RETRY_BASE_DELAY": _env_float("RETRY_BASE_DELAY", 1),
+        "RETRY_MAX_DELAY": _env_float("RETRY_MAX_DELAY", 60),
+        "RETRY_BUDGET": _env_int("RETRY_BUDGET", 1000),
+        "BREAKER_THRESHOLD": _env_int("BREAKER_THRESHOLD", 20),
+        "BREAKER_COOLDOWN": _env_float("BREAKER_COOLDOWN", 30),
+        # Where to write the run report, empty to skip
+        "METRICS_JSON": os.getenv("METRICS_JSON", ""),
+        "METRICS_PROM": os.getenv("METRICS_PROM", ""),
+        # Several servers or users warmed at once, see load_targets(), and requests in flight across all of them (0 for no shared limit)
+        "TARGETS": os.getenv("TARGETS", ""),
+        "SHARED_CONCURRENCY": _env_int("SHARED_CONCURRENCY", 0),
+        # --daemon webhook endpoint, its optional shared secret and the daily times of its incremental runs
+        "DAEMON_HOST": os.getenv("DAEMON_HOST", "127.0.0.1"),
+        "DAEMON_PORT": _env_int("DAEMON_PORT", 8097),
+        "WEBHOOK_TOKEN": os.getenv("WEBHOOK_TOKEN", ""),
+        "DAEMON_SCHEDULE": os.getenv("DAEMON_SCHEDULE", "03:00")
     }
+    env["TARGETS"] = load_targets(env)
 
-    if not env.get("API_KEY") or not env.get("BASE_URL") or not env.get("USER") or not env.get("USERID"):
-        print("Please set API_KEY, BASE_URL, USER, and USERID in your .env file.")
-        exit(1)
-
+    validate(env)
     return env
+
+
+def validate(env: dict) -> None:
+    """
+    Check the shared configuration and every target, also after command line flags or an embedding program changed them.
+    Args:
+        env (dict): The configuration, as returned by load_env().
+    Returns:
+        None
+    Raises:
+        ConfigError: If required variables are missing or a setting is invalid.
+    """
+    for target in env.get("TARGETS") or []:
+        prefix = f"{target['TARGET_NAME'].upper()}_"
+        if not target.get("API_KEY") or not target.get("BASE_URL") or not target.get("USER") or not target.get("USERID"):
+            raise ConfigError(f"Please set {prefix}API_KEY, {prefix}BASE_URL, {prefix}USER, and {prefix}USERID (or their shared defaults) in your .env file.")
+    if not env.get("TARGETS") and (not env.get("API_KEY") or not env.get("BASE_URL") or not env.get("USER") or not env.get("USERID")):
+        raise ConfigError("Please set API_KEY, BASE_URL, USER, and USERID in your .env file.")
+
+    for config in [env, *(env.get("TARGETS") or [])]:
+        try:
+            rate_limit.parse_schedule(config.get("RATE_SCHEDULE"))
+            if config.get("SHARD"):
+                shard.parse_shard(config.get("SHARD"))
+            image_cache.parse_variants(config.get("IMAGE_VARIANTS"))
+        except ValueError as e:
+            raise ConfigError(f"{e} in your .env file.") from e
+
+        if config.get("WARM_STRATEGY", "full") not in fetch_request.WARM_STRATEGIES:
+            raise ConfigError(f"WARM_STRATEGY must be one of {', '.join(fetch_request.WARM_STRATEGIES)} in your .env file.")
+        if config.get("HTTP2") and config.get("ENGINE") != "async":
+            raise ConfigError("HTTP2 needs ENGINE=async, the thread engine only speaks HTTP/1.1.")
+        if config.get("INCREMENTAL") and not config.get("STATE_DB"):
+            raise ConfigError("INCREMENTAL needs STATE_DB to remember when the last run happened.")
+
+    if env.get("TARGETS") and env.get("PROCESSES", 1) > 1:
+        raise ConfigError("PROCESSES cannot be combined with TARGETS, use --shard to split the targets over hosts.")
+
+
+def load_targets(env: dict) -> list:
+    """
+    Build one configuration per name listed in TARGETS, such as "home,cabin".
+    Every setting can be overridden per target by prefixing it with the upper case name, e.g. CABIN_BASE_URL or CABIN_RATE_LIMIT,
+    anything not overridden falls back to the shared value.
+    Args:
+        env (dict): The shared configuration, TARGETS still holds the comma separated names.
+    Returns:
+        list: One configuration dict per target with its name in TARGET_NAME, empty if TARGETS is not set.
+    """
+    targets = []
+    for name in filter(None, (part.strip() for part in env.get("TARGETS", "").split(","))):
+        target = { key: value for key, value in env.items() if key != "TARGETS" }
+        for key, default in env.items():
+            value = os.getenv(f"{name.upper()}_{key}")
+            if value is None or key == "TARGETS":
+                continue
+            if key == "CORE_COUNT":
+                target[key] = os.cpu_count() if value == "MAX" else _number(f"{name.upper()}_{key}", value, int)
+            elif isinstance(default, bool):
+                target[key] = _boolean(f"{name.upper()}_{key}", value)
+            elif isinstance(default, (int, float)):
+                target[key] = _number(f"{name.upper()}_{key}", value, type(default))
+            else:
+                target[key] = value
+        target["TARGET_NAME"] = name
+        targets.append(target)
+    return targets
@@ -1,49 +1,130 @@
 """
 This script fetches all cast and crew members from a Jellyfin server using multithreading.
+Only argparse is loaded up front, the warmer and its dependencies are imported once the arguments are parsed so --help answers at once.
+Embed warmer.Warmer instead of calling main() to run many warm cycles in one process.
 """
+import argparse
+import sys
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from fetch_request import fetch_request
-from load_env import load_env
 
-env = load_env.load_env()
+STRATEGIES = ("full", "minimal", "headers", "image") # fetch_request.WARM_STRATEGIES, spelled out so parsing does not import requests
 
-def main():
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """
+    Parse command line arguments, anything not given falls back to the .env configuration.
+    Args:
+        argv (list): Arguments to parse, defaults to sys.argv.
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description = "Warm Jellyfin cast and crew portraits.")
+    parser.add_argument("--engine", choices = ["thread", "async"], help = "thread: one OS thread per request (CORE_COUNT), async: one event loop (ASYNC_CONCURRENCY)")
+    parser.add_argument("--target", choices = ["all", "missing"], help = "all: warm every person, missing: only persons whose primary image is missing or changed")
+    parser.add_argument("--strategy", choices = STRATEGIES, help = "Request that warms a person, see WARM_STRATEGY")
+    parser.add_argument("--adaptive", action = "store_true", help = "Adjust in-flight requests between ADAPTIVE_MIN and ADAPTIVE_MAX from observed latency and errors")
+    parser.add_argument("--full", action = "store_true", help = "Warm every person, even the ones STATE_DB says are already warmed")
+    parser.add_argument("--incremental", action = "store_true", help = "Only warm the cast and crew of items added since the last complete incremental run")
+    parser.add_argument("--resume", action = "store_true", help = "Skip the persons an interrupted run already finished, read from JOURNAL")
+    parser.add_argument("--shard", help = "K/N, only warm the K-th of N hash partitions of the library, run one per host")
+    parser.add_argument("--processes", type = int, help = "Split the warm (or this host's --shard) over this many local processes")
+    parser.add_argument("--daemon", action = "store_true", help = "Keep running, warm new items from Jellyfin webhooks and run incrementally at every DAEMON_SCHEDULE time")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> int:
     """
     Main function to fetch all cast and crew members from Jellyfin.
+    Args:
+        argv (list): Arguments to parse, defaults to sys.argv.
+    Returns:
+        int: Exit status, 0 when the run completed, 1 when the configuration or the listing failed.
     """
+    args = parse_args(argv)
+    overrides = {}
+    if args.engine:
+        overrides["ENGINE"] = args.engine
+    if args.target:
+        overrides["TARGET_MODE"] = args.target
+    if args.strategy:
+        overrides["WARM_STRATEGY"] = args.strategy
+    if args.adaptive:
+        overrides["ADAPTIVE"] = True
+    if args.shard:
+        overrides["SHARD"] = args.shard
+    if args.processes:
+        overrides["PROCESSES"] = args.processes
+    if args.incremental:
+        overrides["INCREMENTAL"] = True
+
+    # Imported here so --help and bad flags do not wait for requests and the rest of the engine
+    from fetch_request import fetch_request
+    from load_env import load_env
+    from shard import shard
+    from warmer import warmer
+
+    try:
+        # Command line flags win over the .env file, for every target too
+        run_warmer = warmer.Warmer(overrides = overrides)
+    except load_env.ConfigError as e:
+        print(e)
+        return 1
+    env = run_warmer.request_env
+
+    if args.daemon:
+        if env.get("TARGETS") or run_warmer.path or env.get("PROCESSES", 1) > 1:
+            print("--daemon warms a single target in one process, it cannot be combined with TARGETS, SHARD or PROCESSES.")
+            return 1
+        # Imported here so a one-off run does not load the HTTP server
+        from daemon import daemon
+        return daemon.serve(run_warmer)
+
     start_time = time.time()
-    ids = fetch_request.get_all_crew_ids(env)
-    if len(ids) == 0:
-        print("Did not find any cast and crew. Exiting...")
-        exit(0)
-    execute_requests(env, ids)
+    with run_warmer:
+        try:
+            results = run_warmer.warm(args.full, args.resume)
+        except (load_env.ConfigError, fetch_request.ListingError) as e:
+            print(e)
+            return 1
+
+    if sum(result["listed"] for _, result, _ in results) == 0:
+        print("No cast and crew were added since the last run." if env.get("INCREMENTAL") else "Did not find any cast and crew. Exiting...")
+        return 0
+    for request_env, result, seconds in results:
+        print_result(request_env, result, args.full, seconds)
     end_time = time.time()
-    print(f"\nProcessed {len(ids)} crew & cast in {end_time - start_time:.2f} seconds.")
+    sharded = f" in shard {shard.describe(run_warmer.path)}" if run_warmer.path else ""
+    across = f" across {len(results)} targets" if env.get("TARGETS") else ""
+    print(f"\nProcessed {sum(result['listed'] for _, result, _ in results)} crew & cast{across}{sharded} in {end_time - start_time:.2f} seconds.")
+    return 0
 
 
-def execute_requests(request_env: dict, ids: set) -> None:
+def print_result(request_env: dict, result: dict, full: bool, seconds: float = None) -> None:
     """
-    Execute the requests to fetch cast and crew details using multithreading.
+    Print the summary lines of one run, prefixed with the target name when several targets were warmed.
     Args:
-        ids (set): A set of crew/cast IDs to fetch details for.
+        request_env (dict): The environment configuration of the run.
+        result (dict): As returned by warmer.run().
+        full (bool): Whether --full was given.
+        seconds (float): How long the target took, only printed for targets.
     Returns:
         None
     """
-    total_count = len(ids)
-    completed_count = 0
-
-    # multithreaded fetching of cast and crew details
-    # Max threads on 12700K took about 9 minutes for 14TB media library to complete
-    with ThreadPoolExecutor(max_workers = request_env.get("CORE_COUNT")) as executor:
-        print(f"Fetching details with {request_env.get('CORE_COUNT')} threads and max timeout of {request_env.get('TIMEOUT')} seconds per request...")
-        futures = { executor.submit(fetch_request.get_cast_and_crew, env, person_id) for person_id in ids }
-        # Yield as they complete
-        for future in as_completed(futures):
-            completed_count += 1
-            print(f"\rProgress: {completed_count}/{total_count} ({completed_count/total_count*100:.1f}%)", end="", flush=True)
-            future.result()
+    prefix = f"[{request_env['TARGET_NAME']}] " if request_env.get("TARGET_NAME") else ""
+    if result["resumed"]:
+        print(f"\n{prefix}Resumed, skipped {result['resumed']} crew & cast the interrupted run already finished.", end="")
+    if request_env.get("STATE_DB") and not full:
+        print(f"\n{prefix}Skipped {result['listed'] - result['resumed'] - result['queued']} crew & cast already warmed (use --full to warm everyone).", end="")
+    if result["targeting"] is not None:
+        print(f"\n{prefix}Targeting: {result['targeting'].summary()}", end="")
+    if result.get("verification") is not None:
+        print(f"\n{prefix}Verification: {result['verification'].summary()}", end="")
+    if result.get("images") is not None:
+        print(f"\n{prefix}Images: {result['images'].summary()}", end="")
+    print(f"\n{prefix}Metrics: {result['metrics'].summary()}", end="")
+    if seconds is not None:
+        print(f"\n{prefix}Processed {result['listed']} crew & cast in {seconds:.2f} seconds.", end="")
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+This module collects run metrics on the request path and writes them as a JSON report and a node_exporter textfile.
+"""
+import collections
+import datetime
+import json
+import os
+import threading
+import time
+from concurrency import concurrency
+from shard import shard
+
+# Prometheus histogram buckets in seconds, TIMEOUT is 30 so the last real bucket catches everything but timeouts
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PREFIX = "jellyfin_fetch_crew"
+
+
+class RunMetrics(shard.ShardResult):
+    """
+    Thread safe counters of one run, fed by both engines.
+    """
+    def __init__(self, clock = time.monotonic):
+        """
+        Args:
+            clock (callable): Monotonic clock, overridden by tests.
+        """
+        self.clock = clock
+        self.started = clock()
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.finished = None
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.buckets = [0] * len(BUCKETS)
+        self.statuses = collections.Counter()
+        self.exceptions = collections.Counter()
+        self.outcomes = collections.Counter()
+        self.retries = 0
+        self.bytes = 0
+        self.throughput = collections.Counter() # Second since start to persons finished in it
+        self.phases = collections.defaultdict(float)
+        self.listed = 0
+        self.skipped_pages = 0 # Listing pages that kept failing, the persons on them were never seen
+
+
+    def merge(self, other: "RunMetrics") -> None:
+        """
+        Add the metrics of another run, such as a shard that ran in parallel, to this one.
+        Counters add up, phases ran side by side so the longest one is kept, throughput is aligned on the wall clock.
+        Args:
+            other (RunMetrics): The finished run to add.
+        Returns:
+            None
+        """
+        offset = round((other.started_at - self.started_at).total_seconds())
+        with self.lock:
+            self.latencies.extend(other.latencies)
+            self.buckets = [mine + theirs for mine, theirs in zip(self.buckets, other.buckets)]
+            self.statuses.update(other.statuses)
+            self.exceptions.update(other.exceptions)
+            self.outcomes.update(other.outcomes)
+            self.retries += other.retries
+            self.bytes += other.bytes
+            for second, count in other.throughput.items():
+                self.throughput[max(0, second + offset)] += count
+            for phase, seconds in other.phases.items():
+                self.phases[phase] = max(self.phases[phase], seconds)
+            self.listed += other.listed
+            self.skipped_pages += other.skipped_pages
+
+
+    def record_attempt(self, latency: float, result: dict) -> None:
+        """
+        Record one request.
+        Args:
+            latency (float): Seconds the request took.
+            result (dict): The attempt result, see retry.attempt_result().
+        Returns:
+            None
+        """
+        with self.lock:
+            self.latencies.append(latency)
+            for index, bound in enumerate(BUCKETS):
+                if latency <= bound:
+                    self.buckets[index] += 1
+                    break
+            if result.get("status") is not None:
+                self.statuses[result["status"]] += 1
+            else:
+                self.exceptions[result.get("exception") or "error"] += 1
+            self.bytes += result.get("bytes", 0)
+
+
+    def record_outcome(self, outcome: str) -> None:
+        """
+        Record what happened to a person after an attempt.
+        Args:
+            outcome (str): "ok", "retry" or "failed", as returned by RetryScheduler.settle().
+        Returns:
+            None
+        """
+        with self.lock:
+            if outcome == "retry":
+                self.retries += 1
+                return
+            self.outcomes[outcome] += 1
+            self.throughput[int(self.clock() - self.started)] += 1
+
+
+    def record_skipped_page(self) -> None:
+        """
+        Record a listing page given up on after its retries.
+        Returns:
+            None
+        """
+        with self.lock:
+            self.skipped_pages += 1
+
+
+    def add_phase(self, phase: str, seconds: float) -> None:
+        """
+        Add time spent in a phase such as "listing" or "warming".
+        Args:
+            phase (str): Name of the phase.
+            seconds (float): Time to add.
+        Returns:
+            None
+        """
+        with self.lock:
+            self.phases[phase] += seconds
+
+
+    def timed_iter(self, iterable, phase: str):
+        """
+        Pass items through while adding the time spent waiting on each one to a phase, used to time the streaming listing.
+        Args:
+            iterable (iterable): The items to time.
+            phase (str): Name of the phase.
+        Yields:
+            The items of iterable.
+        """
+        iterator = iter(iterable)
+        while True:
+            started = self.clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_phase(phase, self.clock() - started)
+                return
+            self.add_phase(phase, self.clock() - started)
+            yield item
+
+
+    def finish(self) -> None:
+        """
+        Mark the end of the run.
+        Returns:
+            None
+        """
+        self.finished = self.clock()
+
+
+    def report(self) -> dict:
+        """
+        Returns:
+            dict: Everything collected, the structure written as JSON.
+        """
+        with self.lock:
+            duration = (self.finished or self.clock()) - self.started
+            latencies = self.latencies
+            histogram = {}
+            cumulative = 0
+            for bound, count in zip(BUCKETS, self.buckets):
+                cumulative += count
+                histogram[str(bound)] = cumulative
+            histogram["+Inf"] = len(latencies)
+            return {
+                "started_at": self.started_at.isoformat(),
+                "duration_seconds": round(duration, 3),
+                "phases_seconds": { phase: round(seconds, 3) for phase, seconds in self.phases.items() },
+                "persons": {
+                    "listed": self.listed,
+                    "skipped_pages": self.skipped_pages,
+                    "warmed": self.outcomes["ok"],
+                    "failed": self.outcomes["failed"]
+                },
+                "requests": {
+                    "total": len(latencies),
+                    "by_status": { str(status): count for status, count in sorted(self.statuses.items()) },
+                    "exceptions": dict(self.exceptions),
+                    "retries": self.retries,
+                    "bytes": self.bytes,
+                    "bytes_per_request": round(self.bytes / len(latencies)) if latencies else 0,
+                    "per_second": round(len(latencies) / duration, 2) if duration else 0.0
+                },
+                "latency_seconds": {
+                    "p50": round(concurrency.percentile(latencies, 0.50), 4),
+                    "p95": round(concurrency.percentile(latencies, 0.95), 4),
+                    "p99": round(concurrency.percentile(latencies, 0.99), 4),
+                    "max": round(max(latencies, default = 0.0), 4),
+                    "sum": round(sum(latencies), 4),
+                    "histogram": histogram
+                },
+                "throughput": [[second, count] for second, count in sorted(self.throughput.items())]
+            }
+
+
+    def summary(self) -> str:
+        """
+        Returns:
+            str: One line for the console.
+        """
+        report = self.report()
+        latency = report["latency_seconds"]
+        return (f"{report['requests']['total']} requests ({report['requests']['per_second']}/s), {report['requests']['retries']} retries, "
+                f"{report['requests']['bytes_per_request']} bytes per request, "
+                f"latency p50 {latency['p50']}s p95 {latency['p95']}s p99 {latency['p99']}s.")
+
+
+class RequestsOnly:
+    """
+    Feeds the requests of a pass that warms persons already counted, such as a verification round, into a run without counting the persons twice.
+    Drop in for RunMetrics wherever an engine takes `run_metrics`.
+    """
+    def __init__(self, run_metrics: RunMetrics):
+        """
+        Args:
+            run_metrics (RunMetrics): The run the requests belong to.
+        """
+        self.run_metrics = run_metrics
+
+
+    def record_attempt(self, latency: float, result: dict) -> None:
+        """
+        Record one request, see RunMetrics.record_attempt().
+        """
+        self.run_metrics.record_attempt(latency, result)
+
+
+    def record_outcome(self, outcome: str) -> None:
+        """
+        Only retries are counted, the person's outcome already is.
+        """
+        if outcome == "retry":
+            self.run_metrics.record_outcome(outcome)
+
+
+def to_prometheus(report: dict) -> str:
+    """
+    Render a report in the Prometheus text exposition format.
+    Args:
+        report (dict): As returned by RunMetrics.report().
+    Returns:
+        str: The textfile content.
+    """
+    latency = report["latency_seconds"]
+    lines = [
+        f"# HELP {PREFIX}_request_duration_seconds Latency of the warming requests.",
+        f"# TYPE {PREFIX}_request_duration_seconds histogram"
+    ]
+    for bound, count in latency["histogram"].items():
+        lines.append(f'{PREFIX}_request_duration_seconds_bucket{{le="{bound}"}} {count}')
+    lines.append(f"{PREFIX}_request_duration_seconds_sum {latency['sum']}")
+    lines.append(f"{PREFIX}_request_duration_seconds_count {report['requests']['total']}")
+
+    lines.append(f"# HELP {PREFIX}_request_duration_quantile_seconds Latency quantiles of the last run.")
+    lines.append(f"# TYPE {PREFIX}_request_duration_quantile_seconds gauge")
+    for quantile in ("p50", "p95", "p99"):
+        lines.append(f'{PREFIX}_request_duration_quantile_seconds{{quantile="0.{quantile[1:]}"}} {latency[quantile]}')
+
+    lines.append(f"# HELP {PREFIX}_requests_total Warming requests by HTTP status.")
+    lines.append(f"# TYPE {PREFIX}_requests_total counter")
+    for status, count in report["requests"]["by_status"].items():
+        lines.append(f'{PREFIX}_requests_total{{status="{status}"}} {count}')
+    lines.append(f"# HELP {PREFIX}_request_exceptions_total Warming requests that got no answer, by exception.")
+    lines.append(f"# TYPE {PREFIX}_request_exceptions_total counter")
+    for exception, count in report["requests"]["exceptions"].items():
+        lines.append(f'{PREFIX}_request_exceptions_total{{exception="{exception}"}} {count}')
+
+    for name, value, help_text in (
+        ("retries_total", report["requests"]["retries"], "Retries scheduled."),
+        ("response_bytes_total", report["requests"]["bytes"], "Response bytes of the warming requests."),
+        ("persons_listed", report["persons"]["listed"], "Persons in the listing."),
+        ("listing_pages_skipped", report["persons"]["skipped_pages"], "Listing pages that failed every retry, their persons were not warmed."),
+        ("persons_warmed", report["persons"]["warmed"], "Persons warmed successfully."),
+        ("persons_failed", report["persons"]["failed"], "Persons that failed every attempt."),
+        ("run_duration_seconds", report["duration_seconds"], "Wall time of the run."),
+        ("requests_per_second", report["requests"]["per_second"], "Average request throughput of the run."),
+        ("last_run_timestamp_seconds", datetime.datetime.fromisoformat(report["started_at"]).timestamp(), "Start of the last run."),
+    ):
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} gauge")
+        lines.append(f"{PREFIX}_{name} {value}")
+
+    lines.append(f"# HELP {PREFIX}_phase_duration_seconds Time spent per phase, listing overlaps with warming.")
+    lines.append(f"# TYPE {PREFIX}_phase_duration_seconds gauge")
+    for phase, seconds in report["phases_seconds"].items():
+        lines.append(f'{PREFIX}_phase_duration_seconds{{phase="{phase}"}} {seconds}')
+    return "\n".join(lines) + "\n"
+
+
+def write_reports(run_metrics: RunMetrics, request_env: dict) -> None:
+    """
+    Write the JSON report and the node_exporter textfile if their paths are configured.
+    The textfile is written to a temporary file and renamed so node_exporter never reads half of it.
+    Args:
+        run_metrics (RunMetrics): The finished run.
+        request_env (dict): The environment configuration, reads METRICS_JSON and METRICS_PROM.
+    Returns:
+        None
+    """
+    report = run_metrics.report()
+    for path, content in ((request_env.get("METRICS_JSON"), lambda: json.dumps(report, indent = 2)),
+                          (request_env.get("METRICS_PROM"), lambda: to_prometheus(report))):
+        if not path:
+            continue
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding = "utf-8") as file:
+            file.write(content())
+        os.replace(temporary, path)
@@ -0,0 +1,52 @@
+"""
+This module ranks persons by how visible they are right now so a run warms them first: the People of the items users are watching,
+just watched or that were just added, top billed before the rest and cast before crew.
+"""
+import requests
+from fetch_request import fetch_request
+
+SOURCE_WEIGHTS = { "resume": 3.0, "played": 2.0, "latest": 1.0 } # Continue watching is on screen right now, recently added the least
+ROLE_WEIGHTS = { "Actor": 1.0, "GuestStar": 0.6, "Director": 0.5, "Writer": 0.3 }
+OTHER_ROLE_WEIGHT = 0.2 # Producers, composers and the rest of the crew
+
+
+def score_items(items: list, weight: float, scores: dict, tags: dict) -> None:
+    """
+    Add the score of every person in the items' People, the lead of the first item scores `weight` and billing order divides it.
+    A person in several items adds up, so the regulars of what everyone watches come first.
+    Args:
+        items (list): Items with their People, most recent first.
+        weight (float): Weight of the source the items came from.
+        scores (dict): Crew ID to score, updated in place.
+        tags (dict): Crew ID to primary image tag, updated in place.
+    Returns:
+        None
+    """
+    for position, item in enumerate(items):
+        for billing, person in enumerate(item.get("People") or []):
+            if not person.get("Id"):
+                continue
+            role = ROLE_WEIGHTS.get(person.get("Type"), OTHER_ROLE_WEIGHT)
+            scores[person["Id"]] = scores.get(person["Id"], 0.0) + weight * role / (1 + billing) / (1 + position / len(items))
+            tags[person["Id"]] = fetch_request.get_primary_image_tag(person)
+
+
+def rank(request_env: dict) -> list:
+    """
+    Fetch PRIORITY_ITEMS continue watching, recently played and recently added items and rank everyone in their People.
+    A source that cannot be fetched is skipped, priority only changes the order and never what is warmed.
+    Args:
+        request_env (dict): The environment configuration, reads PRIORITY_ITEMS.
+    Returns:
+        list: (crew ID, primary image tag) pairs, most visible first.
+    """
+    scores = {}
+    tags = {}
+    for source in fetch_request.RECENT_SOURCES:
+        try:
+            items = fetch_request.get_recent_items(request_env, source, request_env.get("PRIORITY_ITEMS"))
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error fetching {source} items to prioritize: {e}")
+            continue
+        score_items(items, SOURCE_WEIGHTS[source], scores, tags)
+    return [(person_id, tags[person_id]) for person_id in sorted(scores, key = scores.get, reverse = True)]
@@ -0,0 +1,157 @@
+"""
+This module reports the progress of every engine from its own timer thread, so console I/O stays out of the completion path.
+On a terminal the progress line is redrawn a few times per second, anything else (journald, docker logs, a file) gets a structured line now and then.
+"""
+import collections
+import datetime
+import json
+import sys
+import threading
+import time
+
+RATE_WINDOW = 10.0 # Seconds of completions the throughput and ETA are computed over
+
+
+class Progress:
+    """
+    Progress reporter of one engine run. The engine only hands it counters with update(), the timer thread does the printing.
+    """
+    def __init__(self, label: str = None, interval: float = 0.25, log_interval: float = 30.0, tty: bool = None, clock = time.monotonic):
+        """
+        Args:
+            label (str): Name of the target when several are warmed at once.
+            interval (float): Seconds between redraws of the progress line on a terminal, 0 to only print the last one.
+            log_interval (float): Seconds between structured lines when stdout is not a terminal, 0 to only print the last one.
+            tty (bool): Whether stdout is a terminal, detected when None.
+            clock (callable): Monotonic clock, replaced by tests.
+        """
+        self.label = label
+        self.tty = sys.stdout.isatty() if tty is None else tty
+        self.interval = interval if self.tty else log_interval
+        self.clock = clock
+        self.state = (0, 0, True, 0, 0, None, 0, False, None) # See update(), swapped whole so a redraw never sees half an update
+        self.samples = collections.deque() # (time, completed) of the last RATE_WINDOW seconds
+        self.stopped = threading.Event()
+        self.thread = None
+
+
+    def update(self, completed: int, submitted: int, listing: bool, in_flight: int, failed: int, concurrency: int = None,
+               retried: int = 0, paused: bool = False, last_error: str = None) -> None:
+        """
+        Hand the current counters over, called by the engine on every change. Nothing is printed here, retries and failures included.
+        Args:
+            completed (int): Requests finished so far.
+            submitted (int): Requests handed to the engine so far.
+            listing (bool): True while more IDs may still arrive.
+            in_flight (int): Attempts running or queued right now.
+            failed (int): Persons given up on.
+            concurrency (int): Current in-flight limit when ADAPTIVE is on.
+            retried (int): Retries scheduled so far.
+            paused (bool): True while the circuit breaker holds new requests back.
+            last_error (str): The person and error of the latest failure.
+        Returns:
+            None
+        """
+        self.state = (completed, submitted, listing, in_flight, failed, concurrency, retried, paused, last_error)
+
+
+    def start(self) -> "Progress":
+        """
+        Start the timer thread.
+        Returns:
+            Progress: self, for chaining.
+        """
+        self.samples.append((self.clock(), 0))
+        if self.interval > 0:
+            self.thread = threading.Thread(target = self.run, name = "progress", daemon = True)
+            self.thread.start()
+        return self
+
+
+    def stop(self) -> None:
+        """
+        Stop the timer thread and print the final progress, unless nothing was submitted.
+        Returns:
+            None
+        """
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        if self.state[1]:
+            self.render()
+
+
+    def run(self) -> None:
+        """
+        Timer thread, report every interval until stopped.
+        """
+        while not self.stopped.wait(self.interval):
+            self.render()
+
+
+    def rate(self, now: float, completed: int) -> float:
+        """
+        Args:
+            now (float): The clock reading of this report.
+            completed (int): Requests finished so far.
+        Returns:
+            float: Requests finished per second over the last RATE_WINDOW seconds.
+        """
+        self.samples.append((now, completed))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= RATE_WINDOW:
+            self.samples.popleft()
+        then, done = self.samples[0]
+        return (completed - done) / (now - then) if now > then else 0.0
+
+
+    def line(self) -> str:
+        """
+        Returns:
+            str: The progress line on a terminal, a logfmt line otherwise.
+        """
+        completed, submitted, listing, in_flight, failed, concurrency, retried, paused, last_error = self.state
+        rate = self.rate(self.clock(), completed)
+        # The total is only known once the listing is done, and an empty run is done
+        percent = None if listing else completed / submitted * 100 if submitted else 100.0
+        eta = (submitted - completed) / rate if not listing and rate > 0 and completed < submitted else None
+
+        if not self.tty:
+            fields = { "target": self.label, "completed": completed, "submitted": submitted, "listing": str(listing).lower(),
+                       "percent": None if percent is None else f"{percent:.1f}", "rate": f"{rate:.1f}",
+                       "eta_seconds": None if eta is None else round(eta), "in_flight": in_flight, "retries": retried, "failed": failed,
+                       "concurrency": concurrency, "paused": "true" if paused else None,
+                       "last_error": None if last_error is None else json.dumps(last_error) }
+            return "progress " + " ".join(f"{key}={value}" for key, value in fields.items() if value is not None)
+
+        status = "listing..." if listing else f"{percent:.1f}%"
+        remaining = f" ETA {datetime.timedelta(seconds = round(eta))}" if eta is not None else ""
+        error = f" (last: {last_error})" if last_error else ""
+        suffix = f" [concurrency {concurrency}]" if concurrency is not None else ""
+        suffix += " [paused, too many failures in a row]" if paused else ""
+        prefix = f"[{self.label}] " if self.label else ""
+        # Erase to the end of the line, the previous redraw may have been longer
+        return (f"\r{prefix}Progress: {completed}/{submitted} ({status}) {rate:.1f}/s{remaining}, {in_flight} in flight, {retried} retries, "
+                f"{failed} failed{error}{suffix}\x1b[K")
+
+
+    def render(self) -> None:
+        """
+        Print the progress once, over the previous line on a terminal.
+        Returns:
+            None
+        """
+        if self.tty:
+            print(self.line(), end="", flush=True)
+        else:
+            print(self.line(), flush=True)
+
+
+def from_env(request_env: dict) -> Progress:
+    """
+    Build the progress reporter of one engine run.
+    Args:
+        request_env (dict): The environment configuration, reads PROGRESS_INTERVAL, PROGRESS_LOG_INTERVAL and TARGET_NAME.
+    Returns:
+        Progress: The reporter, not started yet.
+    """
+    return Progress(request_env.get("TARGET_NAME"), request_env.get("PROGRESS_INTERVAL", 0.25), request_env.get("PROGRESS_LOG_INTERVAL", 30.0))
@@ -0,0 +1,134 @@
+"""
+This module limits how many requests per second every worker together sends to Jellyfin, optionally following a time of day schedule.
+"""
+import asyncio
+import datetime
+import threading
+import time
+
+
+def parse_schedule(schedule: str) -> list:
+    """
+    Parse a RATE_SCHEDULE such as "18:00-23:00=5,23:00-07:00=0", a window may wrap past midnight and 0 means unlimited.
+    Args:
+        schedule (str): Comma separated HH:MM-HH:MM=rate windows.
+    Returns:
+        list: (start minute, end minute, rate) tuples.
+    Raises:
+        ValueError: If a window is malformed.
+    """
+    windows = []
+    for window in filter(None, (part.strip() for part in (schedule or "").split(","))):
+        try:
+            span, rate = window.split("=")
+            start, end = span.split("-")
+            windows.append((_minutes(start), _minutes(end), float(rate)))
+        except ValueError as e:
+            raise ValueError(f"Invalid RATE_SCHEDULE window '{window}', expected HH:MM-HH:MM=rate") from e
+    return windows
+
+
+def _minutes(clock_time: str) -> int:
+    hours, minutes = clock_time.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every worker, refills `rate` tokens per second up to `burst`.
+    Every request takes a token, once the bucket is empty callers are told how long to wait for their turn.
+    """
+    def __init__(self, rate: float, burst: float = 0, schedule: list = None, clock = time.monotonic, now = datetime.datetime.now):
+        """
+        Args:
+            rate (float): Requests per second outside of any schedule window, 0 for unlimited.
+            burst (float): Most requests that can go out back to back, defaults to one second worth of rate.
+            schedule (list): Windows from parse_schedule() overriding the rate by time of day.
+            clock (callable): Monotonic clock, overridden by tests.
+            now (callable): Wall clock used for the schedule, overridden by tests.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.schedule = schedule or []
+        self.clock = clock
+        self.now = now
+        self.tokens = None
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+
+    def current_rate(self) -> float:
+        """
+        Returns:
+            float: The requests per second allowed right now, 0 for unlimited.
+        """
+        current = self.now()
+        minute = current.hour * 60 + current.minute
+        for start, end, rate in self.schedule:
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return rate
+        return self.rate
+
+
+    def reserve(self) -> float:
+        """
+        Take a token.
+        Returns:
+            float: Seconds the caller has to wait before sending, 0 if it can go now.
+        """
+        with self.lock:
+            now = self.clock()
+            rate = self.current_rate()
+            elapsed = now - self.updated
+            self.updated = now
+            if not rate:
+                self.tokens = None
+                return 0.0
+
+            burst = self.burst or max(1.0, rate)
+            self.tokens = burst if self.tokens is None else min(burst, self.tokens + elapsed * rate)
+            # Tokens go negative so every waiting caller gets its own slot instead of racing for the next one
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / rate
+
+
+    def acquire(self) -> None:
+        """
+        Block the calling thread until it is its turn.
+        Returns:
+            None
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+    async def acquire_async(self) -> None:
+        """
+        Suspend the calling coroutine until it is its turn.
+        Returns:
+            None
+        """
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+def from_env(request_env: dict):
+    """
+    Build the shared limiter when RATE_LIMIT or RATE_SCHEDULE is set.
+    RATE_SHARE scales every rate, local shard processes each get their share so together they stay under the limit.
+    Args:
+        request_env (dict): The environment configuration, reads RATE_LIMIT, RATE_BURST, RATE_SCHEDULE and RATE_SHARE.
+    Returns:
+        TokenBucket: The limiter, None if no limit is configured.
+    """
+    schedule = parse_schedule(request_env.get("RATE_SCHEDULE"))
+    if not request_env.get("RATE_LIMIT") and not schedule:
+        return None
+    share = request_env.get("RATE_SHARE", 1)
+    return TokenBucket(
+        request_env.get("RATE_LIMIT", 0) * share,
+        request_env.get("RATE_BURST", 0) * share,
+        [(start, end, rate * share) for start, end, rate in schedule]
+    )
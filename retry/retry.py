@@ -0,0 +1,226 @@
+"""
+This module schedules failed requests for a later retry so workers move on to fresh IDs instead of sleeping on a failing one.
+"""
+import email.utils
+import heapq
+import itertools
+import random
+import time
+
+RETRY_STATUSES = { 408, 429 } # Plus every 5xx, anything else will not get better by asking again
+
+
+def is_retryable(status: int) -> bool:
+    """
+    Args:
+        status (int): HTTP status code, None when the request never got an answer.
+    Returns:
+        bool: True if asking again later may succeed.
+    """
+    return status is None or status in RETRY_STATUSES or status >= 500
+
+
+def parse_retry_after(value: str) -> float:
+    """
+    Parse a Retry-After header, either seconds or an HTTP date.
+    Args:
+        value (str): The header value, may be None.
+    Returns:
+        float: Seconds to wait, None if absent or unreadable.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def attempt_result(status: int = None, error: str = None, retry_after: str = None, size: int = 0, exception: str = None, terminal: bool = False) -> dict:
+    """
+    Describe how a single attempt went, the same shape for both engines.
+    Args:
+        status (int): HTTP status code, None when the request never got an answer.
+        error (str): What went wrong, None on success.
+        retry_after (str): The Retry-After header of the response.
+        size (int): Response body bytes.
+        exception (str): Exception class name when the request never got an answer.
+        terminal (bool): The error status is a final answer rather than a failure, such as the 404 of a person without a portrait.
+            Counted ok, so it is never retried nor held against the circuit breaker.
+    Returns:
+        dict: ok, status, error, retry (worth trying again), retry_after (seconds), bytes and exception keys.
+    """
+    ok = terminal or (error is None and status is not None and status < 400)
+    return {
+        "ok": ok,
+        "status": status,
+        "error": error,
+        "retry": not ok and is_retryable(status),
+        "retry_after": parse_retry_after(retry_after),
+        "bytes": size,
+        "exception": exception
+    }
+
+
+class RetryScheduler:
+    """
+    Delayed retry queue with exponential backoff and full jitter, a retry budget for the whole run
+    and a circuit breaker that pauses new requests after too many failures in a row.
+    """
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 60.0, budget: int = 0,
+                 breaker_threshold: int = 0, breaker_cooldown: float = 30.0, clock = time.monotonic, rand = random.random):
+        """
+        Args:
+            max_attempts (int): Attempts per person including the first one.
+            base_delay (float): Backoff of the first retry, doubled on every following one.
+            max_delay (float): Cap of the backoff.
+            budget (int): Retries allowed for the whole run, 0 for unlimited.
+            breaker_threshold (int): Failures in a row that open the breaker, 0 to disable it.
+            breaker_cooldown (float): Seconds the breaker stays open.
+            clock (callable): Monotonic clock, overridden by tests.
+            rand (callable): Random float in [0, 1), overridden by tests.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.clock = clock
+        self.rand = rand
+        self.queue = [] # (due, sequence, person ID, attempt) heap
+        self.sequence = itertools.count()
+        self.retried = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        """
+        Full jitter backoff, never sooner than the server asked for.
+        Args:
+            attempt (int): The attempt about to be scheduled, 1 for the first retry.
+            retry_after (float): Seconds from the Retry-After header.
+        Returns:
+            float: Seconds to wait.
+        """
+        backoff = self.rand() * min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return max(backoff, retry_after or 0.0)
+
+
+    def record(self, ok: bool) -> None:
+        """
+        Feed the circuit breaker with the outcome of an attempt.
+        Args:
+            ok (bool): True if the attempt succeeded.
+        Returns:
+            None
+        """
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.breaker_threshold and self.consecutive_failures >= self.breaker_threshold:
+            self.open_until = self.clock() + self.breaker_cooldown
+            self.consecutive_failures = 0
+
+
+    def breaker_open(self) -> bool:
+        """
+        Returns:
+            bool: True while no request should go out.
+        """
+        return self.clock() < self.open_until
+
+
+    def schedule(self, person_id: str, attempt: int, retry_after: float = None) -> bool:
+        """
+        Queue another attempt for a person, unless they are out of attempts or the run is out of budget.
+        Args:
+            person_id (str): The crew/cast ID.
+            attempt (int): The attempt about to be scheduled, 1 for the first retry.
+            retry_after (float): Seconds from the Retry-After header.
+        Returns:
+            bool: True if the retry was queued.
+        """
+        if attempt >= self.max_attempts or (self.budget and self.retried >= self.budget):
+            return False
+        self.retried += 1
+        heapq.heappush(self.queue, (self.clock() + self.delay(attempt, retry_after), next(self.sequence), person_id, attempt))
+        return True
+
+
+    def settle(self, person_id: str, attempt: int, result: dict) -> str:
+        """
+        Decide what happens to a person after an attempt, shared by both engines.
+        Nothing is printed, the engine hands retries and failures to its progress.Progress reporter.
+        Args:
+            person_id (str): The crew/cast ID.
+            attempt (int): The attempt that just finished, 0 for the first one.
+            result (dict): The attempt result, see attempt_result().
+        Returns:
+            str: "ok", "retry" if another attempt was queued, or "failed".
+        """
+        self.record(result["ok"])
+        if result["ok"]:
+            return "ok"
+        if result["retry"] and self.schedule(person_id, attempt + 1, result["retry_after"]):
+            return "retry"
+        return "failed"
+
+
+    def pop_ready(self, limit: int = None) -> list:
+        """
+        Take every retry that is due, nothing while the breaker is open.
+        Args:
+            limit (int): Take at most this many, the rest stay queued. None takes them all.
+        Returns:
+            list: (person ID, attempt) tuples.
+        """
+        ready = []
+        if self.breaker_open():
+            return ready
+        now = self.clock()
+        while self.queue and self.queue[0][0] <= now and (limit is None or len(ready) < limit):
+            _, _, person_id, attempt = heapq.heappop(self.queue)
+            ready.append((person_id, attempt))
+        return ready
+
+
+    def next_due(self) -> float:
+        """
+        Returns:
+            float: Seconds until a retry is due or the breaker closes, None if nothing is waiting.
+        """
+        now = self.clock()
+        due = self.queue[0][0] - now if self.queue else None
+        if self.breaker_open():
+            # Nothing is sent while open, so the earliest anything can happen is when it closes
+            due = self.open_until - now if due is None else max(due, self.open_until - now)
+        return None if due is None else max(0.0, due)
+
+
+def from_env(request_env: dict) -> RetryScheduler:
+    """
+    Build the retry scheduler of one run.
+    Args:
+        request_env (dict): The environment configuration, reads MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_BUDGET, BREAKER_THRESHOLD and BREAKER_COOLDOWN.
+    Returns:
+        RetryScheduler: The scheduler.
+    """
+    return RetryScheduler(
+        request_env.get("MAX_ATTEMPTS", 3),
+        request_env.get("RETRY_BASE_DELAY", 1.0),
+        request_env.get("RETRY_MAX_DELAY", 60.0),
+        request_env.get("RETRY_BUDGET", 0),
+        request_env.get("BREAKER_THRESHOLD", 0),
+        request_env.get("BREAKER_COOLDOWN", 30.0)
+    )
@@ -0,0 +1,88 @@
+"""
+This module splits the persons of a library into shards by a stable hash, so several processes or hosts can each warm their own part.
+"""
+import threading
+import zlib
+
+
+class ShardResult:
+    """
+    Base of the objects a shard process sends back to the parent to be merged, such as metrics.RunMetrics.
+    Their `lock` cannot be pickled, it stays behind and the copy gets a fresh one.
+    """
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+def parse_shard(shard: str) -> tuple:
+    """
+    Parse a --shard value such as "2/3", the second of three shards.
+    Args:
+        shard (str): K/N with 1 <= K <= N.
+    Returns:
+        tuple: (index, count) with a 0 based index.
+    Raises:
+        ValueError: If the value is malformed or K is out of range.
+    """
+    try:
+        number, count = (int(part) for part in shard.split("/"))
+    except ValueError as e:
+        raise ValueError(f"Invalid shard '{shard}', expected K/N such as 1/3") from e
+    if count < 1 or not 1 <= number <= count:
+        raise ValueError(f"Invalid shard '{shard}', K must be between 1 and N")
+    return number - 1, count
+
+
+def owns(person_id: str, path: tuple) -> bool:
+    """
+    Whether a person belongs to a shard. A path of several (index, count) levels splits a shard further,
+    e.g. ((1, 3), (0, 4)) is the first of 4 local processes on the host running shard 2/3. Every host picks
+    its own process count, each level hashes different bits of the same CRC32 so the levels stay independent.
+    Args:
+        person_id (str): The crew/cast ID.
+        path (tuple): (index, count) pairs from the host shard down, empty owns everyone.
+    Returns:
+        bool: True if this shard warms the person.
+    """
+    value = zlib.crc32(person_id.encode()) # Unlike hash(), identical in every process and on every host
+    for index, count in path:
+        if value % count != index:
+            return False
+        value //= count
+    return True
+
+
+def split(crew, path: tuple, count: int) -> list:
+    """
+    Split the persons of a shard over `count` sub-shards, the same split owns() makes one level further down the path.
+    Args:
+        crew (iterable): (person ID, primary image tag) pairs, all owned by `path`.
+        path (tuple): The shard the persons belong to.
+        count (int): Sub-shards to split it into.
+    Returns:
+        list: One dict of person ID to primary image tag per sub-shard, in listing order.
+    """
+    parts = [{} for _ in range(count)]
+    for person_id, image_tag in crew:
+        value = zlib.crc32(person_id.encode())
+        for _, level_count in path:
+            value //= level_count
+        parts[value % count].setdefault(person_id, image_tag)
+    return parts
+
+
+def describe(path: tuple) -> str:
+    """
+    Args:
+        path (tuple): (index, count) pairs.
+    Returns:
+        str: The path as 1 based K/N levels, e.g. "2/3.1/4".
+    """
+    return ".".join(f"{index + 1}/{count}" for index, count in path)
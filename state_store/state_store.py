@@ -0,0 +1,170 @@
+"""
+This module keeps an on-disk SQLite record of every person that was warmed, so repeat runs only warm new or still blank persons.
+"""
+import sqlite3
+import time
+
+
+def _changed(stored_tag: str, image_tag: str) -> bool:
+    """
+    Blank on either side always counts as changed, a person with no portrait yet is exactly who we want to warm again.
+    """
+    return not stored_tag or not image_tag or stored_tag != image_tag
+
+
+class StateStore:
+    """
+    SQLite backed state keyed by person ID, storing the primary image tag and when the person was last warmed successfully.
+    """
+    def __init__(self, path: str):
+        """
+        Open (or create) the state database.
+        Args:
+            path (str): Path to the SQLite file, ":memory:" keeps it in memory.
+        """
+        # The async engine pulls the listing from a helper thread, only one thread ever uses the connection at a time
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS persons ("
+            "person_id TEXT PRIMARY KEY, "
+            "image_tag TEXT, "
+            "last_warmed REAL NOT NULL)"
+        )
+        # Watermarks of INCREMENTAL runs, one per server and user
+        self.connection.execute("CREATE TABLE IF NOT EXISTS watermarks (source TEXT PRIMARY KEY, created_after TEXT NOT NULL)")
+        # Persons VERIFY_ROUNDS could not get a portrait for, skipped while the listing still shows them blank
+        self.connection.execute("CREATE TABLE IF NOT EXISTS unfixed (person_id TEXT PRIMARY KEY)")
+        # Validators of the IMAGE_VARIANTS already fetched through the reverse proxy, so the next fetch can be conditional
+        self.connection.execute("CREATE TABLE IF NOT EXISTS image_variants (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT)")
+        self.connection.commit()
+
+
+    def get_warmed_tags(self) -> dict:
+        """
+        Get every warmed person at once, one query instead of one per person, the whole table is small compared to a Persons listing.
+        Returns:
+            dict: Person ID to the primary image tag they had when last warmed, None if they had none.
+        """
+        return dict(self.connection.execute("SELECT person_id, image_tag FROM persons"))
+
+
+    def filter_stream(self, crew):
+        """
+        Drop every person whose state has not changed since they were last warmed, checked as they are listed.
+        A person verification gave up on is not warmed again until the listing shows an image tag for them.
+        Args:
+            crew (iterable): (person ID, primary image tag) pairs, as yielded by fetch_request.iter_crew().
+        Yields:
+            str: The IDs that still need warming.
+        """
+        stored = self.get_warmed_tags()
+        unfixed = { person_id for person_id, in self.connection.execute("SELECT person_id FROM unfixed") }
+        for person_id, image_tag in crew:
+            if not image_tag and person_id in unfixed:
+                continue # Warming them again will not get a portrait either, wait for the tag to change
+            if _changed(stored.get(person_id), image_tag):
+                yield person_id
+
+
+    def record_warmed(self, crew: dict) -> None:
+        """
+        Record persons as warmed successfully right now.
+        Args:
+            crew (dict): Person ID to the primary image tag they had when warmed.
+        Returns:
+            None
+        """
+        now = time.time()
+        self.connection.executemany(
+            "INSERT INTO persons (person_id, image_tag, last_warmed) VALUES (?, ?, ?) "
+            "ON CONFLICT(person_id) DO UPDATE SET image_tag = excluded.image_tag, last_warmed = excluded.last_warmed",
+            [(person_id, image_tag, now) for person_id, image_tag in crew.items()]
+        )
+        # A portrait showed up after all
+        self.connection.executemany("DELETE FROM unfixed WHERE person_id = ?", [(person_id,) for person_id, image_tag in crew.items() if image_tag])
+        self.connection.commit()
+
+
+    def record_unfixed(self, person_ids) -> None:
+        """
+        Remember the persons still blank after every VERIFY_ROUNDS round, they are skipped until their image tag changes.
+        Args:
+            person_ids (iterable): The crew/cast IDs, see verify.Verification.unfixed.
+        Returns:
+            None
+        """
+        self.connection.executemany("INSERT OR IGNORE INTO unfixed (person_id) VALUES (?)", [(person_id,) for person_id in person_ids])
+        self.connection.commit()
+
+
+    def get_watermark(self, source: str) -> str:
+        """
+        Get when the last complete INCREMENTAL run of a source started.
+        Args:
+            source (str): The server and user the run listed, see watermark_source().
+        Returns:
+            str: ISO 8601 UTC time, None if no run completed yet.
+        """
+        row = self.connection.execute("SELECT created_after FROM watermarks WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+
+    def set_watermark(self, source: str, created_after: str) -> None:
+        """
+        Move the watermark of a source, the next INCREMENTAL run only lists items created after it.
+        Args:
+            source (str): The server and user the run listed, see watermark_source().
+            created_after (str): ISO 8601 UTC time the run started at.
+        Returns:
+            None
+        """
+        self.connection.execute(
+            "INSERT INTO watermarks (source, created_after) VALUES (?, ?) "
+            "ON CONFLICT(source) DO UPDATE SET created_after = excluded.created_after",
+            (source, created_after)
+        )
+        self.connection.commit()
+
+
+    def get_image_validators(self) -> dict:
+        """
+        Get the validators of every image variant fetched so far, loaded at once like filter_stream() does.
+        Returns:
+            dict: Variant URL to (ETag, Last-Modified), either may be None.
+        """
+        return { url: (etag, last_modified) for url, etag, last_modified in self.connection.execute("SELECT url, etag, last_modified FROM image_variants") }
+
+
+    def record_image_validators(self, validators: dict) -> None:
+        """
+        Remember the validators the proxy sent for image variants.
+        Args:
+            validators (dict): Variant URL to (ETag, Last-Modified).
+        Returns:
+            None
+        """
+        self.connection.executemany(
+            "INSERT INTO image_variants (url, etag, last_modified) VALUES (?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified",
+            [(url, etag, last_modified) for url, (etag, last_modified) in validators.items()]
+        )
+        self.connection.commit()
+
+
+    def close(self) -> None:
+        """
+        Close the database connection.
+        Returns:
+            None
+        """
+        self.connection.close()
+
+
+def watermark_source(request_env: dict) -> str:
+    """
+    Args:
+        request_env (dict): The environment configuration, reads BASE_URL and USERID.
+    Returns:
+        str: The key the watermark of this server and user is stored under.
+    """
+    return f"{request_env.get('BASE_URL')}|{request_env.get('USERID')}"
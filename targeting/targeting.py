@@ -0,0 +1,88 @@
+"""
+This module sorts persons by the state of their primary image so TARGET_MODE=missing only warms the ones that need it.
+Sorting sends no request of its own, it trusts the image tag of the listing and what STATE_DB recorded the last time the person was warmed.
+"""
+import threading
+from shard import shard
+
+NO_IMAGE = "no_image" # No image tag in the listing
+CHANGED = "changed" # Has an image tag STATE_DB never saw them warmed with, a new or replaced portrait
+CACHED = "cached" # Warmed with this image tag before, or no STATE_DB to tell and the listing has a tag, nothing to warm
+
+
+class Targeting(shard.ShardResult):
+    """
+    Classifies persons as NO_IMAGE, CHANGED or CACHED and only hands the first two to the engine.
+    """
+    def __init__(self, crew: dict, warmed_tags: dict = None):
+        """
+        Args:
+            crew (dict): Person ID to primary image tag, filled in by the listing as it streams.
+            warmed_tags (dict): Person ID to the image tag they were last warmed with, see state_store.StateStore.get_warmed_tags().
+                None without STATE_DB, every person with an image tag is then taken as cached.
+        """
+        self.crew = crew
+        self.warmed_tags = warmed_tags
+        self.counts = { NO_IMAGE: 0, CHANGED: 0, CACHED: 0 }
+        self.targeted = {} # Person ID to group, only for persons that need warming
+        self.lock = threading.Lock()
+
+
+    def merge(self, other: "Targeting") -> None:
+        """
+        Add the persons classified by another run, such as a shard that ran in parallel.
+        Args:
+            other (Targeting): The finished run to add.
+        Returns:
+            None
+        """
+        with self.lock:
+            for group, count in other.counts.items():
+                self.counts[group] += count
+            self.targeted.update(other.targeted)
+
+
+    def classify(self, person_id: str) -> str:
+        """
+        Sort a person and count them in their group.
+        Args:
+            person_id (str): The crew/cast ID.
+        Returns:
+            str: NO_IMAGE, CHANGED or CACHED.
+        """
+        with self.lock:
+            if person_id in self.targeted:
+                return self.targeted[person_id]
+            image_tag = self.crew.get(person_id)
+            if not image_tag:
+                group = NO_IMAGE
+            elif self.warmed_tags is None or self.warmed_tags.get(person_id) == image_tag:
+                group = CACHED
+            else:
+                group = CHANGED
+            self.counts[group] += 1
+            if group != CACHED:
+                self.targeted[person_id] = group
+            return group
+
+
+    def filter_stream(self, ids):
+        """
+        Drop the cached persons before they reach the engine, so they take no rate limit token and are not counted as requests.
+        Args:
+            ids (iterable): Person IDs as they are listed, their image tag already in `crew`.
+        Yields:
+            str: The IDs without an image or with a changed one.
+        """
+        for person_id in ids:
+            if self.classify(person_id) != CACHED:
+                yield person_id
+
+
+    def summary(self) -> str:
+        """
+        Returns:
+            str: One line with the size of every group.
+        """
+        return (f"{self.counts[NO_IMAGE]} without image, {self.counts[CHANGED]} with a new image tag, "
+                f"{self.counts[CACHED]} already cached and skipped.")
@@ -0,0 +1,14 @@
+"""
+# test/helpers.py
+Test doubles shared by the unit tests.
+"""
+
+class FakeClock:
+    """
+    Monotonic clock that only moves when told to, tests advance it by changing `now`.
+    """
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,211 @@
+"""
+# test/test_async_request.py
+Unit tests for the async_request module.
+Requests are answered by an httpx.MockTransport so nothing leaves the process.
+"""
+import asyncio
+import unittest
+from unittest.mock import patch, call
+import httpx
+from async_request import async_request
+from retry import retry
+
+class TestAsyncRequest(unittest.TestCase):
+    """
+    Unit tests for the async_request.execute_requests() function.
+    """
+    def setUp(self):
+        self.env = {
+            "BASE_URL": "https://jellyfin.example.com",
+            "API_KEY": "test_api_key_123",
+            "USERID": "test_user_id_123",
+            "TIMEOUT": 30,
+            "ASYNC_CONCURRENCY": 2
+        }
+        self.requested = []
+
+
+    def handler(self, failing: dict):
+        """
+        Build a transport handler that fails the given person IDs a number of times before answering 200.
+        """
+        def handle(request):
+            person_id = request.url.path.rsplit("/", 1)[-1]
+            self.requested.append((request.url.path, request.url.params.get("api_key")))
+            if failing.get(person_id, 0) > 0:
+                failing[person_id] -= 1
+                return httpx.Response(500)
+            return httpx.Response(200, json = {})
+        return httpx.MockTransport(handle)
+
+
+    @patch('sys.stdout.isatty', return_value = False)
+    @patch('builtins.print')
+    def test_all_ids_warmed(self, mock_print, mock_isatty):
+        """
+        Test that every ID is requested on the detail endpoint and reported as warmed.
+        """
+        ids = { "crew_001", "crew_002", "crew_003" }
+        result = async_request.execute_requests(self.env, ids, self.handler({}))
+
+        self.assertEqual(result, ids)
+        self.assertIn(("/Users/test_user_id_123/Items/crew_001", "test_api_key_123"), self.requested)
+        self.assertEqual(len(self.requested), 3)
+        final = mock_print.call_args.args[0]
+        self.assertTrue(final.startswith("progress completed=3 submitted=3 listing=false percent=100.0 rate="), final)
+        self.assertTrue(final.endswith(" in_flight=0 retries=0 failed=0"), final)
+
+
+    @patch('sys.stdout.isatty', return_value = False)
+    @patch('builtins.print')
+    def test_retry_then_success(self, mock_print, mock_isatty):
+        """
+        Test that a failed request is retried and the retries are counted on the progress line, not printed one by one.
+        """
+        self.env["RETRY_BASE_DELAY"] = 0 # Retries are due right away
+        result = async_request.execute_requests(self.env, { "crew_001" }, self.handler({ "crew_001": 2 }))
+
+        self.assertEqual(result, { "crew_001" })
+        self.assertEqual(len(self.requested), 3)
+        self.assertEqual(mock_print.call_count, 2) # "Fetching details..." and the final progress line
+        self.assertIn(" retries=2 failed=0", mock_print.call_args.args[0])
+
+
+    @patch('sys.stdout.isatty', return_value = False)
+    @patch('builtins.print')
+    def test_retries_exhausted(self, mock_print, mock_isatty):
+        """
+        Test that a person failing every attempt is left out of the warmed set while the others keep going.
+        """
+        self.env["RETRY_BASE_DELAY"] = 0
+        result = async_request.execute_requests(self.env, { "crew_001", "crew_002" }, self.handler({ "crew_001": 3 }))
+
+        self.assertEqual(result, { "crew_002" })
+        self.assertEqual(len(self.requested), 4)
+        self.assertTrue(mock_print.call_args.args[0].endswith(' failed=1 last_error="crew_001: 500 Internal Server Error"'), mock_print.call_args.args[0])
+
+
+    @patch('builtins.print')
+    def test_client_errors_are_not_retried(self, mock_print):
+        """
+        Test that a 404 fails right away instead of being retried.
+        """
+        def handle(request):
+            self.requested.append(request.url.path)
+            return httpx.Response(404)
+
+        result = async_request.execute_requests(self.env, { "crew_001" }, httpx.MockTransport(handle))
+
+        self.assertEqual(result, set())
+        self.assertEqual(len(self.requested), 1)
+
+
+    @patch('builtins.print')
+    def test_warm_strategies(self, mock_print):
+        """
+        Test that the headers strategy sends a GET and that the image strategy takes a missing portrait as done, not failed.
+        """
+        def handle(request):
+            self.requested.append((request.method, request.url.path))
+            return httpx.Response(404 if request.url.path.startswith("/Items/crew_001/") else 200)
+
+        self.assertEqual(async_request.execute_requests({ **self.env, "WARM_STRATEGY": "headers" }, { "crew_002" }, httpx.MockTransport(handle)), { "crew_002" })
+        self.assertEqual(self.requested, [("GET", "/Users/test_user_id_123/Items/crew_002")])
+
+        result = async_request.execute_requests({ **self.env, "WARM_STRATEGY": "image" }, { "crew_001" }, httpx.MockTransport(handle))
+        self.assertEqual(result, { "crew_001" })
+        self.assertEqual(len(self.requested), 2)
+
+
+    @patch('builtins.print')
+    def test_work_exception_is_raised(self, mock_print):
+        """
+        Test that an exception from the work function is raised like the thread engine does, not swallowed with the person.
+        """
+        async def work(client, request_env, person_id):
+            if person_id == "crew_002":
+                raise KeyError(person_id)
+            return retry.attempt_result(200)
+
+        with self.assertRaises(KeyError):
+            async_request.execute_requests(self.env, ["crew_001", "crew_002", "crew_003"], self.handler({}), work = work)
+
+
+    def test_missing_httpx(self):
+        """
+        Test that the async engine explains how to install httpx when it is missing.
+        """
+        with patch.object(async_request, "httpx", None):
+            with self.assertRaises(RuntimeError):
+                async_request.execute_requests(self.env, { "crew_001" })
+
+
+    def test_pooled_transport(self):
+        """
+        Test that requests in flight are spread over the small pools and a pool is free again once its body is closed.
+        """
+        transport = async_request.PooledTransport(8, per_pool = 4)
+        self.assertEqual(len(transport.pools), 2)
+        served = []
+        async def handle(request):
+            served.append(request.url.path)
+            return httpx.Response(200, content = b"body")
+        transport.pools = [httpx.MockTransport(handle), httpx.MockTransport(handle)]
+
+        async def fetch():
+            async with httpx.AsyncClient(transport = transport) as client:
+                first = await client.send(client.build_request("GET", "https://jellyfin.example.com/a"), stream = True)
+                second = await client.send(client.build_request("GET", "https://jellyfin.example.com/b"), stream = True)
+                busy = list(transport.busy)
+                await first.aread()
+                await first.aclose()
+                await first.aclose()
+                await second.aclose()
+                return busy, first.content
+
+        busy, content = asyncio.run(fetch())
+        self.assertEqual(busy, [1, 1])
+        self.assertEqual(transport.busy, [0, 0])
+        self.assertEqual(content, b"body")
+        self.assertEqual(served, ["/a", "/b"])
+
+
+    def http2_handler(self, http_version: bytes):
+        """
+        Build a transport handler that answers every request over the given protocol.
+        """
+        def handle(request):
+            self.requested.append((request.url.path, request.url.params.get("api_key")))
+            return httpx.Response(200, json = {}, extensions = { "http_version": http_version })
+        return httpx.MockTransport(handle)
+
+
+    @patch('builtins.print')
+    def test_http2_multiplexed(self, mock_print):
+        """
+        Test that a server negotiating HTTP/2 gets the requests over HTTP2_CONNECTIONS connections after one probe.
+        """
+        self.env.update({ "HTTP2": True, "HTTP2_CONNECTIONS": 1 })
+        result = async_request.execute_requests(self.env, { "crew_001", "crew_002" }, self.http2_handler(b"HTTP/2"))
+
+        self.assertEqual(result, { "crew_001", "crew_002" })
+        self.assertEqual(self.requested[0][0], "/System/Info/Public")
+        self.assertEqual(len(self.requested), 3)
+        mock_print.assert_any_call("Fetching details with 2 concurrent requests over 1 HTTP/2 connections and max timeout of 30 seconds per request...")
+
+
+    @patch('builtins.print')
+    def test_http2_falls_back(self, mock_print):
+        """
+        Test that a server answering HTTP/1.1, or a missing h2 package, falls back to one connection per request in flight.
+        """
+        self.env["HTTP2"] = True
+        result = async_request.execute_requests(self.env, { "crew_001" }, self.http2_handler(b"HTTP/1.1"))
+        self.assertEqual(result, { "crew_001" })
+        mock_print.assert_any_call("https://jellyfin.example.com answered over HTTP/1.1, falling back to HTTP/1.1...")
+        mock_print.assert_any_call("Fetching details with 2 concurrent requests and max timeout of 30 seconds per request...")
+
+        self.requested.clear()
+        with patch.object(async_request, "h2", None):
+            async_request.execute_requests(self.env, { "crew_001" }, self.http2_handler(b"HTTP/1.1"))
+        self.assertEqual(self.requested, [("/Users/test_user_id_123/Items/crew_001", "test_api_key_123")])
@@ -0,0 +1,134 @@
+"""
+# test/test_concurrency.py
+Unit tests for the concurrency module.
+It tests the AIMD steps of the adaptive controller, its in-flight slot accounting and the slots shared between targets.
+"""
+import asyncio
+import threading
+import unittest
+from concurrency import concurrency
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    """
+    Unit tests for the concurrency.AdaptiveConcurrency class.
+    """
+    def finish_window(self, controller, latency, ok = True):
+        """
+        Run one full window of requests through the controller.
+        """
+        for _ in range(controller.window):
+            controller.in_flight += 1
+            controller.release(latency, ok)
+
+
+    def test_percentile(self):
+        """
+        Test the nearest rank percentile.
+        """
+        self.assertEqual(concurrency.percentile([], 0.95), 0.0)
+        self.assertEqual(concurrency.percentile(list(range(100)), 0.95), 95)
+        self.assertEqual(concurrency.percentile([3, 1, 2], 0.5), 2)
+
+
+    def test_ramps_up_while_healthy(self):
+        """
+        Test that the limit grows by one per healthy window and stops at the maximum.
+        """
+        controller = concurrency.AdaptiveConcurrency(2, 4, target_latency = 1.0, window = 5)
+        self.assertEqual(controller.limit, 2)
+        for expected in [3, 4, 4]:
+            self.finish_window(controller, 0.1)
+            self.assertEqual(controller.limit, expected)
+
+
+    def test_backs_off_on_latency_and_errors(self):
+        """
+        Test that slow or failing windows halve the limit without going under the minimum.
+        """
+        controller = concurrency.AdaptiveConcurrency(2, 64, target_latency = 1.0, window = 5)
+        controller.limit = 16
+        self.finish_window(controller, 5.0)
+        self.assertEqual(controller.limit, 8)
+        self.finish_window(controller, 0.1, ok = False)
+        self.assertEqual(controller.limit, 4)
+        self.finish_window(controller, 5.0)
+        self.finish_window(controller, 5.0)
+        self.assertEqual(controller.limit, 2)
+
+
+    def test_learns_target_latency(self):
+        """
+        Test that without a target the best p95 seen times the tolerance is used.
+        """
+        controller = concurrency.AdaptiveConcurrency(1, 64, window = 5, tolerance = 2.0)
+        self.finish_window(controller, 0.1)
+        self.assertEqual(controller.limit, 2)
+        # 0.15 is within 2x of the 0.1 baseline
+        self.finish_window(controller, 0.15)
+        self.assertEqual(controller.limit, 3)
+        self.finish_window(controller, 0.5)
+        self.assertEqual(controller.limit, 1)
+
+
+    def test_slots(self):
+        """
+        Test that no more slots than the limit can be taken.
+        """
+        controller = concurrency.AdaptiveConcurrency(2, 8)
+        self.assertTrue(controller.try_acquire())
+        controller.acquire()
+        self.assertFalse(controller.try_acquire())
+        controller.release(0.1, True)
+        self.assertTrue(controller.try_acquire())
+
+
+    def test_from_env(self):
+        """
+        Test that the controller only exists with ADAPTIVE on.
+        """
+        self.assertIsNone(concurrency.from_env({ "ADAPTIVE": False }))
+        controller = concurrency.from_env({ "ADAPTIVE": True, "ADAPTIVE_MIN": 3, "ADAPTIVE_MAX": 9, "ADAPTIVE_TARGET_LATENCY": 0.5 })
+        self.assertEqual((controller.minimum, controller.maximum, controller.target_latency), (3, 9, 0.5))
+
+
+class TestSharedCapacity(unittest.TestCase):
+    """
+    Unit tests for the concurrency.SharedCapacity class.
+    """
+    def test_threads_wait_for_a_slot(self):
+        """
+        Test that a thread blocks while every slot is taken and gets the one given back.
+        """
+        capacity = concurrency.SharedCapacity(2)
+        capacity.acquire()
+        capacity.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(target = lambda: (capacity.acquire(), acquired.set()))
+        thread.start()
+
+        self.assertFalse(acquired.wait(0.05))
+        capacity.release()
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(capacity.in_use, 2)
+
+
+    def test_loops_and_threads_share_slots(self):
+        """
+        Test that a coroutine on another thread's event loop is woken by a release from this thread.
+        """
+        capacity = concurrency.SharedCapacity(1)
+        capacity.acquire()
+        acquired = threading.Event()
+
+        async def waiter():
+            await capacity.acquire_async()
+            acquired.set()
+
+        thread = threading.Thread(target = lambda: asyncio.run(waiter()))
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        capacity.release()
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(capacity.in_use, 1)
@@ -0,0 +1,143 @@
+"""
+# test/test_daemon.py
+Unit tests for the daemon module.
+It tests schedule parsing, that a webhook event warms the new item's cast and crew on the shared pool,
+that the webhook token is enforced and that a due schedule starts an incremental run.
+"""
+import datetime
+import json
+import os
+import tempfile
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+from retry import retry
+from state_store import state_store
+from daemon import daemon
+from warmer import warmer
+
+class TestSchedule(unittest.TestCase):
+    """
+    Unit tests for daemon.parse_times() and daemon.next_run().
+    """
+    def test_parse_times(self):
+        """
+        Test that times are sorted and malformed ones are rejected.
+        """
+        self.assertEqual(daemon.parse_times("15:30, 03:00"), [(3, 0), (15, 30)])
+        self.assertEqual(daemon.parse_times(""), [])
+        for times in ("3pm", "24:00", "12:60"):
+            with self.assertRaises(ValueError):
+                daemon.parse_times(times)
+
+
+    def test_next_run(self):
+        """
+        Test that the next run is later today or rolls over to tomorrow.
+        """
+        times = [(3, 0), (15, 30)]
+        self.assertEqual(daemon.next_run(times, datetime.datetime(2025, 7, 8, 10, 0)), datetime.datetime(2025, 7, 8, 15, 30))
+        self.assertEqual(daemon.next_run(times, datetime.datetime(2025, 7, 8, 15, 30)), datetime.datetime(2025, 7, 9, 3, 0))
+        self.assertIsNone(daemon.next_run([], datetime.datetime(2025, 7, 8, 10, 0)))
+
+
+class TestDaemon(unittest.TestCase):
+    """
+    Unit tests for the daemon.Daemon class, served on a free local port.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.env = {"API_KEY": "key", "BASE_URL": "https://jellyfin.example.com", "USER": "john", "USERID": "user", "CORE_COUNT": 2, "MAX_ATTEMPTS": 1, "DAEMON_HOST": "127.0.0.1", "DAEMON_PORT": 0, "DAEMON_SCHEDULE": "",
+                    "WEBHOOK_TOKEN": "secret", "STATE_DB": os.path.join(self.directory.name, "state.db")}
+        self.warmed = []
+        print_patch = patch("builtins.print")
+        print_patch.start()
+        self.addCleanup(print_patch.stop)
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def warm(self, request_env, person_id):
+        self.warmed.append(person_id)
+        return retry.attempt_result(200)
+
+
+    def post(self, server, event, token = "secret"):
+        request = urllib.request.Request(server.address, data = json.dumps(event).encode(), headers = {"X-Webhook-Token": token}, method = "POST")
+        try:
+            with urllib.request.urlopen(request, timeout = 5) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+    @patch("fetch_request.fetch_request.get_item_people")
+    def test_webhook_warms_new_crew(self, mock_people):
+        """
+        Test that an ItemAdded event warms the item's people once, skipping those STATE_DB already has.
+        """
+        mock_people.return_value = {"crew_001": "tag1", "crew_002": None}
+        store = state_store.StateStore(self.env["STATE_DB"])
+        store.record_warmed({"crew_001": "tag1"})
+        store.close()
+        server = daemon.Daemon(warmer.Warmer(self.env)).start()
+        self.addCleanup(server.stop)
+        with patch("fetch_request.fetch_request.warm_person", self.warm):
+            self.assertEqual(self.post(server, {"NotificationType": "ItemAdded", "ItemId": "movie_001"}), 202)
+            self.wait_for(lambda: server.health()["warmed"])
+
+        mock_people.assert_called_once_with(server.request_env, "movie_001")
+        self.assertEqual(self.warmed, ["crew_002"])
+        self.assertEqual(server.health()["queued_items"], 0)
+        store = state_store.StateStore(self.env["STATE_DB"])
+        self.assertIn("crew_002", store.get_warmed_tags())
+        store.close()
+
+
+    @patch("fetch_request.fetch_request.get_item_people")
+    def test_webhook_rejects_bad_requests(self, mock_people):
+        """
+        Test the token check, other notification types and unknown paths.
+        """
+        server = daemon.Daemon(warmer.Warmer(self.env)).start()
+        self.addCleanup(server.stop)
+        self.assertEqual(self.post(server, {"ItemId": "movie_001"}, token = "wrong"), 401)
+        self.assertEqual(self.post(server, {"NotificationType": "PlaybackStart", "ItemId": "movie_001"}), 200)
+        with urllib.request.urlopen(server.address.replace("/webhook", "/health"), timeout = 5) as response:
+            self.assertEqual(json.load(response)["queued_items"], 0)
+        mock_people.assert_not_called()
+
+
+    @patch("warmer.warmer.record_watermarks")
+    @patch("warmer.warmer.run")
+    def test_scheduled_incremental_run(self, mock_run, mock_record):
+        """
+        Test that a due schedule runs incrementally on the daemon's pool and moves the watermark.
+        """
+        mock_run.return_value = {"listed": 3, "warmed": {"crew_001"}, "metrics": unittest.mock.MagicMock()}
+        clock = [datetime.datetime(2025, 7, 8, 2, 59, 59, 990000)]
+        server = daemon.Daemon(warmer.Warmer({**self.env, "DAEMON_SCHEDULE": "03:00"}), now = lambda: clock[0])
+        clock[0] = datetime.datetime(2025, 7, 8, 3, 0, 1) # Due by the time the worker looks
+        server.start()
+        self.addCleanup(server.stop)
+        self.wait_for(lambda: server.health()["last_run"])
+
+        request_env = mock_run.call_args.args[0]
+        self.assertTrue(request_env["INCREMENTAL"])
+        self.assertIs(mock_run.call_args.kwargs["executor"], server.warmer.executor)
+        mock_record.assert_called_once()
+        self.assertEqual(server.health()["next_run"], "2025-07-09T03:00:00")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+# test/test_fake_jellyfin.py
+Unit tests for the fake_jellyfin server and the bench command running on top of it.
+Every test starts its own server on a free local port.
+"""
+import os
+import unittest
+from unittest.mock import patch
+import requests
+from bench import bench
+from fake_jellyfin import fake_jellyfin
+
+class TestFakeJellyfin(unittest.TestCase):
+    """
+    Unit tests for the fake_jellyfin.FakeJellyfin server.
+    """
+    def setUp(self):
+        self.server = fake_jellyfin.FakeJellyfin(persons = 5).start()
+
+
+    def tearDown(self):
+        self.server.stop()
+
+
+    def test_paginated_persons(self):
+        """
+        Test that the Persons listing pages like Jellyfin.
+        """
+        response = requests.get(f"{self.server.base_url}/emby/Persons", params = {"StartIndex": 2, "Limit": 2}, timeout = 5)
+        data = response.json()
+
+        self.assertEqual(data["TotalRecordCount"], 5)
+        self.assertEqual([item["Id"] for item in data["Items"]], ["person00000002", "person00000003"])
+        self.assertEqual(data["Items"][0]["ImageTags"], {"Primary": "tag2"})
+
+
+    def test_detail_and_image(self):
+        """
+        Test the detail page and the image HEAD check, HEAD on the detail page is refused like Jellyfin does.
+        """
+        detail = requests.get(f"{self.server.base_url}/Users/user/Items/person00000001", timeout = 5)
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(detail.json()["Id"], "person00000001")
+        self.assertEqual(requests.get(f"{self.server.base_url}/Users/user/Items/nobody", timeout = 5).status_code, 404)
+        self.assertEqual(requests.head(f"{self.server.base_url}/Users/user/Items/person00000001", timeout = 5).status_code, 405)
+
+        statuses = {requests.head(f"{self.server.base_url}/Items/person{index:08d}/Images/Primary", timeout = 5).status_code for index in range(5)}
+        self.assertEqual(statuses, {200, 404})
+        self.assertEqual(self.server.requests, 8)
+
+
+    def test_error_injection(self):
+        """
+        Test that the error rate answers 503 with Retry-After.
+        """
+        self.server.error_rate = 1.0
+        response = requests.get(f"{self.server.base_url}/Users/user/Items/person00000001", timeout = 5)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+
+class TestBench(unittest.TestCase):
+    """
+    Unit tests for the bench.main() command.
+    """
+    @patch("builtins.print")
+    def test_every_engine_warms_everyone(self, mock_print):
+        """
+        Test that both engines list and warm the whole fake library.
+        """
+        with patch.dict(os.environ):
+            reports = bench.main(["--persons", "30", "--latency", "0", "--page-size", "10", "--threads", "4", "--concurrency", "4"])
+
+        self.assertEqual([report["engine"] for report in reports], ["thread", "async"])
+        for report in reports:
+            self.assertEqual(report["persons"]["warmed"], 30)
+            self.assertEqual(report["requests"]["by_status"], {"200": 30})
+
+
+    @patch("builtins.print")
+    def test_strategies_report_bytes(self, mock_print):
+        """
+        Test that every warm-up strategy reaches the fake server and reports what it downloaded.
+        """
+        with patch.dict(os.environ):
+            reports = bench.main(["--persons", "20", "--latency", "0", "--threads", "4", "--concurrency", "4",
+                                  "--strategies", "full", "minimal", "headers", "image"])
+
+        by_strategy = {(report["engine"], report["strategy"]): report for report in reports}
+        for engine in ("thread", "async"):
+            full, minimal, headers, image = (by_strategy[(engine, strategy)] for strategy in ("full", "minimal", "headers", "image"))
+            self.assertEqual(full["persons"]["warmed"], 20)
+            self.assertEqual(minimal["persons"]["warmed"], 20)
+            self.assertEqual(headers["persons"]["warmed"], 20)
+            self.assertEqual(headers["requests"]["bytes"], 0)
+            self.assertLess(minimal["requests"]["bytes"], full["requests"]["bytes"])
+            # Half of the fake library has no portrait to download
+            self.assertEqual(image["requests"]["by_status"], {"200": 10, "404": 10})
+            self.assertGreater(image["requests"]["bytes_per_request"], full["requests"]["bytes_per_request"])
@@ -1,17 +1,20 @@
 """
 # test/test_fetch_request.py
 Unit tests for the fetch_request module.
-This module tests the functions that fetch crew IDs and cast details from a Jellyfin server.
+This module tests the functions that list crew IDs and warm cast details on a Jellyfin server.
 It includes tests for successful API calls, handling of various response structures, and error handling.
 """
+import json
+import threading
 import unittest
 from unittest.mock import patch, Mock, call
 import requests
 from fetch_request import fetch_request
+from warmer import warmer
 
 class TestGetCrewIds(unittest.TestCase):
     """
-    Unit tests for the fetch_request.get_all_crew_ids() and fetch_request.get_cast_and_crew() functions.
+    Unit tests for the fetch_request.iter_crew() listing and the fetch_request.warm_person() requests.
     """
     def setUp(self):
         """
@@ -66,7 +69,7 @@ class TestGetCrewIds(unittest.TestCase):
 
 
     # Mocking requests.get function
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_return_crew_ids_structure(self, mock_get):
         """
         Test that the function fetching the correct endpoint.
@@ -80,21 +83,22 @@ class TestGetCrewIds(unittest.TestCase):
         mock_get.return_value = mock_response
 
         # Need to fetch first then test for structure
-        fetch_request.get_all_crew_ids(self.env["complete"])
+        dict(fetch_request.iter_crew(self.env["complete"]))
 
         # Make sure the structure is intact
         mock_get.assert_called_once_with(
             self.env["complete"]["BASE_URL"]+"/emby/Persons",
-            params={"api_key": self.env["complete"]["API_KEY"]},
-            timeout=self.env["complete"]["TIMEOUT"]
+            params={"api_key": self.env["complete"]["API_KEY"], "StartIndex": 0, "Limit": 1000},
+            timeout=self.env["complete"]["TIMEOUT"],
+            stream=False
         )
 
 
     # Mocking requests.get function
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_successful_return_crew_ids(self, mock_get):
         """
-        Test successful API call returns correct set of crew IDs.
+        Test successful API call returns every crew ID.
         """
         mock_response = Mock()
         # mock raise_for_status() function
@@ -104,16 +108,16 @@ class TestGetCrewIds(unittest.TestCase):
 
         mock_get.return_value = mock_response
 
-        result = fetch_request.get_all_crew_ids(self.env["complete"])
+        result = dict(fetch_request.iter_crew(self.env["complete"]))
 
         # Verify the result
         expected_result = { "crew_001", "crew_002", "crew_003" }
-        self.assertEqual(result, expected_result)
-        self.assertIsInstance(result, set)
+        self.assertEqual(set(result), expected_result)
+        self.assertIsInstance(result, dict)
 
 
-    @patch('requests.get')
-    def test_empty_items_list_returns_empty_set(self, mock_get):
+    @patch('requests.Session.get')
+    def test_empty_items_list_returns_empty(self, mock_get):
         """
         Test API response with empty Items list returns empty set.
         """
@@ -122,16 +126,16 @@ class TestGetCrewIds(unittest.TestCase):
         mock_response.json.return_value = self.mock_response_data.get("empty_items")
         mock_get.return_value = mock_response
 
-        result = fetch_request.get_all_crew_ids(self.env["complete"])
+        result = dict(fetch_request.iter_crew(self.env["complete"]))
 
         # Verify the result
         expected_result = set()
-        self.assertEqual(result, expected_result)
-        self.assertIsInstance(result, set)
+        self.assertEqual(set(result), expected_result)
+        self.assertIsInstance(result, dict)
 
 
-    @patch('requests.get')
-    def test_missing_items_key_returns_empty_set(self, mock_get):
+    @patch('requests.Session.get')
+    def test_missing_items_key_returns_empty(self, mock_get):
         """
         Test API response with empty Items list returns empty set.
         """
@@ -140,16 +144,16 @@ class TestGetCrewIds(unittest.TestCase):
         mock_response.json.return_value = self.mock_response_data.get("no_valid_key")
         mock_get.return_value = mock_response
 
-        result = fetch_request.get_all_crew_ids(self.env["complete"])
+        result = dict(fetch_request.iter_crew(self.env["complete"]))
 
         # Verify the result
         expected_result = set()
-        self.assertEqual(result, expected_result)
-        self.assertIsInstance(result, set)
+        self.assertEqual(set(result), expected_result)
+        self.assertIsInstance(result, dict)
 
 
-    @patch('requests.get')
-    def test_some_missing_id_key_returns_valid_set(self, mock_get):
+    @patch('requests.Session.get')
+    def test_some_missing_id_key_returns_valid(self, mock_get):
         """
         Test API response with empty Items list returns empty set.
         """
@@ -158,16 +162,16 @@ class TestGetCrewIds(unittest.TestCase):
         mock_response.json.return_value = self.mock_response_data.get("missing_id")
         mock_get.return_value = mock_response
 
-        result = fetch_request.get_all_crew_ids(self.env["complete"])
+        result = dict(fetch_request.iter_crew(self.env["complete"]))
 
         # Verify the result
         expected_result = { "crew_001", "crew_003" }
-        self.assertEqual(result, expected_result)
-        self.assertIsInstance(result, set)
+        self.assertEqual(set(result), expected_result)
+        self.assertIsInstance(result, dict)
 
 
-    @patch('requests.get')
-    def test_duplicate_id_keys_returns_unique_set(self, mock_get):
+    @patch('requests.Session.get')
+    def test_duplicate_id_keys_returns_unique(self, mock_get):
         """
         Test API response with empty Items list returns empty set.
         """
@@ -176,18 +180,18 @@ class TestGetCrewIds(unittest.TestCase):
         mock_response.json.return_value = self.mock_response_data["duplicate_id"]
         mock_get.return_value = mock_response
 
-        result = fetch_request.get_all_crew_ids(self.env["complete"])
+        result = dict(fetch_request.iter_crew(self.env["complete"]))
 
         # Verify the result
         expected_result = { "crew_001" }
-        self.assertEqual(result, expected_result)
-        self.assertIsInstance(result, set)
+        self.assertEqual(set(result), expected_result)
+        self.assertIsInstance(result, dict)
 
 
-    @patch('builtins.exit') # Mock system buildtin functions
+    @patch('time.sleep')
     @patch('builtins.print')
-    @patch("requests.get")
-    def test_request_timeout_exception_handling(self, mock_get, mock_print, mock_exit):
+    @patch("requests.Session.get")
+    def test_request_timeout_exception_handling(self, mock_get, mock_print, mock_sleep):
         """
         Test that request timeout exceptions are handled correctly.
         """
@@ -196,177 +200,457 @@ class TestGetCrewIds(unittest.TestCase):
         mock_response.raise_for_status.side_effect = requests.exceptions.Timeout
         mock_get.return_value = mock_response
 
-        # The mock should terminate the program
-        mock_exit.side_effect = SystemExit(0)
-
         # Call the function with anticipation of exception raising
-        with self.assertRaises(SystemExit):
-            fetch_request.get_all_crew_ids(self.env["complete"])
+        with self.assertRaises(fetch_request.ListingError) as raised:
+            dict(fetch_request.iter_crew(self.env["complete"]))
 
-        # Verify the exception was handled correctly
-        mock_print.assert_called_once_with("Error fetching all crew and casts: . Exiting...")
-        mock_exit.assert_called_once_with(0)
+        # Verify the exception was handled correctly, the first page is retried before giving up
+        mock_print.assert_has_calls([
+            call("Retry attempt #1 for persons starting at 0"),
+            call("Retry attempt #2 for persons starting at 0")
+        ])
+        self.assertEqual(str(raised.exception), "Error fetching all crew and casts: ")
+        self.assertEqual(mock_get.call_count, 3)
 
 
-    @patch('requests.get')
+    @patch('time.sleep')
+    @patch('requests.Session.get')
     @patch('builtins.print')
-    @patch('builtins.exit')
-    def test_request_http_error_handling(self, mock_exit, mock_print, mock_get):
-        """Test that HTTP errors (like 404, 500) cause error message and exit."""
+    def test_request_http_error_handling(self, mock_print, mock_get, mock_sleep):
+        """Test that HTTP errors (like 404, 500) raise a ListingError with the cause."""
         mock_response = Mock()
         mock_response.raise_for_status.side_effect = requests.HTTPError("404 Not Found")
         mock_get.return_value = mock_response
 
-        mock_exit.side_effect = SystemExit(0)
-
-        with self.assertRaises(SystemExit):
-            fetch_request.get_all_crew_ids(self.env["complete"])
+        with self.assertRaises(fetch_request.ListingError) as raised:
+            dict(fetch_request.iter_crew(self.env["complete"]))
 
-        mock_print.assert_called_once_with("Error fetching all crew and casts: 404 Not Found. Exiting...")
-        mock_exit.assert_called_once_with(0)
+        self.assertEqual(str(raised.exception), "Error fetching all crew and casts: 404 Not Found")
+        self.assertIsInstance(raised.exception.__cause__, requests.HTTPError)
 
 
-    @patch('requests.get')
+    @patch('time.sleep')
+    @patch('requests.Session.get')
     @patch('builtins.print')
-    @patch('builtins.exit')
-    def test_json_decode_error_is_caught(self, mock_exit, mock_print, mock_get):
+    def test_json_decode_error_is_caught(self, mock_print, mock_get, mock_sleep):
         """Test that JSON decode errors are caught as RequestException."""
         mock_response = Mock()
         mock_response.json.side_effect = requests.JSONDecodeError("Invalid JSON", "HTTP Response returned Invalid JSON", 0)
         mock_get.return_value = mock_response
 
-        mock_exit.side_effect = SystemExit(0)
-
-        with self.assertRaises(SystemExit):
-            fetch_request.get_all_crew_ids(self.env["complete"])
+        with self.assertRaises(fetch_request.ListingError) as raised:
+            dict(fetch_request.iter_crew(self.env["complete"]))
 
-        mock_print.assert_called_once_with("Error fetching all crew and casts: Invalid JSON: line 1 column 1 (char 0). Exiting...")
-        mock_exit.assert_called_once_with(0)
+        self.assertEqual(str(raised.exception), "Error fetching all crew and casts: Invalid JSON: line 1 column 1 (char 0)")
 
 
-    @patch("requests.get")
-    def test_get_cast_and_crew_structure(self, mock_get):
+    @patch("requests.Session.get")
+    def test_warm_person_structure(self, mock_request):
         """
         Test that the function fetching the correct endpoint for cast and crew details.
         """
-        mock_response = Mock()
-        mock_response.raise_for_status.return_value = None
-        mock_response.json.return_value = self.mock_response_data.get("valid_data")
-
-        mock_get.return_value = mock_response
+        mock_request.return_value.ok = True
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.iter_content.return_value = []
 
-        # Need to fetch first then test for structure
-        fetch_request.get_cast_and_crew(self.env["complete"], self.person_id)
+        fetch_request.warm_person(self.env["complete"], self.person_id)
 
         # Make sure the structure is intact
-        mock_get.assert_called_once_with(
+        mock_request.assert_called_once_with(
             f"{self.env['complete']['BASE_URL']}/Users/{self.env['complete']['USERID']}/Items/{self.person_id}",
             params={"api_key": self.env["complete"]["API_KEY"]},
-            timeout=self.env["complete"]["TIMEOUT"]
+            timeout=self.env["complete"]["TIMEOUT"],
+            stream=True
         )
 
 
-    @patch('requests.get')
-    def test_successful_request_first_attempt(self, mock_get):
-        """Test successful API call on first attempt."""
-        # Mock successful response
+    @patch("requests.Session.get")
+    def test_get_image_tags_in_batches(self, mock_get):
+        """
+        Test that persons are looked up batch_size at a time and their current image tag and name returned.
+        """
         mock_response = Mock()
         mock_response.raise_for_status.return_value = None
+        mock_response.json.side_effect = [
+            {"Items": [{"Id": "crew_001", "Name": "One", "ImageTags": {"Primary": "tag1"}}, {"Id": "crew_002", "Name": "Two", "ImageTags": {}}]},
+            {"Items": []}
+        ]
         mock_get.return_value = mock_response
 
-        fetch_request.get_cast_and_crew(self.env["complete"], self.person_id)
+        tags = fetch_request.get_image_tags(self.env["complete"], ["crew_001", "crew_002", "crew_003"], batch_size = 2)
+
+        self.assertEqual(tags, {"crew_001": ("tag1", "One"), "crew_002": (None, "Two")})
+        self.assertEqual([call.kwargs["params"]["Ids"] for call in mock_get.call_args_list], ["crew_001,crew_002", "crew_003"])
+
+
+    @patch('requests.Session.get')
+    def test_successful_request_first_attempt(self, mock_request):
+        """Test successful API call on first attempt."""
+        mock_request.return_value.ok = True
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.iter_content.return_value = [b"{}"]
+
+        result = fetch_request.warm_person(self.env["complete"], self.person_id)
 
+        self.assertEqual((result["ok"], result["status"], result["bytes"]), (True, 200, 2))
         # Verify only one attempt was made
-        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(mock_request.call_count, 1)
 
 
     @patch('time.sleep')
-    @patch('builtins.print')
-    @patch('requests.get')
-    def test_successful_request_second_attempt(self, mock_get, mock_print, mock_sleep):
-        """Test successful API call on second attempt."""
-        # Mock successful response
-        mock_response = Mock()
-        # List of side effects meaning 1st time & 2nd time calling raise_for_status() function
-        mock_response.raise_for_status.side_effect = [
-            requests.exceptions.Timeout, # 1st time calling will return timeout exception
-            mock_response # 2nd time calling will return proper result
-        ]
-        mock_get.return_value = mock_response
+    @patch('requests.Session.get')
+    def test_failed_attempt_is_not_retried_in_place(self, mock_request, mock_sleep):
+        """Test that a timeout or server error is handed back for the retry scheduler, the worker neither retries nor sleeps."""
+        mock_request.side_effect = requests.exceptions.Timeout("timed out")
+        result = fetch_request.warm_person(self.env["complete"], self.person_id)
+        self.assertEqual((result["ok"], result["retry"], result["error"], result["exception"]), (False, True, "timed out", "Timeout"))
+
+        mock_request.side_effect = None
+        mock_request.return_value.ok = False
+        mock_request.return_value.status_code = 503
+        mock_request.return_value.reason = "Service Unavailable"
+        mock_request.return_value.headers = {"Retry-After": "2"}
+        mock_request.return_value.iter_content.return_value = []
+        result = fetch_request.warm_person(self.env["complete"], self.person_id)
+        self.assertEqual((result["ok"], result["retry"], result["error"]), (False, True, "503 Service Unavailable"))
+
+        self.assertEqual(mock_request.call_count, 2)
+        mock_sleep.assert_not_called()
 
-        fetch_request.get_cast_and_crew(self.env["complete"], self.person_id)
 
-        # Verify print is called once
-        mock_print.assert_called_once_with(f"Retry attempt #1 for person {self.person_id}")
-        # Verify sleep was called once (after first failure)
-        mock_sleep.assert_called_once_with(1)
+    @patch('builtins.print')
+    @patch('requests.Session.get')
+    def test_successful_request_third_attempt(self, mock_request, mock_print):
+        """Test that the retry scheduler brings a failing person back until it succeeds."""
+        ok = Mock(ok = True, status_code = 200)
+        ok.iter_content.return_value = []
+        mock_request.side_effect = [requests.exceptions.Timeout, requests.exceptions.ConnectionError, ok]
+        env = { **self.env["complete"], "CORE_COUNT": 1, "MAX_ATTEMPTS": 3, "RETRY_BASE_DELAY": 0 }
 
-        # Verify only one attempt was made
-        self.assertEqual(mock_get.call_count, 2)
+        warmed = warmer.execute_requests(env, [self.person_id])
+
+        self.assertEqual(warmed, {self.person_id})
+        self.assertEqual(mock_request.call_count, 3)
 
 
-    @patch('time.sleep')
     @patch('builtins.print')
-    @patch('requests.get')
-    def test_successful_request_third_attempt(self, mock_get, mock_print, mock_sleep):
-        """Test successful API call on second attempt."""
-        # Mock successful response
+    @patch('requests.Session.get')
+    def test_fail_request_exhausted_attempt(self, mock_request, mock_print):
+        """Test that a person failing MAX_ATTEMPTS times is given up on and left out of the warmed set."""
+        mock_request.side_effect = requests.exceptions.Timeout
+        env = { **self.env["complete"], "CORE_COUNT": 1, "MAX_ATTEMPTS": 3, "RETRY_BASE_DELAY": 0 }
+
+        warmed = warmer.execute_requests(env, [self.person_id])
+
+        self.assertEqual(warmed, set())
+        self.assertEqual(mock_request.call_count, 3)
+
+
+class TestSession(unittest.TestCase):
+    """
+    Unit tests for the fetch_request.get_session() and fetch_request.close_sessions() functions.
+    """
+    def setUp(self):
+        """
+        Start every test with no pooled sessions
+        """
+        fetch_request.close_sessions()
+        self.env = {
+            "BASE_URL": "https://jellyfin.example.com",
+            "POOL_MAXSIZE": 2,
+            "KEEP_ALIVE": True
+        }
+
+
+    def tearDown(self):
+        fetch_request.close_sessions()
+
+
+    def test_same_thread_reuses_session(self):
+        """
+        Test that the same thread always gets the same session back.
+        """
+        session = fetch_request.get_session(self.env)
+        self.assertIs(fetch_request.get_session(self.env), session)
+        # Pool size is configured on the mounted adapter
+        self.assertEqual(session.get_adapter(self.env["BASE_URL"])._pool_maxsize, 2)
+        self.assertEqual(session.headers["Connection"], "keep-alive")
+
+
+    def test_other_thread_gets_own_session(self):
+        """
+        Test that each worker thread owns a separate session.
+        """
+        sessions = []
+        worker = threading.Thread(target=lambda: sessions.append(fetch_request.get_session(self.env)))
+        worker.start()
+        worker.join()
+
+        self.assertIsNot(sessions[0], fetch_request.get_session(self.env))
+
+
+    def test_keep_alive_disabled(self):
+        """
+        Test that disabling keep-alive asks the server to close the connection.
+        """
+        self.env["KEEP_ALIVE"] = False
+        session = fetch_request.get_session(self.env)
+        self.assertEqual(session.headers["Connection"], "close")
+
+
+    def test_close_sessions_recreates_session(self):
+        """
+        Test that a closed session is never handed out again.
+        """
+        session = fetch_request.get_session(self.env)
+        fetch_request.close_sessions()
+        self.assertIsNot(fetch_request.get_session(self.env), session)
+
+
+class TestGetAllCrew(unittest.TestCase):
+    """
+    Unit tests for the fetch_request.iter_crew() function.
+    """
+    @patch("requests.Session.get")
+    def test_primary_image_tags(self, mock_get):
+        """
+        Test that the primary image tag is read from ImageTags or PrimaryImageTag.
+        """
         mock_response = Mock()
-        # List of side effects meaning 1st time & 2nd time calling raise_for_status() function
-        mock_response.raise_for_status.side_effect = [
-            requests.exceptions.Timeout, # 1st time calling
-            requests.RequestException, # 2st time calling
-            mock_response # 3nd time calling
-        ]
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {
+            "Items": [
+                {"Id": "crew_001", "ImageTags": {"Primary": "tag_1"}},
+                {"Id": "crew_002", "PrimaryImageTag": "tag_2"},
+                {"Id": "crew_003", "ImageTags": {}},
+                {"Name": "No Id"}
+            ]
+        }
         mock_get.return_value = mock_response
 
-        fetch_request.get_cast_and_crew(self.env["complete"], self.person_id)
+        result = dict(fetch_request.iter_crew({"BASE_URL": "https://jellyfin.example.com", "API_KEY": "key", "TIMEOUT": 30}))
 
-        # Verify print is called once
-        # mock_print.assert_called_once_with(f"Retry attempt #1 for person {self.person_id}")
-        mock_print.assert_has_calls([
-            call(f"Retry attempt #1 for person {self.person_id}"),
-            call(f"Retry attempt #2 for person {self.person_id}"),
-        ])
-        # Verify sleep was called once (after first failure)
-        mock_sleep.assert_has_calls([
-            call(1),
-            call(1)
-        ])
+        self.assertEqual(result, {"crew_001": "tag_1", "crew_002": "tag_2", "crew_003": None})
 
-        # Verify only one attempt was made
-        self.assertEqual(mock_get.call_count, 3)
 
+    @patch("requests.Session.get")
+    def test_pages_are_deduplicated(self, mock_get):
+        """
+        Test that every page is requested and IDs repeated across pages are only yielded once.
+        """
+        pages = [
+            {"Items": [{"Id": "crew_001"}, {"Id": "crew_002"}], "TotalRecordCount": 5},
+            {"Items": [{"Id": "crew_002"}, {"Id": "crew_003"}], "TotalRecordCount": 5},
+            {"Items": [{"Id": "crew_004"}], "TotalRecordCount": 5}
+        ]
+        mock_get.return_value.json.side_effect = pages
+        env = {"BASE_URL": "https://jellyfin.example.com", "API_KEY": "key", "TIMEOUT": 30, "PAGE_SIZE": 2}
 
-    @patch('time.sleep')
-    @patch('builtins.print')
-    @patch('requests.get')
-    def test_fail_request_exhausted_attempt(self, mock_get, mock_print, mock_sleep):
-        """Test successful API call on second attempt."""
-        # Mock successful response
-        mock_response = Mock()
-        # List of side effects meaning 1st time & 2nd time calling raise_for_status() function
-        mock_response.raise_for_status.side_effect = [
-            requests.exceptions.Timeout, # 1st time calling
-            requests.RequestException, # 2st time calling
-            requests.exceptions.Timeout, # 3st time calling
+        result = [person_id for person_id, _ in fetch_request.iter_crew(env)]
+
+        self.assertEqual(result, ["crew_001", "crew_002", "crew_003", "crew_004"])
+        self.assertEqual([c.kwargs["params"]["StartIndex"] for c in mock_get.call_args_list], [0, 2, 4])
+
+
+    @patch("time.sleep")
+    @patch("builtins.print")
+    @patch("requests.Session.get")
+    def test_failed_page_is_skipped(self, mock_get, mock_print, mock_sleep):
+        """
+        Test that a page failing every retry is skipped instead of failing the whole listing.
+        """
+        ok = Mock()
+        ok.json.side_effect = [
+            {"Items": [{"Id": "crew_001"}, {"Id": "crew_002"}], "TotalRecordCount": 5},
+            {"Items": [{"Id": "crew_005"}], "TotalRecordCount": 5}
         ]
-        mock_get.return_value = mock_response
+        mock_get.side_effect = [ok, requests.exceptions.Timeout("slow"), requests.exceptions.Timeout("slow"), requests.exceptions.Timeout("slow"), ok]
+        env = {"BASE_URL": "https://jellyfin.example.com", "API_KEY": "key", "TIMEOUT": 30, "PAGE_SIZE": 2}
 
-        fetch_request.get_cast_and_crew(self.env["complete"], self.person_id)
+        result = dict(fetch_request.iter_crew(env))
 
-        # Verify print is called once
-        mock_print.assert_has_calls([
-            call(f"Retry attempt #1 for person {self.person_id}"),
-            call(f"Retry attempt #2 for person {self.person_id}"),
-            call(f"Error fetching details for person {self.person_id}: "),
-        ])
-        # Verify sleep was called once (after first failure)
-        mock_sleep.assert_has_calls([
-            call(1),
-            call(1)
-            # 3rd call does not sleep, printing error immediately and return
-        ])
+        self.assertEqual(set(result), {"crew_001", "crew_002", "crew_005"})
+        mock_print.assert_any_call("Error fetching persons 2 to 3: slow. Skipping page...")
 
-        # Verify only one attempt was made
-        self.assertEqual(mock_get.call_count, 3)
+
+class TestCrewPageParams(unittest.TestCase):
+    """
+    Unit tests for the fetch_request.get_crew_page_params() function.
+    """
+    def setUp(self):
+        self.env = {"BASE_URL": "https://jellyfin.example.com", "API_KEY": "key", "TIMEOUT": 30, "PAGE_SIZE": 10}
+
+
+    def test_missing_mode_requests_image_fields(self):
+        """
+        Test that only TARGET_MODE=missing asks the listing for image fields.
+        """
+        self.assertNotIn("EnableImageTypes", fetch_request.get_crew_page_params(self.env, 0))
+
+        self.env["TARGET_MODE"] = "missing"
+        params = fetch_request.get_crew_page_params(self.env, 20)
+        self.assertEqual(params["StartIndex"], 20)
+        self.assertEqual(params["Limit"], 10)
+        self.assertEqual(params["EnableImageTypes"], "Primary")
+
+
+class TestListingParsers(unittest.TestCase):
+    """
+    Unit tests for the LISTING_PARSER options of fetch_request.iter_crew().
+    """
+    def setUp(self):
+        self.body = json.dumps({
+            "Items": [
+                {"Id": "crew_001", "Name": "John Doe", "ImageTags": {"Primary": "tag_1"}},
+                {"Name": "No Id"},
+                {"Id": "crew_002", "Name": "Jane \"]} Smith", "PrimaryImageTag": "tag_2"}
+            ],
+            "TotalRecordCount": 3
+        }).encode()
+        self.env = {"BASE_URL": "https://jellyfin.example.com", "API_KEY": "key", "TIMEOUT": 30, "PAGE_SIZE": 3}
+        self.expected = {"crew_001": "tag_1", "crew_002": "tag_2"}
+
+
+    @patch("requests.Session.get")
+    def test_stream_parser(self, mock_get):
+        """
+        Test that the streaming parser reads the body in chunks and closes the response.
+        """
+        mock_get.return_value.iter_content.return_value = [self.body[i:i + 7] for i in range(0, len(self.body), 7)]
+        self.env["LISTING_PARSER"] = "stream"
+
+        self.assertEqual(dict(fetch_request.iter_crew(self.env)), self.expected)
+        self.assertTrue(mock_get.call_args.kwargs["stream"])
+        mock_get.return_value.json.assert_not_called()
+        mock_get.return_value.close.assert_called_once()
+
+
+    @patch("requests.Session.get")
+    def test_orjson_parser(self, mock_get):
+        """
+        Test that the orjson parser decodes the raw body.
+        """
+        mock_get.return_value.content = self.body
+        self.env["LISTING_PARSER"] = "orjson"
+
+        self.assertEqual(dict(fetch_request.iter_crew(self.env)), self.expected)
+        mock_get.return_value.json.assert_not_called()
+
+
+class TestWarmStrategies(unittest.TestCase):
+    """
+    Unit tests for the WARM_STRATEGY requests of fetch_request.warm_person().
+    """
+    def setUp(self):
+        self.env = {"BASE_URL": "https://jellyfin.example.com", "API_KEY": "key", "USERID": "user", "TIMEOUT": 30}
+
+
+    def test_get_warm_request(self):
+        """
+        Test the URL, params, body reading and terminal statuses of every strategy.
+        """
+        expected = {
+            "full": ("https://jellyfin.example.com/Users/user/Items/crew_001", True, ()),
+            "minimal": ("https://jellyfin.example.com/Users/user/Items", True, ()),
+            "headers": ("https://jellyfin.example.com/Users/user/Items/crew_001", False, ()),
+            "image": ("https://jellyfin.example.com/Items/crew_001/Images/Primary", True, (404,))
+        }
+        for strategy, (url, read_body, terminal) in expected.items():
+            self.env["WARM_STRATEGY"] = strategy
+            request_url, params, request_read_body, request_terminal = fetch_request.get_warm_request(self.env, "crew_001")
+            self.assertEqual((request_url, request_read_body, request_terminal), (url, read_body, terminal))
+            self.assertEqual(params["api_key"], "key")
+        self.env["WARM_STRATEGY"] = "minimal"
+        self.assertEqual(fetch_request.get_warm_request(self.env, "crew_001")[1]["Ids"], "crew_001")
+
+        self.env["WARM_STRATEGY"] = "bogus"
+        with self.assertRaises(ValueError):
+            fetch_request.get_warm_request(self.env, "crew_001")
+
+
+    @patch("requests.Session.get")
+    def test_body_is_streamed_and_counted(self, mock_request):
+        """
+        Test that the body is read in chunks for its size and the response closed.
+        """
+        mock_request.return_value.ok = True
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.iter_content.return_value = [b"abc", b"de"]
+
+        result = fetch_request.warm_person(self.env, "crew_001")
+
+        self.assertEqual((result["ok"], result["bytes"]), (True, 5))
+        self.assertTrue(mock_request.call_args.kwargs["stream"])
+        mock_request.return_value.close.assert_called_once()
+
+
+    @patch("requests.Session.get")
+    def test_headers_strategy_skips_body(self, mock_request):
+        """
+        Test that the headers strategy sends a streamed GET, hangs up without reading the body and still closes the response.
+        """
+        mock_request.return_value.ok = True
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.iter_content.return_value = [b"abc"]
+        self.env["WARM_STRATEGY"] = "headers"
+
+        result = fetch_request.warm_person(self.env, "crew_001")
+
+        self.assertEqual((result["ok"], result["bytes"]), (True, 0))
+        self.assertTrue(mock_request.call_args.kwargs["stream"])
+        mock_request.return_value.iter_content.assert_not_called()
+        mock_request.return_value.close.assert_called_once()
+
+
+    @patch("requests.Session.get")
+    def test_image_strategy_missing_portrait(self, mock_request):
+        """
+        Test that the image strategy takes a 404 as a person without a portrait, done and not worth a retry, while a 500 still is.
+        """
+        mock_request.return_value.ok = False
+        mock_request.return_value.status_code = 404
+        mock_request.return_value.reason = "Not Found"
+        mock_request.return_value.iter_content.return_value = [b"missing"]
+        self.env["WARM_STRATEGY"] = "image"
+
+        result = fetch_request.warm_person(self.env, "crew_001")
+        self.assertEqual((result["ok"], result["retry"], result["status"], result["error"]), (True, False, 404, None))
+
+        mock_request.return_value.status_code = 500
+        mock_request.return_value.reason = "Internal Server Error"
+        mock_request.return_value.headers = {}
+        result = fetch_request.warm_person(self.env, "crew_001")
+        self.assertEqual((result["ok"], result["retry"]), (False, True))
+
+        # Any other strategy still fails a 404
+        self.env["WARM_STRATEGY"] = "full"
+        mock_request.return_value.status_code = 404
+        self.assertFalse(fetch_request.warm_person(self.env, "crew_001")["ok"])
+
+
+class TestIncrementalListing(unittest.TestCase):
+    """
+    Unit tests for fetch_request.iter_crew() with a watermark.
+    """
+    @patch("requests.Session.get")
+    def test_people_of_recent_items(self, mock_get):
+        """
+        Test that only the People of items created since the watermark are listed, once each.
+        """
+        mock_get.return_value.json.return_value = {
+            "Items": [
+                {"Id": "movie_1", "People": [{"Id": "crew_001", "PrimaryImageTag": "tag_1"}, {"Id": "crew_002"}]},
+                {"Id": "episode_1", "People": [{"Id": "crew_001", "PrimaryImageTag": "tag_1"}]},
+                {"Id": "movie_2"}
+            ],
+            "TotalRecordCount": 3
+        }
+        env = {"BASE_URL": "https://jellyfin.example.com", "API_KEY": "key", "USERID": "user", "TIMEOUT": 30, "TARGET_MODE": "missing"}
+
+        crew = list(fetch_request.iter_crew(env, "2026-01-01T00:00:00.000000Z"))
+
+        self.assertEqual(crew, [("crew_001", "tag_1"), ("crew_002", None)])
+        self.assertEqual(mock_get.call_args.args[0], "https://jellyfin.example.com/Users/user/Items")
+        params = mock_get.call_args.kwargs["params"]
+        self.assertEqual((params["MinDateCreated"], params["Recursive"], params["Fields"]), ("2026-01-01T00:00:00.000000Z", "true", "People"))
+        self.assertNotIn("EnableImageTypes", params)
@@ -0,0 +1,180 @@
+"""
+# test/test_image_cache.py
+Unit tests for the image_cache module.
+It tests how IMAGE_VARIANTS are parsed and spelled, that variants are fetched unconditionally once and with their validators afterwards,
+that both engine workers count proxy hits and failures, and that warmer.run() fetches the variants of everyone it warmed.
+"""
+import asyncio
+import os
+import pickle
+import tempfile
+import unittest
+from unittest.mock import patch
+import httpx
+from fake_jellyfin import fake_jellyfin
+from fetch_request import fetch_request
+from image_cache import image_cache
+from warmer import warmer
+
+VARIANTS = "fillHeight=396&fillWidth=264&quality=96; fillHeight=792&fillWidth=528&quality=96"
+
+class TestVariants(unittest.TestCase):
+    """
+    Unit tests for the image_cache helper functions.
+    """
+    def test_parse_variants(self):
+        """
+        Test that entries are split on ";" and anything that is not a query string is refused.
+        """
+        self.assertEqual(image_cache.parse_variants(VARIANTS), ["fillHeight=396&fillWidth=264&quality=96", "fillHeight=792&fillWidth=528&quality=96"])
+        self.assertEqual(image_cache.parse_variants("?quality=90;"), ["quality=90"])
+        self.assertEqual(image_cache.parse_variants(""), [])
+        with self.assertRaises(ValueError):
+            image_cache.parse_variants("quality=90;fillHeight")
+
+
+    def test_variant_url(self):
+        """
+        Test that the tag goes last unless the variant places it.
+        """
+        self.assertEqual(image_cache.variant_url("https://cdn.example.com", "crew_001", "tag_1", "quality=96"),
+                         "https://cdn.example.com/Items/crew_001/Images/Primary?quality=96&tag=tag_1")
+        self.assertEqual(image_cache.variant_url("https://cdn.example.com", "crew_001", "tag_1", "tag={tag}&quality=96"),
+                         "https://cdn.example.com/Items/crew_001/Images/Primary?tag=tag_1&quality=96")
+
+
+    def test_conditional_headers(self):
+        """
+        Test that only the validators the proxy sent are asked for.
+        """
+        self.assertEqual(image_cache.conditional_headers(None), {})
+        self.assertEqual(image_cache.conditional_headers(('"abc"', None)), { "If-None-Match": '"abc"' })
+        self.assertEqual(image_cache.conditional_headers((None, "Wed, 01 Jan 2026 00:00:00 GMT")), { "If-Modified-Since": "Wed, 01 Jan 2026 00:00:00 GMT" })
+
+
+class TestImageCache(unittest.TestCase):
+    """
+    Unit tests for the image_cache.ImageCache workers.
+    """
+    def setUp(self):
+        self.server = fake_jellyfin.FakeJellyfin(persons = 4, image_rate = 1.0).start()
+        self.env = { "BASE_URL": self.server.base_url, "TIMEOUT": 5, "IMAGE_VARIANTS": VARIANTS }
+        self.crew = { "person00000000": "tag0", "person00000001": None, "person00000002": "tag2" }
+
+
+    def tearDown(self):
+        fetch_request.close_sessions()
+        self.server.stop()
+
+
+    def test_warm_then_not_modified(self):
+        """
+        Test that the first run downloads every variant and the next one only revalidates them.
+        """
+        first = image_cache.ImageCache(self.env, self.crew)
+        for person_id in self.crew:
+            self.assertTrue(first.warm(self.env, person_id)["ok"])
+        self.assertEqual(first.counts, { "fetched": 4, "not_modified": 0, "hits": 0, "failed": 0 })
+        self.assertEqual(first.bytes, 4 * len(fake_jellyfin.IMAGE))
+        self.assertEqual(len(first.updated), 4)
+        # No tag means no image to fetch
+        self.assertEqual(self.server.requests, 4)
+
+        second = image_cache.ImageCache(self.env, self.crew, first.updated)
+        result = second.warm(self.env, "person00000000")
+        self.assertTrue(result["ok"])
+        self.assertEqual(result["bytes"], 0)
+        self.assertEqual(second.counts["not_modified"], 2)
+        self.assertEqual(second.updated, {})
+
+
+    def test_failure_and_retry(self):
+        """
+        Test that a failed variant fails the person and a retry skips the variants already fetched.
+        """
+        cache = image_cache.ImageCache({ **self.env, "IMAGE_BASE_URL": self.server.base_url + "/" }, { "person00000000": "tag0", "nobody": "tag" })
+        result = cache.warm(self.env, "nobody")
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["status"], 404)
+        self.assertEqual(cache.counts["failed"], 1)
+
+        cache.warm(self.env, "person00000000")
+        requests_sent = self.server.requests
+        self.assertTrue(cache.warm(self.env, "person00000000")["ok"])
+        self.assertEqual(self.server.requests, requests_sent)
+
+
+    def test_warm_async(self):
+        """
+        Test the async worker against a mock transport, proxy hits are counted and a 503 is worth a retry.
+        """
+        requested = []
+        def handle(request):
+            requested.append((str(request.url), request.headers.get("If-None-Match")))
+            if request.url.path.startswith("/Items/crew_002/"):
+                return httpx.Response(503, headers = { "Retry-After": "1" })
+            return httpx.Response(200, content = b"x" * 100, headers = { "ETag": '"v2"', "X-Cache-Status": "HIT" })
+
+        url = "https://cdn.example.com/Items/crew_001/Images/Primary?quality=96&tag=tag_1"
+        env = { "BASE_URL": "https://jellyfin.example.com", "IMAGE_BASE_URL": "https://cdn.example.com", "IMAGE_VARIANTS": "quality=96" }
+        cache = image_cache.ImageCache(env, { "crew_001": "tag_1", "crew_002": "tag_2" }, { url: ('"v1"', None) })
+
+        async def warm():
+            async with httpx.AsyncClient(transport = httpx.MockTransport(handle)) as client:
+                return [await cache.warm_async(client, env, person_id) for person_id in ("crew_001", "crew_002")]
+
+        ok, unavailable = asyncio.run(warm())
+        self.assertTrue(ok["ok"])
+        self.assertEqual(ok["bytes"], 100)
+        self.assertTrue(unavailable["retry"])
+        self.assertEqual(requested[0], (url, '"v1"'))
+        self.assertEqual(cache.counts, { "fetched": 1, "not_modified": 0, "hits": 1, "failed": 1 })
+        self.assertEqual(cache.updated, { url: ('"v2"', None) })
+
+
+    def test_merge_and_pickle(self):
+        """
+        Test that a cache survives the trip back from a shard process and adds up.
+        """
+        cache = image_cache.ImageCache(self.env, self.crew)
+        cache.warm(self.env, "person00000000")
+        merged = image_cache.ImageCache(self.env, {})
+        merged.merge(pickle.loads(pickle.dumps(cache)))
+        merged.merge(cache)
+
+        self.assertEqual(merged.counts["fetched"], 4)
+        self.assertEqual(merged.bytes, 4 * len(fake_jellyfin.IMAGE))
+        self.assertEqual(merged.updated, cache.updated)
+        self.assertEqual(merged.summary(), "4 variants fetched (0.1 MiB), 0 not modified, 0 already in the proxy cache, 0 failed.")
+
+
+class TestImageStage(unittest.TestCase):
+    """
+    Unit tests for the IMAGE_VARIANTS stage of warmer.run().
+    """
+    def setUp(self):
+        self.server = fake_jellyfin.FakeJellyfin(persons = 6, image_rate = 1.0).start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.env = { "API_KEY": "key", "BASE_URL": self.server.base_url, "USERID": "user", "CORE_COUNT": 2, "ASYNC_CONCURRENCY": 4, "TIMEOUT": 5, "MAX_ATTEMPTS": 1,
+                     "PAGE_SIZE": 10, "STATE_DB": os.path.join(self.directory.name, "state.db"), "IMAGE_VARIANTS": VARIANTS }
+
+
+    def tearDown(self):
+        fetch_request.close_sessions()
+        self.server.stop()
+        self.directory.cleanup()
+
+
+    @patch("builtins.print")
+    def test_variants_of_warmed_persons(self, mock_print):
+        """
+        Test that the persons with a portrait get their variants fetched and the next run revalidates them from STATE_DB.
+        """
+        for engine in ("thread", "async"):
+            with self.subTest(engine = engine):
+                result = warmer.run({ **self.env, "ENGINE": engine }, full = True)
+                self.assertEqual(len(result["warmed"]), 6)
+                self.assertIn("images", result["metrics"].phases)
+
+        # Half of the fake library has an image tag, the second run found every variant in STATE_DB
+        self.assertEqual(result["images"].counts, { "fetched": 0, "not_modified": 6, "hits": 0, "failed": 0 })
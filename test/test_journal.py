@@ -0,0 +1,81 @@
+"""
+# test/test_journal.py
+Unit tests for the journal module.
+It tests that outcomes are written in batches, read back after a crash cut the last line short, and that every run gets its own file.
+"""
+import os
+import tempfile
+import unittest
+from journal import journal
+from test.helpers import FakeClock
+
+class TestJournal(unittest.TestCase):
+    """
+    Unit tests for the journal.Journal class and the journal.load()/journal.journal_path() functions.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "journal.log")
+        self.clock = FakeClock()
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def test_batched_writes(self):
+        """
+        Test that nothing reaches the file until a batch is full or the interval passed.
+        """
+        run_journal = journal.Journal(self.path, batch_size = 3, interval = 5.0, clock = self.clock)
+        run_journal.record("crew_001", journal.OK)
+        run_journal.record("crew_002", "retry")
+        run_journal.record("crew_003", journal.FAILED)
+        self.assertEqual(journal.load(self.path), (set(), set()))
+
+        run_journal.record("crew_004", journal.OK)
+        self.assertEqual(journal.load(self.path), ({"crew_001", "crew_004"}, {"crew_003"}))
+
+        run_journal.record("crew_005", journal.OK)
+        self.clock.now = 5.0
+        run_journal.record("crew_006", journal.OK)
+        self.assertIn("crew_006", journal.load(self.path)[0])
+        run_journal.close()
+
+
+    def test_resume_appends_and_close_removes(self):
+        """
+        Test that resuming keeps the earlier outcomes, a later success wins over an earlier failure and a finished run removes the file.
+        """
+        first = journal.Journal(self.path)
+        first.record("crew_001", journal.FAILED)
+        first.record("crew_002", journal.OK)
+        first.close()
+
+        second = journal.Journal(self.path, resume = True)
+        second.record("crew_001", journal.OK)
+        second.flush()
+        self.assertEqual(journal.load(self.path), ({"crew_001", "crew_002"}, set()))
+
+        second.close(remove = True)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(journal.load(self.path), (set(), set()))
+
+
+    def test_truncated_line_is_ignored(self):
+        """
+        Test that a line cut short by a crash is not read as a person.
+        """
+        with open(self.path, "w", encoding = "utf-8") as file:
+            file.write("ok\tcrew_001\nok\tcrew_0")
+
+        self.assertEqual(journal.load(self.path), ({"crew_001"}, set()))
+
+
+    def test_journal_path(self):
+        """
+        Test that targets and shard processes never share a journal.
+        """
+        self.assertEqual(journal.journal_path({ "JOURNAL": "" }), "")
+        self.assertEqual(journal.journal_path({ "JOURNAL": "journal.log" }), "journal.log")
+        self.assertEqual(journal.journal_path({ "JOURNAL": "run/journal.log", "TARGET_NAME": "home" }, ((1, 2), (0, 4))), "run/journal.home.2-2.1-4.log")
@@ -0,0 +1,59 @@
+"""
+# test/test_json_stream.py
+Unit tests for the json_stream module.
+Bodies are fed in small chunks so items and multi-byte characters get split across chunk boundaries.
+"""
+import json
+import unittest
+from json_stream import json_stream
+
+def chunked(body: bytes, size: int) -> list:
+    """
+    Split a body into chunks of `size` bytes.
+    """
+    return [body[index:index + size] for index in range(0, len(body), size)]
+
+
+class TestListingStream(unittest.TestCase):
+    """
+    Unit tests for the json_stream.ListingStream class.
+    """
+    def test_items_across_chunks(self):
+        """
+        Test that every item is decoded whatever the chunk size, and TotalRecordCount after the array is found.
+        """
+        data = {"Items": [{"Id": f"crew_{index}", "Name": "Zoë [\"Bob\"] {x}", "ImageTags": {"Primary": "t"}} for index in range(50)],
+                "TotalRecordCount": 1234, "StartIndex": 0}
+        body = json.dumps(data, ensure_ascii = False).encode()
+
+        for size in (1, 3, 64, len(body)):
+            listing = json_stream.ListingStream(chunked(body, size))
+            self.assertEqual(list(listing.items()), data["Items"])
+            self.assertEqual(listing.total_count, 1234)
+
+
+    def test_total_before_items_and_empty(self):
+        """
+        Test TotalRecordCount before the array and an empty array.
+        """
+        listing = json_stream.ListingStream([b'{"TotalRecordCount": 0, "Items" : [ ] }'])
+        self.assertEqual(list(listing.items()), [])
+        self.assertEqual(listing.total_count, 0)
+
+
+    def test_missing_items(self):
+        """
+        Test that a body without Items yields nothing, like data.get('Items', []).
+        """
+        listing = json_stream.ListingStream([b'{"metadata": []}'])
+        self.assertEqual(list(listing.items()), [])
+        self.assertIsNone(listing.total_count)
+
+
+    def test_truncated_body(self):
+        """
+        Test that a body cut short is an error instead of a silently short page.
+        """
+        listing = json_stream.ListingStream([b'{"Items": [{"Id": "crew_001"}, {"Id": "cr'])
+        with self.assertRaises(json.JSONDecodeError):
+            list(listing.items())
@@ -1,7 +1,7 @@
 """
 # test/test_load_env.py
 Unit tests for the load_env.load_env() function.
-It includes tests for: ensuring the correct number of CPU cores is set, handling missing environment variables, and ensuring the function exits with an error message when required variables are not set.
+It includes tests for: ensuring the correct number of CPU cores is set, handling missing environment variables, and ensuring the function raises a ConfigError naming what to set when required variables are missing.
 """
 import unittest
 from unittest.mock import patch
@@ -83,13 +83,11 @@ class TestLoadEnv(unittest.TestCase):
                 self.assertEqual(result["CORE_COUNT"], 4)
 
 
-    @patch("builtins.exit")
-    @patch("builtins.print")
     @patch("os.getenv")
     @patch("os.cpu_count")
-    def test_missing_fields(self, mock_cpu_count, mock_getenv, mock_print, mock_exit):
+    def test_missing_fields(self, mock_cpu_count, mock_getenv):
         """
-        Test that if required environment variables are missing, the function prints an error message and exits with code 1.
+        Test that if required environment variables are missing, the function raises a ConfigError naming them.
         """
         mock_cpu_count.side_effect = [8]
 
@@ -97,11 +95,97 @@ class TestLoadEnv(unittest.TestCase):
             values = self.env["incomplete"]
             return values.get(key, default)
         mock_getenv.side_effect = getenv_side_effect
-        mock_exit.side_effect = SystemExit
 
-        with self.assertRaises(SystemExit):
+        with self.assertRaises(load_env.ConfigError) as raised:
             load_env.load_env()
 
-        # Verify the exception was handled correctly
-        mock_print.assert_called_once_with("Please set API_KEY, BASE_URL, USER, and USERID in your .env file.")
-        mock_exit.assert_called_once_with(1)
+        self.assertEqual(str(raised.exception), "Please set API_KEY, BASE_URL, USER, and USERID in your .env file.")
+
+
+    @patch("os.getenv")
+    def test_targets(self, mock_getenv):
+        """
+        Test that every target gets the shared settings with its own overrides, typed like the shared ones.
+        """
+        values = {
+            "API_KEY": "shared_key",
+            "USER": "john",
+            "USERID": "test_user_id_123",
+            "TARGETS": "home, cabin",
+            "HOME_BASE_URL": "https://home.example.com",
+            "CABIN_BASE_URL": "https://cabin.example.com",
+            "CABIN_API_KEY": "cabin_key",
+            "CABIN_CORE_COUNT": "2",
+            "CABIN_RATE_LIMIT": "2.5",
+            "CABIN_ADAPTIVE": "true"
+        }
+        mock_getenv.side_effect = lambda key, default = None: values.get(key, default)
+
+        home, cabin = load_env.load_env()["TARGETS"]
+
+        self.assertEqual((home["TARGET_NAME"], home["BASE_URL"], home["API_KEY"], home["CORE_COUNT"]), ("home", "https://home.example.com", "shared_key", 4))
+        self.assertEqual((cabin["TARGET_NAME"], cabin["BASE_URL"], cabin["API_KEY"]), ("cabin", "https://cabin.example.com", "cabin_key"))
+        self.assertEqual((cabin["CORE_COUNT"], cabin["RATE_LIMIT"], cabin["ADAPTIVE"]), (2, 2.5, True))
+        self.assertNotIn("TARGETS", cabin)
+
+
+    @patch("os.getenv")
+    def test_target_missing_fields(self, mock_getenv):
+        """
+        Test that a target without a server to talk to is reported by name.
+        """
+        values = { "API_KEY": "key", "USER": "john", "USERID": "user", "TARGETS": "home", "BASE_URL": "" }
+        mock_getenv.side_effect = lambda key, default = None: values.get(key, default)
+
+        with self.assertRaises(load_env.ConfigError) as raised:
+            load_env.load_env()
+
+        self.assertEqual(str(raised.exception), "Please set HOME_API_KEY, HOME_BASE_URL, HOME_USER, and HOME_USERID (or their shared defaults) in your .env file.")
+
+
+    @patch("os.getenv")
+    def test_bad_numbers(self, mock_getenv):
+        """
+        Test that a setting that is not a number is reported by name instead of escaping as a ValueError.
+        """
+        for values, message in (({ "CORE_COUNT": "abc" }, "CORE_COUNT must be a whole number in your .env file, got 'abc'."),
+                                ({ "RATE_LIMIT": "fast" }, "RATE_LIMIT must be a number in your .env file, got 'fast'."),
+                                ({ "TARGETS": "home", "HOME_PAGE_SIZE": "1e3" }, "HOME_PAGE_SIZE must be a whole number in your .env file, got '1e3'.")):
+            values = { **self.env["complete_no_core_count"], **values }
+            mock_getenv.side_effect = lambda key, default = None: values.get(key, default)
+            with self.assertRaises(load_env.ConfigError) as raised:
+                load_env.load_env()
+            self.assertEqual(str(raised.exception), message)
+
+
+    @patch("os.getenv")
+    def test_booleans(self, mock_getenv):
+        """
+        Test that a yes/no setting reads the same whether it is shared or set for one target, and that anything else is reported by name.
+        """
+        values = { **self.env["complete_no_core_count"], "TARGETS": "home, cabin", "KEEP_ALIVE": "off", "CABIN_KEEP_ALIVE": "On",
+                   "HOME_ADAPTIVE": "off", "ADAPTIVE": "Yes" }
+        mock_getenv.side_effect = lambda key, default = None: values.get(key, default)
+
+        env = load_env.load_env()
+        home, cabin = env["TARGETS"]
+
+        self.assertEqual((env["KEEP_ALIVE"], home["KEEP_ALIVE"], cabin["KEEP_ALIVE"]), (False, False, True))
+        self.assertEqual((env["ADAPTIVE"], home["ADAPTIVE"], cabin["ADAPTIVE"]), (True, False, True))
+
+        values["HOME_HTTP2"] = "maybe"
+        with self.assertRaises(load_env.ConfigError) as raised:
+            load_env.load_env()
+        self.assertEqual(str(raised.exception), "HOME_HTTP2 must be true or false in your .env file, got 'maybe'.")
+
+
+    def test_validate(self):
+        """
+        Test that settings changed after loading, such as command line flags, are checked the same way.
+        """
+        env = { "API_KEY": "key", "BASE_URL": "https://jellyfin.example.com", "USER": "john", "USERID": "user" }
+        load_env.validate(env)
+        for override in ({ "SHARD": "4/3" }, { "WARM_STRATEGY": "guess" }, { "INCREMENTAL": True, "STATE_DB": "" }, { "HTTP2": True, "ENGINE": "thread" },
+                         { "IMAGE_VARIANTS": "quality=96;fillHeight" }):
+            with self.assertRaises(load_env.ConfigError):
+                load_env.validate({ **env, **override })
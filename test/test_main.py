@@ -0,0 +1,65 @@
+"""
+# test/test_main.py
+Unit tests for the command line front end in main.
+It tests that importing and parsing load nothing heavy, and that configuration and listing errors become an exit status.
+"""
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+from fetch_request import fetch_request
+from metrics import metrics
+import main
+
+ENV = {"API_KEY": "key", "BASE_URL": "https://jellyfin.example.com", "USER": "john", "USERID": "user", "CORE_COUNT": 2, "STATE_DB": "", "JOURNAL": ""}
+
+class TestMain(unittest.TestCase):
+    """
+    Unit tests for the main.main() and main.parse_args() functions.
+    """
+    def test_import_is_light(self):
+        """
+        Test that importing main and parsing flags neither reads .env nor imports requests.
+        """
+        code = "import sys, main; main.parse_args(['--engine', 'async', '--strategy', 'minimal']); print('requests' in sys.modules, 'dotenv' in sys.modules)"
+        output = subprocess.run([sys.executable, "-c", code], capture_output = True, text = True, check = True).stdout
+        self.assertEqual(output.strip(), "False False")
+        self.assertEqual(main.STRATEGIES, fetch_request.WARM_STRATEGIES)
+
+
+    @patch("builtins.print")
+    @patch("load_env.load_env.load_env", return_value = ENV)
+    def test_config_error_status(self, mock_load_env, mock_print):
+        """
+        Test that an invalid flag is reported and returns 1 instead of exiting.
+        """
+        self.assertEqual(main.main(["--shard", "4/3"]), 1)
+        mock_print.assert_called_once()
+
+
+    @patch("builtins.print")
+    @patch("load_env.load_env.load_env", return_value = ENV)
+    def test_listing_error_status(self, mock_load_env, mock_print):
+        """
+        Test that a library that cannot be listed returns 1.
+        """
+        with patch("fetch_request.fetch_request.iter_crew", side_effect = fetch_request.ListingError("Error fetching all crew and casts: refused")):
+            self.assertEqual(main.main([]), 1)
+        self.assertIn("Error fetching all crew and casts: refused", [str(call.args[0]) for call in mock_print.call_args_list])
+
+
+    @patch("builtins.print")
+    @patch("load_env.load_env.load_env", return_value = ENV)
+    def test_completed_run_status(self, mock_load_env, mock_print):
+        """
+        Test that a completed run returns 0 and passes the flags on.
+        """
+        result = {"listed": 2, "resumed": 0, "queued": 2, "warmed": {"crew_001", "crew_002"}, "metrics": metrics.RunMetrics(), "targeting": None}
+        with patch("warmer.warmer.run", return_value = result) as mock_run:
+            self.assertEqual(main.main(["--full", "--engine", "async"]), 0)
+        self.assertTrue(mock_run.call_args.args[1])
+        self.assertEqual(mock_run.call_args.args[0]["ENGINE"], "async")
+
+
+if __name__ == "__main__":
+    unittest.main()
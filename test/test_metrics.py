@@ -0,0 +1,125 @@
+"""
+# test/test_metrics.py
+Unit tests for the metrics module.
+It tests what is collected per request and how the JSON and Prometheus reports are rendered and written.
+"""
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from metrics import metrics
+from retry import retry
+from test.helpers import FakeClock
+
+class TestRunMetrics(unittest.TestCase):
+    """
+    Unit tests for the metrics.RunMetrics class and metrics.to_prometheus()/metrics.write_reports() functions.
+    """
+    def setUp(self):
+        self.clock = FakeClock(100.0)
+        self.run_metrics = metrics.RunMetrics(clock = self.clock)
+        self.run_metrics.record_attempt(0.07, retry.attempt_result(200, size = 100))
+        self.run_metrics.record_attempt(0.3, retry.attempt_result(503, "503 Service Unavailable", size = 20))
+        self.run_metrics.record_attempt(40.0, retry.attempt_result(error = "timed out", exception = "ReadTimeout"))
+        self.run_metrics.record_outcome("retry")
+        self.clock.now = 101.5
+        self.run_metrics.record_outcome("ok")
+        self.run_metrics.record_outcome("failed")
+        self.run_metrics.listed = 2
+        self.run_metrics.record_skipped_page()
+        self.clock.now = 102.0
+        self.run_metrics.finish()
+
+
+    def test_report(self):
+        """
+        Test the counters, percentiles and histogram of the report.
+        """
+        report = self.run_metrics.report()
+
+        self.assertEqual(report["duration_seconds"], 2.0)
+        self.assertEqual(report["persons"], { "listed": 2, "skipped_pages": 1, "warmed": 1, "failed": 1 })
+        self.assertEqual(report["requests"]["by_status"], { "200": 1, "503": 1 })
+        self.assertEqual(report["requests"]["exceptions"], { "ReadTimeout": 1 })
+        self.assertEqual(report["requests"]["retries"], 1)
+        self.assertEqual(report["requests"]["bytes"], 120)
+        self.assertEqual(report["requests"]["bytes_per_request"], 40)
+        self.assertEqual(report["requests"]["per_second"], 1.5)
+        self.assertEqual(report["latency_seconds"]["p50"], 0.3)
+        self.assertEqual(report["latency_seconds"]["p99"], 40.0)
+        # Cumulative like Prometheus, the timeout is only in +Inf
+        self.assertEqual(report["latency_seconds"]["histogram"]["0.05"], 0)
+        self.assertEqual(report["latency_seconds"]["histogram"]["0.1"], 1)
+        self.assertEqual(report["latency_seconds"]["histogram"]["0.5"], 2)
+        self.assertEqual(report["latency_seconds"]["histogram"]["30"], 2)
+        self.assertEqual(report["latency_seconds"]["histogram"]["+Inf"], 3)
+        self.assertEqual(report["throughput"], [[1, 2]])
+
+
+    def test_timed_iter(self):
+        """
+        Test that only the time spent producing items is added to the phase.
+        """
+        def slow_pages():
+            self.clock.now += 2
+            yield "crew_001"
+            self.clock.now += 3
+            yield "crew_002"
+
+        items = []
+        for item in self.run_metrics.timed_iter(slow_pages(), "listing"):
+            self.clock.now += 10 # Consumer time does not count
+            items.append(item)
+
+        self.assertEqual(items, ["crew_001", "crew_002"])
+        self.assertEqual(self.run_metrics.report()["phases_seconds"], { "listing": 5.0 })
+
+
+    def test_merge(self):
+        """
+        Test that a pickled shard adds its counters to the parent and keeps the longest phase.
+        """
+        shard_metrics = pickle.loads(pickle.dumps(self.run_metrics))
+        parent = metrics.RunMetrics(clock = self.clock)
+        parent.add_phase("listing", 5.0)
+        parent.merge(shard_metrics)
+        parent.merge(shard_metrics)
+        report = parent.report()
+
+        self.assertEqual(report["persons"], { "listed": 4, "skipped_pages": 2, "warmed": 2, "failed": 2 })
+        self.assertEqual(report["requests"]["total"], 6)
+        self.assertEqual(report["requests"]["by_status"], { "200": 2, "503": 2 })
+        self.assertEqual(report["requests"]["retries"], 2)
+        self.assertEqual(report["requests"]["bytes"], 240)
+        self.assertEqual(report["phases_seconds"]["listing"], 5.0)
+        self.assertEqual(report["latency_seconds"]["histogram"]["0.1"], 2)
+        shard_metrics.record_outcome("ok") # The lock came back after unpickling
+
+
+    def test_prometheus(self):
+        """
+        Test the node_exporter textfile format.
+        """
+        text = metrics.to_prometheus(self.run_metrics.report())
+
+        self.assertIn("# TYPE jellyfin_fetch_crew_request_duration_seconds histogram\n", text)
+        self.assertIn('jellyfin_fetch_crew_request_duration_seconds_bucket{le="+Inf"} 3\n', text)
+        self.assertIn("jellyfin_fetch_crew_request_duration_seconds_count 3\n", text)
+        self.assertIn('jellyfin_fetch_crew_requests_total{status="503"} 1\n', text)
+        self.assertIn('jellyfin_fetch_crew_request_exceptions_total{exception="ReadTimeout"} 1\n', text)
+        self.assertIn("jellyfin_fetch_crew_persons_warmed 1\n", text)
+        self.assertTrue(text.endswith("\n"))
+
+
+    def test_write_reports(self):
+        """
+        Test that only configured reports are written.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, "report.json")
+            metrics.write_reports(self.run_metrics, { "METRICS_JSON": json_path, "METRICS_PROM": "" })
+
+            self.assertEqual(os.listdir(directory), ["report.json"])
+            with open(json_path, encoding = "utf-8") as file:
+                self.assertEqual(json.load(file)["persons"]["warmed"], 1)
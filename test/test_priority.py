@@ -0,0 +1,62 @@
+"""
+# test/test_priority.py
+Unit tests for the priority module.
+It tests that leads rank before supporting roles and crew, that continue watching outranks recently added
+and that a source that cannot be fetched is skipped.
+"""
+import unittest
+from unittest.mock import patch
+import requests
+from priority import priority
+
+RECENT = {
+    "resume": [{"Id": "movie_001", "People": [{"Id": "lead", "Type": "Actor", "PrimaryImageTag": "tag1"}, {"Id": "director", "Type": "Director"}]}],
+    "played": [],
+    "latest": [{"Id": "movie_002", "People": [{"Id": "newcomer", "Type": "Actor"}, {"Id": "supporting", "Type": "Actor"}, {"Id": "composer", "Type": "Composer"}]}]
+}
+
+class TestPriority(unittest.TestCase):
+    """
+    Unit tests for the priority.rank() and priority.score_items() functions.
+    """
+    def test_score_items(self):
+        """
+        Test billing order and role weights within one source, and that appearances add up.
+        """
+        scores, tags = {}, {}
+        items = [{"People": [{"Id": "lead", "Type": "Actor"}, {"Id": "writer", "Type": "Writer"}, {"Id": "guest", "Type": "GuestStar"}]},
+                 {"People": [{"Id": "writer", "Type": "Writer"}, {}]}]
+        priority.score_items(items, 1.0, scores, tags)
+        self.assertEqual(sorted(scores, key = scores.get, reverse = True), ["lead", "writer", "guest"])
+        self.assertEqual(tags, {"lead": None, "writer": None, "guest": None})
+
+
+    @patch("fetch_request.fetch_request.get_recent_items")
+    def test_rank(self, mock_recent):
+        """
+        Test that the continue watching lead ranks first, a new lead still outranks crew, and the image tags of the People are kept.
+        """
+        mock_recent.side_effect = lambda request_env, source, limit: RECENT[source]
+        ranked = priority.rank({"PRIORITY_ITEMS": 50})
+        self.assertEqual([person_id for person_id, _ in ranked], ["lead", "newcomer", "director", "supporting", "composer"])
+        self.assertEqual(ranked[0], ("lead", "tag1"))
+        mock_recent.assert_any_call({"PRIORITY_ITEMS": 50}, "resume", 50)
+
+
+    @patch("builtins.print")
+    @patch("fetch_request.fetch_request.get_recent_items")
+    def test_failing_source_is_skipped(self, mock_recent, mock_print):
+        """
+        Test that an unreachable source only drops its own persons.
+        """
+        def recent(request_env, source, limit):
+            if source == "resume":
+                raise requests.ConnectionError("refused")
+            return RECENT[source]
+        mock_recent.side_effect = recent
+        self.assertEqual([person_id for person_id, _ in priority.rank({"PRIORITY_ITEMS": 50})], ["newcomer", "supporting", "composer"])
+        mock_print.assert_called_once_with("Error fetching resume items to prioritize: refused")
+
+
+if __name__ == "__main__":
+    unittest.main()
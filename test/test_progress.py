@@ -0,0 +1,113 @@
+"""
+# test/test_progress.py
+Unit tests for the progress module.
+It tests the terminal line and the structured log line, the throughput and ETA over the rate window and that the timer thread does the printing.
+"""
+import threading
+import unittest
+from unittest.mock import patch
+from progress import progress
+from test.helpers import FakeClock
+
+class TestProgress(unittest.TestCase):
+    """
+    Unit tests for the progress.Progress class.
+    """
+    def setUp(self):
+        self.clock = FakeClock()
+
+
+    def reporter(self, tty, **kwargs):
+        return progress.Progress(interval = 0, log_interval = 0, tty = tty, clock = self.clock, **kwargs).start()
+
+
+    def test_terminal_line(self):
+        """
+        Test the redrawn line while listing and the ETA once the total is known.
+        """
+        reporter = self.reporter(True, label = "home")
+        self.clock.now = 2.0
+        reporter.update(100, 400, True, 16, 1, retried = 3, last_error = "crew_001: 404 Not Found")
+        self.assertEqual(reporter.line(), "\r[home] Progress: 100/400 (listing...) 50.0/s, 16 in flight, 3 retries, 1 failed (last: crew_001: 404 Not Found)\x1b[K")
+
+        self.clock.now = 4.0
+        reporter.update(200, 1000, False, 16, 0, 24, paused = True)
+        self.assertEqual(reporter.line(), "\r[home] Progress: 200/1000 (20.0%) 50.0/s ETA 0:00:16, 16 in flight, 0 retries, 0 failed [concurrency 24] [paused, too many failures in a row]\x1b[K")
+
+
+    def test_log_line(self):
+        """
+        Test the logfmt line written when stdout is not a terminal.
+        """
+        reporter = self.reporter(False)
+        reporter.update(10, 10, True, 2, 0)
+        self.assertEqual(reporter.line(), "progress completed=10 submitted=10 listing=true rate=0.0 in_flight=2 retries=0 failed=0")
+
+        self.clock.now = 5.0
+        reporter.update(50, 100, False, 4, 3, retried = 7, paused = True, last_error = 'crew_001: "quoted"')
+        self.assertEqual(reporter.line(), 'progress completed=50 submitted=100 listing=false percent=50.0 rate=10.0 eta_seconds=5 in_flight=4 retries=7 failed=3 '
+                                          'paused=true last_error="crew_001: \\"quoted\\""')
+
+
+    def test_empty_run(self):
+        """
+        Test that a finished run with nothing submitted draws without dividing by zero.
+        """
+        for tty in (True, False):
+            reporter = self.reporter(tty)
+            reporter.update(0, 0, False, 0, 0)
+            self.assertIn("100.0", reporter.line())
+
+
+    def test_rate_window(self):
+        """
+        Test that throughput only looks at the last RATE_WINDOW seconds, a stall shows up right away.
+        """
+        reporter = self.reporter(False)
+        for second, completed in ((5, 500), (10, 1000), (15, 1500), (20, 1500)):
+            self.clock.now = float(second)
+            rate = reporter.rate(self.clock.now, completed)
+        self.assertEqual(rate, 50.0)
+        self.assertLessEqual(len(reporter.samples), 3)
+
+
+    @patch("builtins.print")
+    def test_stop_prints_final(self, mock_print):
+        """
+        Test that only the final report is printed when there is no interval, and nothing when nothing was submitted.
+        """
+        self.reporter(True).stop()
+        mock_print.assert_not_called()
+
+        reporter = self.reporter(True)
+        reporter.update(3, 3, False, 0, 0)
+        reporter.stop()
+        mock_print.assert_called_once_with("\rProgress: 3/3 (100.0%) 0.0/s, 0 in flight, 0 retries, 0 failed\x1b[K", end="", flush=True)
+
+
+    @patch("builtins.print")
+    def test_timer_thread_prints(self, mock_print):
+        """
+        Test that reports come from the timer thread, never from the thread calling update().
+        """
+        threads = []
+        mock_print.side_effect = lambda *args, **kwargs: threads.append(threading.current_thread())
+        reporter = progress.Progress(interval = 0.01, tty = True).start()
+        reporter.update(1, 2, True, 1, 0)
+        while len(threads) < 2:
+            threading.Event().wait(0.01)
+        reporter.stop()
+
+        self.assertEqual({thread.name for thread in threads[:-1]}, {"progress"})
+
+
+    def test_from_env(self):
+        """
+        Test that the interval follows whether stdout is a terminal.
+        """
+        env = { "TARGET_NAME": "cabin", "PROGRESS_INTERVAL": 0.5, "PROGRESS_LOG_INTERVAL": 60 }
+        with patch("sys.stdout.isatty", return_value = True):
+            self.assertEqual(progress.from_env(env).interval, 0.5)
+        with patch("sys.stdout.isatty", return_value = False):
+            reporter = progress.from_env(env)
+        self.assertEqual((reporter.interval, reporter.label), (60, "cabin"))
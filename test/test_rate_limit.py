@@ -0,0 +1,95 @@
+"""
+# test/test_rate_limit.py
+Unit tests for the rate_limit module.
+Clocks are injected so no test actually waits.
+"""
+import datetime
+import unittest
+from unittest.mock import patch
+from rate_limit import rate_limit
+from test.helpers import FakeClock
+
+class TestTokenBucket(unittest.TestCase):
+    """
+    Unit tests for the rate_limit.TokenBucket class and rate_limit.parse_schedule() function.
+    """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.wall = datetime.datetime(2025, 7, 8, 12, 0)
+
+
+    def bucket(self, rate, burst = 0, schedule = None):
+        return rate_limit.TokenBucket(rate, burst, schedule, clock = self.clock, now = lambda: self.wall)
+
+
+    def test_burst_then_wait(self):
+        """
+        Test that a full bucket lets `burst` requests through and queues the rest one slot apart.
+        """
+        bucket = self.bucket(2, burst = 3)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertEqual([bucket.reserve() for _ in range(2)], [0.5, 1.0])
+
+
+    def test_refill(self):
+        """
+        Test that tokens come back at `rate` per second but never above `burst`.
+        """
+        bucket = self.bucket(1, burst = 2)
+        bucket.reserve()
+        bucket.reserve()
+        self.clock.now += 100
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.0, 0.0, 1.0])
+
+
+    def test_unlimited(self):
+        """
+        Test that a rate of 0 never waits.
+        """
+        bucket = self.bucket(0)
+        self.assertEqual({bucket.reserve() for _ in range(100)}, {0.0})
+
+
+    def test_schedule(self):
+        """
+        Test that schedule windows, including one wrapping past midnight, override the default rate.
+        """
+        bucket = self.bucket(10, schedule = rate_limit.parse_schedule("18:00-23:00=5, 23:00-07:00=0"))
+        self.assertEqual(bucket.current_rate(), 10)
+        self.wall = datetime.datetime(2025, 7, 8, 20, 30)
+        self.assertEqual(bucket.current_rate(), 5)
+        self.wall = datetime.datetime(2025, 7, 8, 2, 0)
+        self.assertEqual(bucket.current_rate(), 0)
+        self.assertEqual(bucket.reserve(), 0.0)
+
+
+    def test_invalid_schedule(self):
+        """
+        Test that a malformed window is reported.
+        """
+        self.assertEqual(rate_limit.parse_schedule(""), [])
+        with self.assertRaises(ValueError):
+            rate_limit.parse_schedule("18:00=5")
+
+
+    @patch("time.sleep")
+    def test_acquire_sleeps_for_reservation(self, mock_sleep):
+        """
+        Test that acquire() only sleeps once the bucket is empty.
+        """
+        bucket = self.bucket(4, burst = 1)
+        bucket.acquire()
+        mock_sleep.assert_not_called()
+        bucket.acquire()
+        mock_sleep.assert_called_once_with(0.25)
+
+
+    def test_from_env(self):
+        """
+        Test that the limiter only exists when a rate or schedule is configured.
+        """
+        self.assertIsNone(rate_limit.from_env({ "RATE_LIMIT": 0, "RATE_SCHEDULE": "" }))
+        self.assertEqual(rate_limit.from_env({ "RATE_LIMIT": 20, "RATE_BURST": 5 }).burst, 5)
+        self.assertIsNotNone(rate_limit.from_env({ "RATE_SCHEDULE": "18:00-23:00=5" }))
+        shared = rate_limit.from_env({ "RATE_LIMIT": 20, "RATE_BURST": 8, "RATE_SCHEDULE": "18:00-23:00=4", "RATE_SHARE": 0.25 })
+        self.assertEqual((shared.rate, shared.burst, shared.schedule[0][2]), (5, 2, 1))
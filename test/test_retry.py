@@ -0,0 +1,138 @@
+"""
+# test/test_retry.py
+Unit tests for the retry module.
+It tests backoff with jitter, Retry-After handling, the retry budget and the circuit breaker.
+"""
+import unittest
+from unittest.mock import patch
+from retry import retry
+from test.helpers import FakeClock
+
+class TestRetryScheduler(unittest.TestCase):
+    """
+    Unit tests for the retry.RetryScheduler class and its helpers.
+    """
+    def setUp(self):
+        self.clock = FakeClock()
+
+
+    def scheduler(self, **kwargs):
+        # rand() of 1 makes the jitter land on the full backoff
+        return retry.RetryScheduler(clock = self.clock, rand = lambda: 1.0, **kwargs)
+
+
+    def test_attempt_result(self):
+        """
+        Test which attempts count as ok and which are worth retrying.
+        """
+        self.assertEqual(retry.attempt_result(200, size = 512), {"ok": True, "status": 200, "error": None, "retry": False, "retry_after": None, "bytes": 512, "exception": None})
+        self.assertTrue(retry.attempt_result(503, "503 Service Unavailable", "7")["retry"])
+        self.assertEqual(retry.attempt_result(503, "503 Service Unavailable", "7")["retry_after"], 7.0)
+        self.assertTrue(retry.attempt_result(429, "429 Too Many Requests")["retry"])
+        self.assertFalse(retry.attempt_result(404, "404 Not Found")["retry"])
+        self.assertTrue(retry.attempt_result(error = "ReadTimeout")["retry"])
+
+
+    @patch("time.time")
+    def test_parse_retry_after(self, mock_time):
+        """
+        Test both Retry-After formats.
+        """
+        mock_time.return_value = 1751932800.0 # Tue, 08 Jul 2025 00:00:00 GMT
+        self.assertIsNone(retry.parse_retry_after(None))
+        self.assertEqual(retry.parse_retry_after("120"), 120.0)
+        self.assertEqual(retry.parse_retry_after("Tue, 08 Jul 2025 00:00:30 GMT"), 30.0)
+        self.assertIsNone(retry.parse_retry_after("soon"))
+
+
+    def test_exponential_backoff(self):
+        """
+        Test that the delay doubles per attempt, is capped and never beats Retry-After.
+        """
+        scheduler = self.scheduler(base_delay = 1.0, max_delay = 5.0)
+        self.assertEqual([scheduler.delay(attempt) for attempt in (1, 2, 3, 4)], [1.0, 2.0, 4.0, 5.0])
+        self.assertEqual(scheduler.delay(1, retry_after = 10.0), 10.0)
+        jittered = retry.RetryScheduler(base_delay = 4.0, rand = lambda: 0.25)
+        self.assertEqual(jittered.delay(1), 1.0)
+
+
+    def test_retries_come_back_when_due(self):
+        """
+        Test that queued retries are only handed out once their delay passed, earliest first.
+        """
+        scheduler = self.scheduler(base_delay = 1.0)
+        self.assertTrue(scheduler.schedule("crew_001", 2))
+        self.assertTrue(scheduler.schedule("crew_002", 1))
+        self.assertEqual(scheduler.next_due(), 1.0)
+        self.assertEqual(scheduler.pop_ready(), [])
+
+        self.clock.now = 1.0
+        self.assertEqual(scheduler.pop_ready(), [("crew_002", 1)])
+        self.clock.now = 2.0
+        self.assertEqual(scheduler.pop_ready(), [("crew_001", 2)])
+        self.assertEqual(len(scheduler), 0)
+        self.assertIsNone(scheduler.next_due())
+
+
+    def test_pop_ready_limit(self):
+        """
+        Test that a limit leaves the remaining due retries queued for the next call.
+        """
+        scheduler = self.scheduler(base_delay = 1.0)
+        for person_id in ("crew_001", "crew_002", "crew_003"):
+            scheduler.schedule(person_id, 1)
+        self.clock.now = 1.0
+
+        self.assertEqual(scheduler.pop_ready(0), [])
+        self.assertEqual(len(scheduler.pop_ready(2)), 2)
+        self.assertEqual(len(scheduler), 1)
+        self.assertEqual(len(scheduler.pop_ready()), 1)
+
+
+    def test_attempts_and_budget(self):
+        """
+        Test that a person runs out of attempts and the run runs out of budget.
+        """
+        scheduler = self.scheduler(max_attempts = 3, budget = 2)
+        self.assertFalse(scheduler.schedule("crew_001", 3))
+        self.assertTrue(scheduler.schedule("crew_001", 1))
+        self.assertTrue(scheduler.schedule("crew_002", 1))
+        self.assertFalse(scheduler.schedule("crew_003", 1))
+
+
+    @patch("builtins.print")
+    def test_settle(self, mock_print):
+        """
+        Test the outcome of an attempt, nothing is printed on the completion path.
+        """
+        scheduler = self.scheduler(max_attempts = 2)
+        self.assertEqual(scheduler.settle("crew_001", 0, retry.attempt_result(200)), "ok")
+        self.assertEqual(scheduler.settle("crew_001", 0, retry.attempt_result(500, "500 Internal Server Error")), "retry")
+        self.assertEqual(scheduler.settle("crew_001", 1, retry.attempt_result(500, "500 Internal Server Error")), "failed")
+        self.assertEqual(scheduler.retried, 1)
+        mock_print.assert_not_called()
+
+
+    @patch("builtins.print")
+    def test_circuit_breaker(self, mock_print):
+        """
+        Test that enough failures in a row pause everything for the cooldown.
+        """
+        scheduler = self.scheduler(breaker_threshold = 3, breaker_cooldown = 30.0, base_delay = 1.0)
+        scheduler.record(False)
+        scheduler.record(False)
+        scheduler.record(True) # A success resets the streak
+        scheduler.record(False)
+        scheduler.record(False)
+        self.assertFalse(scheduler.breaker_open())
+        scheduler.record(False)
+        self.assertTrue(scheduler.breaker_open())
+        mock_print.assert_not_called()
+
+        scheduler.schedule("crew_001", 1)
+        self.clock.now = 5.0
+        self.assertEqual(scheduler.pop_ready(), [])
+        self.assertEqual(scheduler.next_due(), 25.0)
+        self.clock.now = 30.0
+        self.assertFalse(scheduler.breaker_open())
+        self.assertEqual(scheduler.pop_ready(), [("crew_001", 1)])
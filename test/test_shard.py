@@ -0,0 +1,60 @@
+"""
+# test/test_shard.py
+Unit tests for the shard module.
+It tests that shards are parsed strictly and that every person lands in exactly one shard, however the shards are nested or split.
+"""
+import unittest
+from shard import shard
+
+class TestShard(unittest.TestCase):
+    """
+    Unit tests for the shard module functions.
+    """
+    def setUp(self):
+        self.ids = [f"crew_{index:05d}" for index in range(3000)]
+
+
+    def test_parse_shard(self):
+        """
+        Test that K/N is 1 based on the command line and 0 based once parsed.
+        """
+        self.assertEqual(shard.parse_shard("1/3"), (0, 3))
+        self.assertEqual(shard.parse_shard("3/3"), (2, 3))
+        for invalid in ("0/3", "4/3", "1/0", "3", "a/b", ""):
+            with self.assertRaises(ValueError):
+                shard.parse_shard(invalid)
+
+
+    def test_every_person_in_one_shard(self):
+        """
+        Test that shards are disjoint, cover everyone and are roughly even.
+        """
+        owners = [[person_id for person_id in self.ids if shard.owns(person_id, ((index, 3),))] for index in range(3)]
+
+        self.assertEqual(sorted(sum(owners, [])), self.ids)
+        for owned in owners:
+            self.assertGreater(len(owned), 800)
+        self.assertTrue(all(shard.owns(person_id, ()) for person_id in self.ids))
+
+
+    def test_nested_shards(self):
+        """
+        Test that local processes split their host's shard exactly, with a different process count on every host.
+        """
+        for host, processes in ((0, 2), (1, 4)):
+            host_ids = [person_id for person_id in self.ids if shard.owns(person_id, ((host, 2),))]
+            split = [[person_id for person_id in host_ids if shard.owns(person_id, ((host, 2), (index, processes)))] for index in range(processes)]
+            self.assertEqual(sorted(sum(split, [])), host_ids)
+            self.assertTrue(all(split))
+        self.assertEqual(shard.describe(((1, 2), (0, 4))), "2/2.1/4")
+
+
+    def test_split(self):
+        """
+        Test that split() hands every person to the process owns() gives them to, in listing order.
+        """
+        path = ((1, 2),)
+        host_crew = [(person_id, None) for person_id in self.ids if shard.owns(person_id, path)]
+        parts = shard.split(host_crew, path, 3)
+        for index, part in enumerate(parts):
+            self.assertEqual(list(part), [person_id for person_id, _ in host_crew if shard.owns(person_id, path + ((index, 3),))])
@@ -0,0 +1,106 @@
+"""
+# test/test_state_store.py
+Unit tests for the state_store module.
+Every test uses an in-memory SQLite database.
+"""
+import unittest
+from unittest.mock import patch
+from state_store import state_store
+
+class TestStateStore(unittest.TestCase):
+    """
+    Unit tests for the state_store.StateStore class.
+    """
+    def setUp(self):
+        self.store = state_store.StateStore(":memory:")
+
+
+    def tearDown(self):
+        self.store.close()
+
+
+    def test_new_person_needs_warming(self):
+        """
+        Test that a person never seen before is warmed.
+        """
+        self.assertEqual(self.store.get_warmed_tags(), {})
+        self.assertEqual(list(self.store.filter_stream([("crew_001", "tag_1")])), ["crew_001"])
+
+
+    @patch("time.time")
+    def test_record_warmed(self, mock_time):
+        """
+        Test that warming stores the image tag and the time it happened.
+        """
+        mock_time.return_value = 1000.0
+        self.store.record_warmed({ "crew_001": "tag_1" })
+
+        self.assertEqual(self.store.connection.execute("SELECT image_tag, last_warmed FROM persons").fetchall(), [("tag_1", 1000.0)])
+        self.assertEqual(list(self.store.filter_stream([("crew_001", "tag_1")])), [])
+        self.assertEqual(self.store.get_warmed_tags(), { "crew_001": "tag_1" })
+
+
+    def test_changed_or_blank_needs_warming(self):
+        """
+        Test that a changed tag, or a blank one on either side, warms the person again.
+        """
+        self.store.record_warmed({ "crew_001": "tag_1", "crew_002": None })
+
+        for crew in ([("crew_001", "tag_2")], [("crew_001", None)], [("crew_002", None)]):
+            self.assertEqual(len(list(self.store.filter_stream(crew))), 1, crew)
+
+
+    def test_unfixed_skipped_until_tag_changes(self):
+        """
+        Test that a person verification gave up on stays skipped while blank and comes back once the listing shows a tag.
+        """
+        self.store.record_warmed({ "crew_001": None, "crew_002": None })
+        self.store.record_unfixed(["crew_001"])
+
+        self.assertEqual(list(self.store.filter_stream([("crew_001", None), ("crew_002", None)])), ["crew_002"])
+        self.assertEqual(list(self.store.filter_stream([("crew_001", "tag_1")])), ["crew_001"])
+
+        # Warmed with a portrait, a later blank listing warms them again
+        self.store.record_warmed({ "crew_001": "tag_1" })
+        self.assertEqual(list(self.store.filter_stream([("crew_001", None)])), ["crew_001"])
+
+
+    def test_filter_stream(self):
+        """
+        Test that only new, changed or still blank persons are kept, in listing order.
+        """
+        self.store.record_warmed({ "crew_001": "tag_1", "crew_002": "tag_2", "crew_003": None })
+        # Warming again overwrites the previous row
+        self.store.record_warmed({ "crew_002": "tag_2" })
+
+        crew = [("crew_001", "tag_1"), ("crew_002", "tag_changed"), ("crew_003", None), ("crew_004", "tag_4")]
+        self.assertEqual(list(self.store.filter_stream(crew)), ["crew_002", "crew_003", "crew_004"])
+
+
+    def test_watermarks(self):
+        """
+        Test that every server and user keeps its own watermark and setting it again moves it.
+        """
+        home = state_store.watermark_source({ "BASE_URL": "https://home.example.com", "USERID": "user_1" })
+        cabin = state_store.watermark_source({ "BASE_URL": "https://cabin.example.com", "USERID": "user_1" })
+        self.assertIsNone(self.store.get_watermark(home))
+
+        self.store.set_watermark(home, "2026-01-01T00:00:00.000000Z")
+        self.store.set_watermark(home, "2026-01-02T00:00:00.000000Z")
+
+        self.assertEqual(self.store.get_watermark(home), "2026-01-02T00:00:00.000000Z")
+        self.assertIsNone(self.store.get_watermark(cabin))
+
+
+    def test_image_validators(self):
+        """
+        Test that validators are upserted per variant URL.
+        """
+        self.assertEqual(self.store.get_image_validators(), {})
+        self.store.record_image_validators({ "https://cdn.example.com/a": ('"v1"', None), "https://cdn.example.com/b": (None, "Wed, 01 Jan 2026 00:00:00 GMT") })
+        self.store.record_image_validators({ "https://cdn.example.com/a": ('"v2"', None) })
+
+        self.assertEqual(self.store.get_image_validators(), {
+            "https://cdn.example.com/a": ('"v2"', None),
+            "https://cdn.example.com/b": (None, "Wed, 01 Jan 2026 00:00:00 GMT")
+        })
@@ -0,0 +1,38 @@
+"""
+# test/test_targeting.py
+Unit tests for the targeting module.
+It tests that persons are sorted into no image, changed and cached from the listing and STATE_DB alone, and that only the first two are handed to the engine.
+"""
+import unittest
+from targeting import targeting
+
+class TestTargeting(unittest.TestCase):
+    """
+    Unit tests for the targeting.Targeting class.
+    """
+    def setUp(self):
+        self.env = {
+            "BASE_URL": "https://jellyfin.example.com",
+            "API_KEY": "test_api_key_123",
+            "USERID": "test_user_id_123",
+            "TIMEOUT": 30
+        }
+        self.crew = { "crew_001": None, "crew_002": "tag_new", "crew_003": "tag_ok" }
+        self.target = targeting.Targeting(self.crew, { "crew_001": None, "crew_002": "tag_old", "crew_003": "tag_ok" })
+
+
+    def test_filter_stream_sorts_persons(self):
+        """
+        Test that only persons without an image or with a new image tag are handed on and every group is counted.
+        """
+        self.assertEqual(list(self.target.filter_stream(self.crew)), ["crew_001", "crew_002"])
+        self.assertEqual(self.target.counts, { targeting.NO_IMAGE: 1, targeting.CHANGED: 1, targeting.CACHED: 1 })
+        self.assertEqual(self.target.summary(), "1 without image, 1 with a new image tag, 1 already cached and skipped.")
+
+
+    def test_without_state_db(self):
+        """
+        Test that without STATE_DB an image tag in the listing is trusted.
+        """
+        target = targeting.Targeting(self.crew)
+        self.assertEqual([target.classify(person_id) for person_id in self.crew], [targeting.NO_IMAGE, targeting.CACHED, targeting.CACHED])
@@ -0,0 +1,106 @@
+"""
+# test/test_verify.py
+Unit tests for the verify module.
+It tests that only persons warmed without a portrait are checked, that still blank ones are warmed again round after round,
+that fixed ones get their new tag and that the persons left blank are reported.
+"""
+import pickle
+import unittest
+from unittest.mock import MagicMock, patch
+import requests
+from metrics import metrics
+from verify import verify
+
+class TestVerify(unittest.TestCase):
+    """
+    Unit tests for the verify.verify() function and the verify.Verification class.
+    """
+    def setUp(self):
+        self.env = {"VERIFY_ROUNDS": 2, "VERIFY_DELAY": 10}
+        self.crew = {"crew_001": "tag1", "crew_002": None, "crew_003": None, "crew_004": None}
+        self.rewarmed = []
+        print_patch = patch("builtins.print")
+        print_patch.start()
+        self.addCleanup(print_patch.stop)
+
+
+    def warm(self, ids):
+        self.rewarmed.append(sorted(ids))
+        return set(ids)
+
+
+    @patch("fetch_request.fetch_request.get_image_tags")
+    def test_requeues_until_fixed(self, mock_tags):
+        """
+        Test that every round only looks up and warms the persons still blank.
+        """
+        mock_tags.side_effect = [
+            {"crew_002": ("tag2", "Two"), "crew_003": (None, "Three"), "crew_004": (None, "Four")},
+            {"crew_003": ("tag3", "Three"), "crew_004": (None, "Four")},
+            {"crew_004": (None, "Four")}
+        ]
+        sleeps = []
+        verification = verify.verify(self.env, self.crew, {"crew_001", "crew_002", "crew_003", "crew_004"}, self.warm, sleeps.append)
+
+        self.assertEqual(sorted(mock_tags.call_args_list[0].args[1]), ["crew_002", "crew_003", "crew_004"])
+        self.assertEqual(self.rewarmed, [["crew_003", "crew_004"], ["crew_004"]])
+        self.assertEqual(sleeps, [10, 10, 10])
+        self.assertEqual(self.crew["crew_002"], "tag2")
+        self.assertEqual(self.crew["crew_003"], "tag3")
+        self.assertEqual((verification.checked, verification.fixed, verification.requeued, verification.rounds, verification.lookups), (3, 2, 3, 2, 3))
+        self.assertEqual(verification.unfixed, {"crew_004": "Four"})
+        self.assertIn("1 still blank: Four (crew_004).", verification.summary())
+
+
+    @patch("fetch_request.fetch_request.get_image_tags")
+    def test_nothing_blank(self, mock_tags):
+        """
+        Test that persons warmed with a portrait cost no lookup.
+        """
+        verification = verify.verify(self.env, self.crew, {"crew_001"}, self.warm, lambda seconds: None)
+        mock_tags.assert_not_called()
+        self.assertEqual(verification.checked, 0)
+        self.assertTrue(verification.summary().endswith("0 still blank."))
+
+
+    @patch("fetch_request.fetch_request.get_image_tags")
+    def test_removed_and_unreachable(self, mock_tags):
+        """
+        Test that persons gone from the library drop out and a failed lookup leaves the rest reported as blank.
+        """
+        mock_tags.side_effect = [{"crew_003": (None, "Three")}, requests.ConnectionError("refused")]
+        verification = verify.verify(self.env, self.crew, {"crew_002", "crew_003"}, self.warm, lambda seconds: None)
+        self.assertEqual(self.rewarmed, [["crew_003"]])
+        self.assertEqual(verification.unfixed, {"crew_003": "Three"})
+
+
+    @patch("fetch_request.fetch_request.get_image_tags")
+    def test_lookups_recorded(self, mock_tags):
+        """
+        Test that every lookup request, failed ones included, reaches the run metrics.
+        """
+        mock_tags.side_effect = [{}, requests.HTTPError("503 Server Error", response = MagicMock(status_code = 503))]
+        run_metrics = metrics.RunMetrics()
+        ids = [f"crew_{index:03d}" for index in range(verify.LOOKUP_BATCH + 1)]
+        with self.assertRaises(requests.HTTPError):
+            verify.lookup(self.env, ids, run_metrics)
+
+        self.assertEqual([len(c.args[1]) for c in mock_tags.call_args_list], [verify.LOOKUP_BATCH, 1])
+        self.assertEqual(dict(run_metrics.statuses), {200: 1, 503: 1})
+
+
+    def test_merge_and_pickle(self):
+        """
+        Test that shard verifications add up after crossing a process boundary.
+        """
+        first = verify.Verification()
+        first.checked, first.fixed, first.unfixed = 3, 2, {"crew_001": "One"}
+        second = pickle.loads(pickle.dumps(first))
+        first.merge(second)
+        self.assertEqual((first.checked, first.fixed, first.unfixed), (6, 4, {"crew_001": "One"}))
+        first.unfixed = { f"crew_{index:03d}": f"Person {index}" for index in range(12) }
+        self.assertTrue(first.summary(limit = 10).endswith("and 2 more."))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,451 @@
+"""
+# test/test_warmer.py
+Unit tests for the warmer module, the thread engine and the reusable Warmer.
+It tests that IDs are pulled from the iterable lazily and never more than SUBMIT_WINDOW are in flight,
+that local shard processes split the library and merge their results, that targets are warmed side by side
+that an interrupted run is resumed from its journal, that incremental runs move their watermark only when nothing was missed,
+that ranked persons are warmed first, that cached persons never reach the engine and that a Warmer keeps its own sessions and async client between cycles.
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+import requests
+from async_request import async_request
+from fake_jellyfin import fake_jellyfin
+from fetch_request import fetch_request
+from retry import retry
+from shard import shard
+from state_store import state_store
+from warmer import warmer
+
+class TestExecuteRequests(unittest.TestCase):
+    """
+    Unit tests for the warmer.execute_requests() function.
+    """
+    def setUp(self):
+        self.env = {"CORE_COUNT": 4, "SUBMIT_WINDOW": 6, "MAX_ATTEMPTS": 3, "RETRY_BASE_DELAY": 0}
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.pulled = 0
+        self.finished = 0
+        self.ahead = 0
+
+
+    def ids(self, count):
+        """
+        Generator of IDs recording how far the listing ran ahead of the finished requests.
+        """
+        for index in range(count):
+            with self.lock:
+                self.pulled += 1
+                self.ahead = max(self.ahead, self.pulled - self.finished)
+            yield f"crew_{index:03d}"
+
+
+    def work(self, request_env, person_id):
+        """
+        Work function recording the number of attempts running or queued at once.
+        """
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        threading.Event().wait(0.001)
+        with self.lock:
+            self.in_flight -= 1
+            self.finished += 1
+        return retry.attempt_result(200)
+
+
+    @patch("builtins.print")
+    def test_window_bounds_submissions(self, mock_print):
+        """
+        Test that every ID of a generator is warmed while the listing never runs more than the window ahead.
+        """
+        result = warmer.execute_requests(self.env, self.ids(200), self.work)
+
+        self.assertEqual(result, {f"crew_{index:03d}" for index in range(200)})
+        self.assertLessEqual(self.peak, 4)
+        self.assertLessEqual(self.ahead, 6 + 1)
+
+
+    @patch("builtins.print")
+    def test_retries_stay_in_window(self, mock_print):
+        """
+        Test that retried IDs come back through the window and are warmed.
+        """
+        failed = set()
+
+        def flaky(request_env, person_id):
+            if person_id not in failed:
+                failed.add(person_id)
+                return retry.attempt_result(503, "503 Service Unavailable")
+            return self.work(request_env, person_id)
+
+        result = warmer.execute_requests(self.env, [f"crew_{index:03d}" for index in range(20)], flaky)
+
+        self.assertEqual(len(result), 20)
+        self.assertLessEqual(self.peak, 4)
+
+
+    @patch("builtins.print")
+    def test_work_exception_is_raised(self, mock_print):
+        """
+        Test that an exception from the work function is raised to the caller, like the async engine does.
+        """
+        def work(request_env, person_id):
+            if person_id == "crew_002":
+                raise KeyError(person_id)
+            return retry.attempt_result(200)
+
+        with self.assertRaises(KeyError):
+            warmer.execute_requests(self.env, self.ids(5), work)
+
+
+def warm_person(request_env, person_id):
+    """
+    Stand-in for fetch_request.warm_person() in the worker processes.
+    """
+    return retry.attempt_result(200, size = 10)
+
+
+class TestRunProcesses(unittest.TestCase):
+    """
+    Unit tests for the warmer.run_processes() function.
+    """
+    def setUp(self):
+        self.crew = [(f"crew_{index:03d}", None) for index in range(60)]
+        self.env = {"CORE_COUNT": 2, "MAX_ATTEMPTS": 3, "TARGET_MODE": "missing", "STATE_DB": ""}
+
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == "fork", "patches only reach forked workers")
+    @patch("fetch_request.fetch_request.warm_person", warm_person)
+    @patch("builtins.print")
+    def test_processes_merge(self, mock_print):
+        """
+        Test that three processes warm a host shard listed once and report one merged summary.
+        """
+        with patch("fetch_request.fetch_request.iter_crew", return_value = self.crew) as mock_iter_crew:
+            result = warmer.run_processes(self.env, 3, path = ((0, 2),))
+        # Listed once by the parent, not once per process
+        mock_iter_crew.assert_called_once()
+
+        expected = {person_id for person_id, _ in self.crew if shard.owns(person_id, ((0, 2),))}
+        self.assertEqual(result["warmed"], expected)
+        self.assertEqual(result["listed"], len(expected))
+        self.assertEqual(result["metrics"].report()["requests"]["bytes"], 10 * len(expected))
+        self.assertEqual(result["targeting"].counts["no_image"], len(expected))
+
+
+class TestRunTargets(unittest.TestCase):
+    """
+    Unit tests for the warmer.run_targets() function.
+    """
+    @patch("builtins.print")
+    def test_targets_share_capacity(self, mock_print):
+        """
+        Test that both targets are warmed at the same time and never exceed SHARED_CONCURRENCY together.
+        """
+        lock = threading.Lock()
+        in_flight = { "now": 0, "peak": 0 }
+        requested = []
+
+        def iter_crew(request_env, since = None, run_metrics = None):
+            return [(f"{request_env['TARGET_NAME']}_{index:03d}", None) for index in range(40)]
+
+        def warm(request_env, person_id):
+            with lock:
+                in_flight["now"] += 1
+                in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+                requested.append((request_env["BASE_URL"], person_id))
+            threading.Event().wait(0.002)
+            with lock:
+                in_flight["now"] -= 1
+            return retry.attempt_result(200)
+
+        shared = { "CORE_COUNT": 4, "MAX_ATTEMPTS": 3, "STATE_DB": "", "SHARED_CONCURRENCY": 5 }
+        env = { **shared, "TARGETS": [
+            { **shared, "TARGET_NAME": "home", "BASE_URL": "https://home.example.com" },
+            { **shared, "TARGET_NAME": "cabin", "BASE_URL": "https://cabin.example.com", "CORE_COUNT": 2 }
+        ] }
+        with patch("fetch_request.fetch_request.iter_crew", iter_crew), patch("fetch_request.fetch_request.warm_person", warm):
+            results = warmer.run_targets(env)
+
+        self.assertEqual([target["TARGET_NAME"] for target, _, _ in results], ["home", "cabin"])
+        for target, result, seconds in results:
+            self.assertEqual(len(result["warmed"]), 40)
+            self.assertGreater(seconds, 0)
+        self.assertTrue(all(person_id.startswith("home") == (base_url == "https://home.example.com") for base_url, person_id in requested))
+        self.assertLessEqual(in_flight["peak"], 5)
+
+
+class TestResume(unittest.TestCase):
+    """
+    Unit tests for the journal handling of warmer.run().
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.env = {"CORE_COUNT": 1, "MAX_ATTEMPTS": 1, "STATE_DB": "", "JOURNAL": os.path.join(self.directory.name, "journal.log"), "JOURNAL_BATCH": 1}
+        self.crew = [(f"crew_{index:03d}", None) for index in range(10)]
+        self.requested = []
+        self.killed = False
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def warm(self, request_env, person_id):
+        """
+        Work function of a run that is killed on the sixth person.
+        """
+        if len(self.requested) == 5 and not self.killed:
+            self.killed = True
+            raise RuntimeError("killed")
+        self.requested.append(person_id)
+        return retry.attempt_result(200)
+
+
+    @patch("builtins.print")
+    def test_resume_skips_finished(self, mock_print):
+        """
+        Test that a resumed run only warms the persons the interrupted run did not finish and removes the journal at the end.
+        """
+        with patch("fetch_request.fetch_request.iter_crew", return_value = self.crew), patch("fetch_request.fetch_request.warm_person", self.warm):
+            with self.assertRaises(RuntimeError):
+                warmer.run(self.env)
+            finished = list(self.requested)
+            self.assertTrue(os.path.exists(self.env["JOURNAL"]))
+
+            self.requested.clear()
+            result = warmer.run(self.env, resume = True)
+
+        # Whatever was still in flight when the run died is warmed again, everything journaled is not
+        self.assertEqual(result["resumed"], 10 - len(self.requested))
+        self.assertGreaterEqual(result["resumed"], 4)
+        self.assertEqual(set(finished) | set(self.requested), {person_id for person_id, _ in self.crew})
+        self.assertEqual(len(result["warmed"]), 10)
+        self.assertFalse(os.path.exists(self.env["JOURNAL"]))
+
+
+class TestIncremental(unittest.TestCase):
+    """
+    Unit tests for the INCREMENTAL watermark of warmer.run() and warmer.record_watermarks().
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.env = {"BASE_URL": "https://jellyfin.example.com", "USERID": "user", "CORE_COUNT": 2, "MAX_ATTEMPTS": 1,
+                    "STATE_DB": os.path.join(self.directory.name, "state.db"), "INCREMENTAL": True}
+        self.source = state_store.watermark_source(self.env)
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    @patch("fetch_request.fetch_request.warm_person", warm_person)
+    @patch("builtins.print")
+    def test_watermark_moves_after_complete_run(self, mock_print):
+        """
+        Test that the first run lists everyone and the next one only lists since the watermark of the first.
+        """
+        with patch("fetch_request.fetch_request.iter_crew", return_value = [("crew_001", None)]) as mock_iter_crew:
+            result = warmer.run(self.env)
+            self.assertIsNone(mock_iter_crew.call_args.args[1])
+            warmer.record_watermarks([(self.env, result, None)], "2026-01-01T00:00:00.000000Z")
+
+            warmer.run(self.env)
+            self.assertEqual(mock_iter_crew.call_args.args[1], "2026-01-01T00:00:00.000000Z")
+
+
+    @patch("builtins.print")
+    def test_failures_keep_watermark(self, mock_print):
+        """
+        Test that a run with failed persons does not move the watermark.
+        """
+        failed = lambda request_env, person_id: retry.attempt_result(404, "404 Not Found")
+        with patch("fetch_request.fetch_request.iter_crew", return_value = [("crew_001", None)]), patch("fetch_request.fetch_request.warm_person", failed):
+            result = warmer.run(self.env)
+        warmer.record_watermarks([(self.env, result, None)], "2026-01-01T00:00:00.000000Z")
+
+        store = state_store.StateStore(self.env["STATE_DB"])
+        self.assertIsNone(store.get_watermark(self.source))
+        store.close()
+
+
+    @patch("fetch_request.fetch_request.warm_person", warm_person)
+    @patch("builtins.print")
+    def test_skipped_page_keeps_watermark(self, mock_print):
+        """
+        Test that a run whose second listing page kept failing does not move the watermark, even though everyone it saw was warmed.
+        """
+        def get_crew_page(request_env, start_index, since = None):
+            if start_index == 1:
+                raise requests.ConnectionError("connection reset")
+            return { f"crew_{start_index:03d}": None }, 1, 3
+
+        with patch("fetch_request.fetch_request.get_crew_page", get_crew_page):
+            result = warmer.run({ **self.env, "PAGE_SIZE": 1 })
+        self.assertEqual(result["warmed"], {"crew_000", "crew_002"})
+        self.assertEqual(result["metrics"].skipped_pages, 1)
+        warmer.record_watermarks([(self.env, result, None)], "2026-01-01T00:00:00.000000Z")
+
+        store = state_store.StateStore(self.env["STATE_DB"])
+        self.assertIsNone(store.get_watermark(self.source))
+        store.close()
+
+
+class TestVerifyStage(unittest.TestCase):
+    """
+    Unit tests for the VERIFY_ROUNDS stage of warmer.run().
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.env = {"BASE_URL": "https://jellyfin.example.com", "USERID": "user", "CORE_COUNT": 2, "MAX_ATTEMPTS": 1,
+                    "STATE_DB": os.path.join(self.directory.name, "state.db"), "VERIFY_ROUNDS": 1, "VERIFY_DELAY": 0}
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    @patch("fetch_request.fetch_request.warm_person", warm_person)
+    @patch("builtins.print")
+    def test_unfixed_counted_and_remembered(self, mock_print):
+        """
+        Test that verification requests show up in the metrics without counting the person twice,
+        and that the next run does not warm a person verification gave up on.
+        """
+        with patch("fetch_request.fetch_request.iter_crew", return_value = [("crew_001", None)]), \
+             patch("fetch_request.fetch_request.get_image_tags", return_value = {"crew_001": (None, "One")}) as mock_tags:
+            result = warmer.run(self.env)
+            report = result["metrics"].report()
+            # Warm, lookup, warm again, lookup
+            self.assertEqual(report["requests"]["total"], 4)
+            self.assertEqual(report["persons"]["warmed"], 1)
+            self.assertEqual(result["verification"].unfixed, {"crew_001": "One"})
+
+            result = warmer.run(self.env)
+            self.assertEqual(result["queued"], 0)
+            self.assertEqual(mock_tags.call_count, 2)
+
+
+class TestPriority(unittest.TestCase):
+    """
+    Unit tests for the PRIORITY_ITEMS ordering of warmer.run().
+    """
+    @patch("builtins.print")
+    def test_ranked_persons_go_first(self, mock_print):
+        """
+        Test that ranked persons are warmed before the listing and not warmed again when it lists them.
+        """
+        env = {"CORE_COUNT": 1, "SUBMIT_WINDOW": 1, "MAX_ATTEMPTS": 1, "PRIORITY_ITEMS": 50}
+        order = []
+        def warm(request_env, person_id):
+            order.append(person_id)
+            return retry.attempt_result(200)
+        listing = [("crew_001", None), ("crew_002", "tag2"), ("crew_003", None)]
+        with patch("fetch_request.fetch_request.iter_crew", return_value = listing), patch("fetch_request.fetch_request.warm_person", warm), \
+             patch("priority.priority.rank", return_value = [("crew_003", None)]):
+            result = warmer.run(env)
+
+        self.assertEqual(order, ["crew_003", "crew_001", "crew_002"])
+        self.assertEqual(result["listed"], 3)
+
+
+class TestTargeting(unittest.TestCase):
+    """
+    Unit tests for the TARGET_MODE=missing selection of warmer.run().
+    """
+    @patch("builtins.print")
+    def test_cached_persons_never_reach_the_engine(self, mock_print):
+        """
+        Test that cached persons are counted by the targeting but sent no request and not counted as one.
+        """
+        env = {"CORE_COUNT": 2, "MAX_ATTEMPTS": 1, "TARGET_MODE": "missing"}
+        listing = [("crew_001", None), ("crew_002", "tag2"), ("crew_003", "tag3")]
+        with patch("fetch_request.fetch_request.iter_crew", return_value = listing), \
+             patch("fetch_request.fetch_request.warm_person", return_value = retry.attempt_result(200)) as mock_warm_person:
+            result = warmer.run(env)
+
+        self.assertEqual([c.args[1] for c in mock_warm_person.call_args_list], ["crew_001"])
+        self.assertEqual(result["queued"], 1)
+        self.assertEqual(result["metrics"].report()["requests"]["total"], 1)
+        self.assertEqual(result["targeting"].counts, {"no_image": 1, "changed": 0, "cached": 2})
+
+
+class TestWarmer(unittest.TestCase):
+    """
+    Unit tests for the warmer.Warmer class.
+    """
+    def setUp(self):
+        self.env = {"API_KEY": "key", "BASE_URL": "https://jellyfin.example.com", "USER": "john", "USERID": "user",
+                    "CORE_COUNT": 2, "MAX_ATTEMPTS": 1, "STATE_DB": "", "JOURNAL": ""}
+
+
+    @patch("fetch_request.fetch_request.warm_person", warm_person)
+    @patch("builtins.print")
+    def test_cycles_reuse_the_pool(self, mock_print):
+        """
+        Test that cycles share one pool until the Warmer is closed.
+        """
+        with patch("fetch_request.fetch_request.iter_crew", return_value = [("crew_001", None), ("crew_002", "tag2")]):
+            with warmer.Warmer(self.env) as run_warmer:
+                first = run_warmer.warm()
+                pool = run_warmer.executor
+                second = run_warmer.warm()
+                self.assertIs(run_warmer.executor, pool)
+            self.assertIsNone(run_warmer.executor)
+        self.assertEqual(first[0][1]["warmed"], {"crew_001", "crew_002"})
+        self.assertEqual(second[0][1]["warmed"], {"crew_001", "crew_002"})
+
+
+    def test_overrides_reach_targets(self):
+        """
+        Test that overrides win over the configuration of every target and are validated.
+        """
+        env = {**self.env, "TARGETS": [{**self.env, "TARGET_NAME": "home"}]}
+        run_warmer = warmer.Warmer(env, {"ENGINE": "async"})
+        self.assertEqual((run_warmer.request_env["ENGINE"], run_warmer.request_env["TARGETS"][0]["ENGINE"]), ("async", "async"))
+        self.assertNotIn("ENGINE", env)
+        with self.assertRaises(warmer.load_env.ConfigError):
+            warmer.Warmer(self.env, {"SHARD": "0/2"})
+
+
+    def test_close_keeps_other_sessions(self):
+        """
+        Test that every Warmer's threads use its own sessions and closing one Warmer leaves the other's open.
+        """
+        first, second = warmer.Warmer(self.env), warmer.Warmer(self.env)
+        session = first.pool().submit(fetch_request.get_session, self.env).result()
+        self.assertEqual(first.sessions.sessions, [session])
+        with fetch_request.using_sessions(second.sessions):
+            other = fetch_request.get_session(self.env)
+        self.assertEqual(second.sessions.sessions, [other])
+        self.assertIsNot(fetch_request.get_session(self.env), other) # Bound for the with block only
+
+        first.close()
+        self.assertEqual(first.sessions.sessions, [])
+        self.assertIs(second.sessions.get(self.env), other)
+        second.close()
+
+
+    @patch("builtins.print")
+    def test_async_cycles_reuse_the_client(self, mock_print):
+        """
+        Test that the async engine opens its client once and keeps it for every cycle until the Warmer is closed.
+        """
+        server = fake_jellyfin.FakeJellyfin(persons = 5).start()
+        self.addCleanup(server.stop)
+        env = { **self.env, "BASE_URL": server.base_url, "ENGINE": "async", "ASYNC_CONCURRENCY": 4, "TIMEOUT": 5, "VERIFY_ROUNDS": 0 }
+        with patch("async_request.async_request.open_client", wraps = async_request.open_client) as mock_open_client:
+            with warmer.Warmer(env) as run_warmer:
+                for _ in range(2):
+                    self.assertEqual(len(run_warmer.warm()[0][1]["warmed"]), 5)
+                engine = run_warmer.engine
+            self.assertIsNone(run_warmer.engine)
+        self.assertEqual(mock_open_client.call_count, 1)
+        self.assertEqual(engine.clients, {})
@@ -0,0 +1,137 @@
+"""
+This module closes the loop after warming: a 200 does not mean the portrait got filled in, so the persons warmed without one
+are looked up again in bulk and only the ones still blank are warmed again, for up to VERIFY_ROUNDS rounds.
+"""
+import math
+import threading
+import time
+import requests
+from fetch_request import fetch_request
+from retry import retry
+from shard import shard
+
+LOOKUP_BATCH = 100 # Persons per bulk lookup request
+
+class Verification(shard.ShardResult):
+    """
+    Outcome of the verification pass, how many blank persons were checked, fixed, warmed again and which ones are still blank.
+    """
+    def __init__(self):
+        self.checked = 0 # Warmed persons that had no image tag in the listing
+        self.fixed = 0 # Got an image tag after warming
+        self.requeued = 0 # Warm requests sent again, over every round
+        self.rounds = 0 # Rounds that warmed someone again
+        self.lookups = 0 # Bulk requests spent checking
+        self.unfixed = {} # Crew ID to name, still without an image tag after the last round
+        self.lock = threading.Lock()
+
+
+    def merge(self, other: "Verification") -> None:
+        """
+        Add the verification of another run, such as a shard that ran in parallel.
+        Args:
+            other (Verification): The finished verification to add.
+        Returns:
+            None
+        """
+        with self.lock:
+            self.checked += other.checked
+            self.fixed += other.fixed
+            self.requeued += other.requeued
+            self.rounds = max(self.rounds, other.rounds)
+            self.lookups += other.lookups
+            self.unfixed.update(other.unfixed)
+
+
+    def summary(self, limit: int = 10) -> str:
+        """
+        Args:
+            limit (int): Persons still blank listed by name, the rest are only counted.
+        Returns:
+            str: One line with the counts and the persons that could not be fixed.
+        """
+        line = (f"{self.checked} warmed without a portrait, {self.fixed} got one, {self.requeued} warmed again over {self.rounds} rounds "
+                f"({self.lookups} lookups), {len(self.unfixed)} still blank")
+        if not self.unfixed:
+            return line + "."
+        names = [f"{name or 'Unknown'} ({person_id})" for person_id, name in sorted(self.unfixed.items(), key = lambda item: item[1] or "")]
+        more = f" and {len(names) - limit} more" if len(names) > limit else ""
+        return f"{line}: {', '.join(names[:limit])}{more}."
+
+
+def lookup(request_env: dict, ids: list, run_metrics = None) -> dict:
+    """
+    Look the image tags of many persons up, LOOKUP_BATCH per request, timing every request for the run metrics.
+    Args:
+        request_env (dict): The environment configuration.
+        ids (list): The crew/cast IDs to look up.
+        run_metrics (metrics.RunMetrics): Optional, records every lookup request.
+    Returns:
+        dict: Crew ID to (primary image tag or None, name), see fetch_request.get_image_tags().
+    Raises:
+        requests.RequestException: If a batch cannot be fetched.
+    """
+    tags = {}
+    for start in range(0, len(ids), LOOKUP_BATCH):
+        started = time.perf_counter()
+        try:
+            tags.update(fetch_request.get_image_tags(request_env, ids[start:start + LOOKUP_BATCH], LOOKUP_BATCH))
+        except requests.RequestException as e:
+            if run_metrics:
+                status = e.response.status_code if e.response is not None else None
+                run_metrics.record_attempt(time.perf_counter() - started, retry.attempt_result(status, str(e), exception = type(e).__name__))
+            raise
+        if run_metrics:
+            run_metrics.record_attempt(time.perf_counter() - started, retry.attempt_result(200))
+    return tags
+
+
+def verify(request_env: dict, crew: dict, warmed: set, warm, sleep = time.sleep, run_metrics = None) -> Verification:
+    """
+    Look the warmed persons without an image tag up again after VERIFY_DELAY seconds, warm the ones still blank again and repeat,
+    up to VERIFY_ROUNDS times, then check one last time. Persons that got a portrait have their new tag written to `crew`,
+    so STATE_DB stops warming them on every run.
+    Args:
+        request_env (dict): The environment configuration, reads VERIFY_ROUNDS and VERIFY_DELAY.
+        crew (dict): Crew ID to the image tag of the listing, updated in place.
+        warmed (set): The IDs warmed successfully this run.
+        warm (callable): Called with a list of IDs to warm again, returns the ones warmed successfully.
+        sleep (callable): Waits between warming and checking, overridden by tests.
+        run_metrics (metrics.RunMetrics): Optional, records every lookup request. `warm` records its own requests.
+    Returns:
+        Verification: The outcome.
+    """
+    rounds = request_env.get("VERIFY_ROUNDS", 0)
+    delay = request_env.get("VERIFY_DELAY", 0)
+    verification = Verification()
+    pending = [person_id for person_id in warmed if not crew.get(person_id)]
+    verification.checked = len(pending)
+    names = {}
+    for round_number in range(rounds + 1):
+        if not pending:
+            break
+        sleep(delay) # Jellyfin fetches the portrait in the background after the warm-up request
+        try:
+            tags = lookup(request_env, pending, run_metrics)
+        except requests.RequestException as e:
+            print(f"\nError verifying portraits: {e}")
+            break
+        verification.lookups += math.ceil(len(pending) / LOOKUP_BATCH)
+        still_blank = []
+        for person_id in pending:
+            if person_id not in tags:
+                continue # Removed from the library meanwhile
+            image_tag, names[person_id] = tags[person_id]
+            if image_tag:
+                crew[person_id] = image_tag
+                verification.fixed += 1
+            else:
+                still_blank.append(person_id)
+        pending = still_blank
+        if pending and round_number < rounds:
+            print(f"\nVerification round {round_number + 1}: {len(pending)} crew & cast still without a portrait, warming them again...")
+            verification.rounds += 1
+            verification.requeued += len(pending)
+            warm(pending)
+    verification.unfixed = { person_id: names.get(person_id) for person_id in pending }
+    return verification